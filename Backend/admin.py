@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
-from .models import Stock, ETF, Cryptocurrency
+from .models import Instrument, Stock, ETF, Cryptocurrency, FXRate, TargetAllocation
 
 # Custom Admin for User to display additional information
 class UserAdmin(admin.ModelAdmin):
@@ -28,3 +28,24 @@ class ETFAdmin(admin.ModelAdmin):
 class CryptocurrencyAdmin(admin.ModelAdmin):
     list_display = ('crypto_name', 'quantity', 'initial_purchase_price', 'current_price')
     search_fields = ('crypto_name',)
+
+
+# Admin for Instrument quotes
+@admin.register(Instrument)
+class InstrumentAdmin(admin.ModelAdmin):
+    list_display = ('symbol', 'asset_class', 'currency', 'last_price', 'quoted_at')
+    list_filter = ('asset_class',)
+    search_fields = ('symbol',)
+
+# Admin for exchange rates
+@admin.register(FXRate)
+class FXRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'rate', 'quoted_at')
+    search_fields = ('currency',)
+
+# Admin for rebalancing targets
+@admin.register(TargetAllocation)
+class TargetAllocationAdmin(admin.ModelAdmin):
+    list_display = ('portfolio', 'instrument', 'asset_class', 'weight')
+    list_filter = ('asset_class',)
+    raw_id_fields = ('portfolio', 'instrument')
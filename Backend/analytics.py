@@ -0,0 +1,157 @@
+'''
+Vectorized portfolio risk and return analytics.
+Price histories of every position are aligned into a single days x instruments matrix so weights,
+returns, volatility, drawdown, beta and correlations are computed with array operations rather than
+per-holding Python loops.
+'''
+
+import numpy as np
+from django.conf import settings
+
+from .timeseries import downsample
+
+DAY = 86400
+
+DEFAULT_ANALYTICS = {
+    'BENCHMARK': ('ETF', 'SPY'),
+    'RISK_FREE_RATE': 0.0,
+    'PERIODS_PER_YEAR': 252,
+}
+
+
+def analytics_settings():
+    return {**DEFAULT_ANALYTICS, **getattr(settings, 'ANALYTICS', {})}
+
+
+def load_daily_closes(store, instruments, start=None, end=None):
+    """
+    Reads daily closing prices for (asset_class, symbol) pairs into an aligned matrix.
+    Returns (days, closes, has_history) where days are epoch seconds at midnight UTC, closes is a
+    days x instruments float array and has_history flags instruments with at least one tick.
+    Gaps are forward filled and days before an instrument's first tick are back filled,
+    so an instrument contributes zero return until it starts trading.
+    """
+    bars = [downsample(store.range(asset_class, symbol, start, end), DAY) for asset_class, symbol in instruments]
+    has_history = np.array([len(series) > 0 for series in bars], dtype=bool)
+    if not has_history.any():
+        return np.empty(0, dtype=np.int64), np.empty((0, len(instruments))), has_history
+
+    days = np.unique(np.concatenate([series['t'] for series in bars]))
+    closes = np.full((len(days), len(instruments)), np.nan)
+    for column, series in enumerate(bars):
+        closes[np.searchsorted(days, series['t']), column] = series['close']
+    return days, fill_gaps(closes), has_history
+
+
+def fill_gaps(matrix):
+    """
+    Forward fills NaNs down each column, then back fills the leading NaNs.
+    Columns without any value are left as NaN.
+    """
+    rows = np.arange(len(matrix))[:, None]
+    last_seen = np.maximum.accumulate(np.where(np.isnan(matrix), 0, rows), axis=0)
+    filled = matrix[last_seen, np.arange(matrix.shape[1])]
+    valid = ~np.isnan(filled)
+    first_valid = np.where(valid.any(axis=0), valid.argmax(axis=0), 0)
+    leading = rows < first_valid
+    return np.where(leading, filled[first_valid, np.arange(matrix.shape[1])], filled)
+
+
+def simple_returns(prices):
+    """
+    Period over period returns along the first axis.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return prices[1:] / prices[:-1] - 1
+
+
+def max_drawdown(values):
+    """
+    Largest peak to trough decline of a value series, as a negative fraction.
+    """
+    if len(values) == 0:
+        return None
+    peaks = np.maximum.accumulate(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(peaks > 0, values / peaks - 1, 0)
+    return float(drawdowns.min())
+
+
+def betas(returns, benchmark_returns):
+    """
+    Beta of each column of `returns` (and of any 1-D series) against the benchmark returns.
+    """
+    centered_benchmark = benchmark_returns - benchmark_returns.mean()
+    variance = centered_benchmark @ centered_benchmark
+    if variance == 0:
+        return np.full(returns.shape[1:], np.nan)
+    return (centered_benchmark @ (returns - returns.mean(axis=0))) / variance
+
+
+def portfolio_analytics(closes, quantities, current_prices, benchmark_closes=None,
+                        risk_free_rate=0.0, periods_per_year=252, correlation=False):
+    """
+    Computes portfolio statistics from aligned closes (days x instruments), held quantities and
+    latest prices per instrument. Columns of `closes` that are entirely NaN are ignored in the
+    time-series statistics but still count towards weights.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    market_values = quantities * np.asarray(current_prices, dtype=float)
+    total_value = market_values.sum()
+    weights = market_values / total_value if total_value else np.zeros_like(market_values)
+
+    result = {
+        'total_value': float(total_value),
+        'weights': weights,
+        'observations': 0,
+        'volatility': None,
+        'annual_return': None,
+        'sharpe_ratio': None,
+        'max_drawdown': None,
+        'beta': None,
+        'holding_volatility': np.full(len(quantities), np.nan),
+        'holding_beta': np.full(len(quantities), np.nan),
+        'correlation': None,
+    }
+    priced = ~np.isnan(closes).all(axis=0) if closes.size else np.zeros(len(quantities), dtype=bool)
+    if len(closes) < 2 or not priced.any():
+        return result
+
+    values = np.nan_to_num(closes[:, priced]) @ quantities[priced]
+    portfolio_returns = simple_returns(values)
+    portfolio_returns = np.where(np.isfinite(portfolio_returns), portfolio_returns, 0)
+    asset_returns = np.nan_to_num(simple_returns(closes[:, priced]), nan=0, posinf=0, neginf=0)
+
+    # Dispersion needs at least two returns; with fewer, volatility, Sharpe ratio and betas are None
+    dispersed = len(portfolio_returns) > 1
+    volatility = portfolio_returns.std(ddof=1) * np.sqrt(periods_per_year) if dispersed else np.nan
+    annual_return = portfolio_returns.mean() * periods_per_year
+    result.update({
+        'observations': len(closes),
+        'volatility': finite_or_none(volatility),
+        'annual_return': finite_or_none(annual_return),
+        'sharpe_ratio': finite_or_none((annual_return - risk_free_rate) / volatility) if volatility > 0 else None,
+        'max_drawdown': max_drawdown(values),
+    })
+    if dispersed:
+        result['holding_volatility'][priced] = asset_returns.std(axis=0, ddof=1) * np.sqrt(periods_per_year)
+
+    if dispersed and benchmark_closes is not None and not np.isnan(benchmark_closes).all():
+        benchmark_returns = np.nan_to_num(simple_returns(benchmark_closes), nan=0, posinf=0, neginf=0)
+        result['beta'] = finite_or_none(betas(portfolio_returns, benchmark_returns))
+        result['holding_beta'][priced] = betas(asset_returns, benchmark_returns)
+
+    if correlation:
+        matrix = np.full((len(quantities), len(quantities)), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix[np.ix_(priced, priced)] = np.corrcoef(asset_returns, rowvar=False).reshape(priced.sum(), -1)
+        result['correlation'] = matrix
+    return result
+
+
+def finite_or_none(values):
+    """
+    Converts an array to nested lists with NaN and infinities replaced by None for JSON output.
+    """
+    array = np.asarray(values, dtype=float)
+    return np.where(np.isfinite(array), array, None).tolist()
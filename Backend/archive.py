@@ -0,0 +1,53 @@
+'''
+Append-only history written to the document store.
+Executed trades and quoted prices are copied to TradeEvent and PriceTick rows, which
+Backend/routers.py sends to DOCUMENT_ALIAS. Trades are still written to VirtualTrade on 'default'
+as well, so TradeEvent adds a write per trade instead of moving one off the relational database. Rows are queued on the transaction that produced them
+and written once it commits, in bulk inserts of BATCH_SIZE rows, so the document store never holds
+history of rolled back writes and a batch of trades or quotes costs one round trip per BATCH_SIZE.
+'''
+
+import logging
+
+from django.db import DatabaseError, transaction
+
+from .models import PriceTick, TradeEvent
+from .routers import storage_routing_settings
+
+logger = logging.getLogger(__name__)
+
+
+def write_documents(model, rows):
+    """
+    Bulk inserts `rows` of a document model. A document store outage is logged rather than raised,
+    as the relational writes the rows describe have already committed.
+    """
+    try:
+        model.objects.bulk_create(rows, batch_size=storage_routing_settings()['BATCH_SIZE'])
+    except DatabaseError:
+        logger.exception('Writing %d %s rows to the document store failed', len(rows), model.__name__)
+
+
+def archive(model, rows):
+    """
+    Writes `rows` once the current transaction on 'default' commits.
+    """
+    if rows:
+        transaction.on_commit(lambda: write_documents(model, rows))
+
+
+def archive_trades(trades):
+    archive(TradeEvent, [TradeEvent(user_id=trade.user_id, portfolio_id=trade.portfolio_id,
+                                    instrument_id=trade.instrument_id, asset_class=trade.instrument.asset_class,
+                                    symbol=trade.instrument.symbol, trade_type=trade.trade_type,
+                                    trade_quantity=trade.trade_quantity, trade_price=trade.trade_price,
+                                    trade_date=trade.trade_date)
+                         for trade in trades])
+
+
+def archive_quotes(quotes):
+    """
+    Archives (asset_class, symbol, price, quoted_at) quote tuples as price ticks.
+    """
+    archive(PriceTick, [PriceTick(asset_class=asset_class, symbol=symbol, price=price, quoted_at=quoted_at)
+                        for asset_class, symbol, price, quoted_at in quotes])
@@ -0,0 +1,225 @@
+'''
+Reproducible API benchmarks.
+generate_dataset() seeds users, portfolios, mixed holdings, trades and price history from a fixed
+random seed, and run_benchmarks() drives every GET route of the API router in-process, recording
+latency percentiles, query counts, rows returned and peak Python memory per endpoint. Results are
+plain JSON so two runs can be diffed, or checked against each other with compare_results().
+'''
+
+import json
+import random
+import secrets
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import django
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+from rest_framework.test import APIClient
+
+from .ledger import record_trades
+from .models import (UserProfile, Instrument, Portfolio, VirtualTrade, BlogPost, FAQ, HOLDING_MODELS,
+                     HOLDING_MODEL_BY_ASSET_CLASS)
+from .timeseries import to_epoch
+
+SCALES = {
+    'small': {'users': 5, 'portfolios': 2, 'holdings': 20, 'trades': 100, 'instruments': 30, 'history_days': 90},
+    'medium': {'users': 20, 'portfolios': 3, 'holdings': 100, 'trades': 1000, 'instruments': 200, 'history_days': 365},
+    'large': {'users': 50, 'portfolios': 5, 'holdings': 400, 'trades': 5000, 'instruments': 1000, 'history_days': 1260},
+}
+
+# Fixed clock so generated dates, and therefore responses, are the same on every run
+EPOCH = datetime(2024, 1, 2, tzinfo=dt_timezone.utc)
+
+
+def new_run_id():
+    """
+    Random prefix for generated usernames and symbols, so a run never collides with an earlier one.
+    Four hex digits keep the largest scale's symbols within the 10 character ticker fields.
+    """
+    return secrets.token_hex(2).upper()
+
+
+def generate_dataset(users=5, portfolios=2, holdings=20, trades=100, instruments=30, history_days=90,
+                     seed=0, history_store=None, run=None):
+    """
+    Creates a synthetic data set and returns the first user, a superuser that owns data like the rest.
+    `portfolios` is per user, `holdings` per portfolio and `trades` per user. Daily closes are written
+    to `history_store` when given. Usernames and symbols start with `run`, a random id by default, so
+    the data set can be generated into a database that already holds an earlier one.
+    """
+    rng = random.Random(seed)
+    run = run or new_run_id()
+    asset_classes = [asset_class for asset_class, _ in Instrument.ASSET_CLASS_CHOICES]
+    listed = Instrument.objects.bulk_create([
+        Instrument(asset_class=asset_classes[i % len(asset_classes)], symbol=f'{run}SYM{i}',
+                   last_price=Decimal(rng.randint(100, 100000)) / 100, quoted_at=EPOCH)
+        for i in range(instruments)])
+    listed = list(Instrument.objects.filter(symbol__in=[instrument.symbol for instrument in listed]).order_by('pk'))
+
+    owners = [User.objects.create_superuser(username=f'benchmark-{run}-0', password='benchmark')]
+    owners += User.objects.bulk_create([User(username=f'benchmark-{run}-{i}') for i in range(1, users)])
+    UserProfile.objects.bulk_create([UserProfile(user=user, email=f'{user.username}@example.com',
+                                                 age=rng.randint(18, 90)) for user in owners])
+    Portfolio.objects.bulk_create([Portfolio(user=user, name=f'Portfolio {i}')
+                                   for user in owners for i in range(portfolios)])
+    books = list(Portfolio.objects.filter(user__in=owners).order_by('pk'))
+
+    lots = {model: [] for model in HOLDING_MODELS}
+    for portfolio in books:
+        for _ in range(holdings):
+            instrument = rng.choice(listed)
+            model = HOLDING_MODEL_BY_ASSET_CLASS[instrument.asset_class]
+            lots[model].append(model(portfolio=portfolio, instrument=instrument, quantity=rng.randint(1, 500),
+                                     initial_purchase_price=Decimal(rng.randint(100, 100000)) / 100,
+                                     purchase_date=EPOCH - timedelta(days=rng.randint(0, 1000)),
+                                     **{model.symbol_field: instrument.symbol}))
+    for model, objects in lots.items():
+        model.objects.bulk_create(objects, batch_size=5000)
+
+    books_by_user = {}
+    for portfolio in books:
+        books_by_user.setdefault(portfolio.user_id, []).append(portfolio)
+    history = [VirtualTrade(user=user, portfolio=rng.choice(books_by_user[user.pk]), instrument=rng.choice(listed),
+                            trade_type='BUY', trade_quantity=rng.randint(1, 100),
+                            trade_price=Decimal(rng.randint(100, 100000)) / 100)
+               for user in owners for _ in range(trades)]
+    record_trades(VirtualTrade.objects.bulk_create(history, batch_size=5000))
+
+    BlogPost.objects.bulk_create([BlogPost(author=owners[0], title=f'Post {i}', content='Lorem ipsum ' * 50)
+                                  for i in range(20)])
+    FAQ.objects.bulk_create([FAQ(question=f'Question {i}?', answer='Answer.') for i in range(20)])
+
+    if history_store is not None and history_days:
+        walk = np.random.default_rng(seed)
+        days = to_epoch(EPOCH) - np.arange(history_days, 0, -1, dtype=np.int64) * 86400
+        for instrument in listed:
+            closes = float(instrument.last_price) * np.exp(np.cumsum(walk.normal(0, 0.02, history_days)))
+            history_store.append(instrument.asset_class, instrument.symbol, days, closes)
+    return owners[0]
+
+
+def router_endpoints(router, user):
+    """
+    Lists (name, url) for the list, detail and extra GET routes of every registered viewset.
+    Detail routes use the lowest primary key the user can see.
+    """
+    endpoints = []
+    for prefix, viewset, basename in router.registry:
+        model = viewset.queryset.model
+        objects = model.objects.order_by('pk')
+        if any(field.name == 'user' for field in model._meta.get_fields()):
+            objects = objects.filter(user=user)
+        pk = objects.values_list('pk', flat=True).first()
+
+        routes = [('list', False), ('detail', True)]
+        routes += [(action.url_name, action.detail) for action in viewset.get_extra_actions() if 'get' in action.mapping]
+        for url_name, detail in routes:
+            if detail and pk is None:
+                continue
+            try:
+                url = reverse(f'{basename}-{url_name}', args=[pk] if detail else [])
+            except NoReverseMatch:
+                continue
+            endpoints.append((f'{basename}-{url_name}', url))
+    return endpoints
+
+
+def count_rows(response):
+    if response.streaming:
+        return b''.join(response.streaming_content).count(b'\n')
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict):
+        for key in ('results', 'points', 'holdings'):
+            if isinstance(data.get(key), list):
+                return len(data[key])
+        return 1
+    return len(data) if isinstance(data, list) else 0
+
+
+def measure(client, url, iterations, warmup=2):
+    """
+    Requests `url` repeatedly and returns its latency percentiles, queries, rows and peak memory.
+    """
+    for _ in range(warmup):
+        response = client.get(url)
+        count_rows(response)
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = client.get(url)
+        rows = count_rows(response)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            count_rows(client.get(url))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        'status': response.status_code,
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'queries': len(queries),
+        'rows': rows,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(router, user, iterations=20, only=None):
+    """
+    Benchmarks every GET route of `router` as `user` and returns {endpoint name: metrics}.
+    """
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return {name: measure(client, url, iterations) for name, url in router_endpoints(router, user)
+            if only is None or any(pattern in name for pattern in only)}
+
+
+def results_document(endpoints, scale, seed, iterations):
+    return {
+        'meta': {'scale': scale, 'seed': seed, 'iterations': iterations, 'database': connection.vendor,
+                 'django': django.get_version()},
+        'endpoints': endpoints,
+    }
+
+
+def compare_results(baseline, current, threshold=1.25):
+    """
+    Lists regressions of `current` against `baseline` results: a p95 latency more than `threshold`
+    times slower, more queries, or an endpoint that now fails.
+    """
+    regressions = []
+    for name, metrics in sorted(current['endpoints'].items()):
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        if metrics['status'] >= 400 > before['status']:
+            regressions.append(f'{name}: status {before["status"]} -> {metrics["status"]}')
+        if metrics['queries'] > before['queries']:
+            regressions.append(f'{name}: queries {before["queries"]} -> {metrics["queries"]}')
+        if before['p95_ms'] and metrics['p95_ms'] > before['p95_ms'] * threshold:
+            regressions.append(f'{name}: p95 {before["p95_ms"]} ms -> {metrics["p95_ms"]} ms')
+    return regressions
+
+
+def load_results(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def write_results(path, document):
+    with open(path, 'w') as handle:
+        json.dump(document, handle, indent=2, sort_keys=True)
+        handle.write('\n')
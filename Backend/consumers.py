@@ -0,0 +1,135 @@
+'''
+Streams of portfolio values and holding prices, over WebSocket and server-sent events.
+Both transports authenticate with the session, take an optional ?portfolios=1,2 filter, send a
+snapshot on connect and then coalesced updates from Backend/streaming.py, including the values of
+portfolios whose holdings changed after trades or imports.
+'''
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.exceptions import StopConsumer
+from channels.generic.http import AsyncHttpConsumer
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .streaming import HOLDINGS_GROUP, PRICE_GROUP, load_positions, load_tracker, parse_prices, streaming_settings
+
+
+class PortfolioStreamMixin:
+    """
+    Subscription logic shared by the stream consumers. Subclasses implement push(message).
+    """
+    tracker = None
+    flusher = None
+
+    def requested_portfolios(self):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('portfolios')
+        if not values:
+            return None
+        return [int(value) for value in ','.join(values).split(',') if value.strip()]
+
+    async def subscribe(self):
+        """
+        Loads the tracker and joins the price group. Returns an HTTP style status code on failure.
+        """
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            return 401
+        try:
+            portfolio_ids = self.requested_portfolios()
+        except ValueError:
+            return 400
+        self.tracker = await database_sync_to_async(load_tracker)(user, portfolio_ids)
+        if self.tracker is None:
+            return 404
+        if self.channel_layer is not None:
+            await self.channel_layer.group_add(PRICE_GROUP, self.channel_name)
+            await self.channel_layer.group_add(HOLDINGS_GROUP, self.channel_name)
+        options = streaming_settings()
+        self.flusher = asyncio.create_task(self.flush_periodically(options['COALESCE_WINDOW'], options['HEARTBEAT']))
+        return None
+
+    async def unsubscribe(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        if self.tracker is not None and self.channel_layer is not None:
+            await self.channel_layer.group_discard(PRICE_GROUP, self.channel_name)
+            await self.channel_layer.group_discard(HOLDINGS_GROUP, self.channel_name)
+
+    async def prices_changed(self, event):
+        if self.tracker is not None:
+            self.tracker.apply(parse_prices(event['prices']))
+
+    async def holdings_changed(self, event):
+        if self.tracker is None:
+            return
+        portfolio_ids = [portfolio_id for portfolio_id in event['portfolios'] if portfolio_id in self.tracker.values]
+        if portfolio_ids:
+            loaded = await database_sync_to_async(load_positions)(portfolio_ids, self.tracker.currency)
+            self.tracker.replace_positions(*loaded)
+
+    async def flush_periodically(self, window, heartbeat):
+        last_sent = time.monotonic()
+        while True:
+            await asyncio.sleep(window)
+            update = self.tracker.flush()
+            if update is not None:
+                await self.push(update)
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                await self.keepalive()
+                last_sent = time.monotonic()
+
+    async def keepalive(self):
+        pass
+
+
+class PortfolioValueConsumer(PortfolioStreamMixin, AsyncJsonWebsocketConsumer):
+    """
+    WebSocket stream of portfolio values. Rejected connections close with 4000 + the status code.
+    """
+    async def connect(self):
+        error = await self.subscribe()
+        if error is not None:
+            await self.close(code=4000 + error)
+            return
+        await self.accept()
+        await self.send_json(self.tracker.snapshot())
+
+    async def disconnect(self, code):
+        await self.unsubscribe()
+
+    async def push(self, message):
+        await self.send_json(message)
+
+
+class PortfolioValueEventStream(PortfolioStreamMixin, AsyncHttpConsumer):
+    """
+    Server-sent event stream of portfolio values, for clients that cannot open WebSockets.
+    """
+    async def http_request(self, message):
+        # AsyncHttpConsumer stops once handle() returns, so open the stream here instead and keep
+        # the consumer running, receiving price events, until the client disconnects
+        if message.get('more_body'):
+            return
+        error = await self.subscribe()
+        if error is not None:
+            await self.send_response(error, json.dumps({'detail': 'Unable to open the stream.'}).encode(),
+                                     headers=[(b'Content-Type', b'application/json')])
+            raise StopConsumer()
+        await self.send_headers(headers=[(b'Content-Type', b'text/event-stream'), (b'Cache-Control', b'no-cache'),
+                                         (b'X-Accel-Buffering', b'no')])
+        await self.push(self.tracker.snapshot())
+
+    async def disconnect(self):
+        await self.unsubscribe()
+
+    async def push(self, message):
+        await self.send_body(f'event: {message["type"]}\ndata: {json.dumps(message)}\n\n'.encode(), more_body=True)
+
+    async def keepalive(self):
+        await self.send_body(b': keep-alive\n\n', more_body=True)
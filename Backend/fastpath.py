@@ -0,0 +1,198 @@
+'''
+Fast read-only serialization for hot list and detail endpoints.
+A ModelSerializer is compiled once into a plan of (output key, values() column, converter) steps, so
+a page is fetched with QuerySet.values() and rendered without building model instances or walking
+DRF's per-field attribute lookup for every row. Converters reuse the serializer's own fields where
+formatting matters (decimals, datetimes), so the output is identical to the DRF path.
+'''
+
+import decimal
+from datetime import timezone as dt_timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import ISO_8601, permissions, relations, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .pricecache import get_price_cache
+from .profiling import timed
+from .serializers import CachedPriceField
+
+# Fields whose representation of a column value is the value itself
+PASSTHROUGH_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.ChoiceField,
+                      serializers.BooleanField, serializers.ReadOnlyField, relations.PrimaryKeyRelatedField)
+
+# Step kinds
+PASS, CONVERT, DATETIME, NESTED = range(4)
+
+
+def decimal_converter(field):
+    """
+    Returns a function formatting decimals like DecimalField.to_representation(), with the
+    quantize exponent and context built once instead of per value.
+    """
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.decimal_places is None or field.localize or not coerce_to_string:
+        return serializers.DecimalField.to_representation.__get__(field)
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+    return convert
+
+
+def cached_price_converter(field):
+    """
+    Returns a function rendering an instrument id as its cached price, like CachedPriceField.
+    """
+    fmt = decimal_converter(field)
+
+    def convert(instrument_id):
+        price = get_price_cache().get(instrument_id)
+        return None if price is None else fmt(price)
+    return convert
+
+
+def iso_datetime(value, tz):
+    """
+    Formats a datetime like DateTimeField.to_representation() with the default ISO 8601 output.
+    """
+    if tz is not None:
+        value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, dt_timezone.utc)
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+class SerializerPlan:
+    """
+    Precompiled rendering plan for one serializer class.
+    `columns` are the values() names to fetch; serialize() turns those row dicts into the
+    serializer's output, in the same field order. Nested model serializers become sub-plans over
+    columns prefixed with the relation name.
+    """
+    def __init__(self, serializer_class, prefix=''):
+        self.serializer_class = serializer_class
+        self.steps = []
+        self.columns = []
+        self.cached_price_columns = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            self.steps.append(self.compile_field(name, field, prefix))
+
+    def compile_field(self, name, field, prefix):
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} has no column to read.')
+        column = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.ModelSerializer):
+            nested = SerializerPlan(type(field), prefix=column + '__')
+            self.columns.append(column)
+            self.columns.extend(nested.columns)
+            self.cached_price_columns.extend(nested.cached_price_columns)
+            return name, column, NESTED, nested
+        if isinstance(field, serializers.BaseSerializer):
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} is not a single related object.')
+        self.columns.append(column)
+
+        if isinstance(field, CachedPriceField):
+            self.cached_price_columns.append(column)
+            return name, column, CONVERT, cached_price_converter(field)
+        if isinstance(field, serializers.DecimalField):
+            return name, column, CONVERT, decimal_converter(field)
+        if (type(field) is serializers.DateTimeField and not hasattr(field, 'timezone')
+                and (getattr(field, 'format', api_settings.DATETIME_FORMAT) or '').lower() == ISO_8601):
+            return name, column, DATETIME, None
+        if isinstance(field, PASSTHROUGH_FIELDS):
+            return name, column, PASS, None
+        return name, column, CONVERT, field.to_representation
+
+    def render(self, row, tz=None):
+        """
+        Renders one values() row dict. `tz` is the output timezone, resolved once per page.
+        """
+        output = {}
+        for name, column, kind, convert in self.steps:
+            value = row[column]
+            if value is None or kind == PASS:
+                output[name] = value
+            elif kind == DATETIME:
+                output[name] = iso_datetime(value, tz)
+            elif kind == NESTED:
+                # Nested serializers read their own prefixed columns from the same row
+                output[name] = convert.render(row, tz)
+            else:
+                output[name] = convert(value)
+        return output
+
+    def serialize(self, rows):
+        """
+        Renders a list of values() row dicts.
+        """
+        with timed('serialize'):
+            return self.render_rows(rows)
+
+    def render_rows(self, rows):
+        if self.cached_price_columns:
+            get_price_cache().get_many({row[column] for row in rows for column in self.cached_price_columns
+                                        if row[column] is not None})
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        render = self.render
+        return [render(row, tz) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    return SerializerPlan(serializer_class)
+
+
+class FastReadMixin:
+    """
+    Serves list and retrieve of a viewset from values() rows rendered by a compiled plan of its
+    serializer, instead of model instances and ModelSerializer. Viewsets opt in with
+    `fast_read = True`; views with object level permissions always use the DRF path.
+    """
+    fast_read = False
+
+    def use_fast_read(self):
+        return self.fast_read and all(
+            type(permission).has_object_permission is permissions.BasePermission.has_object_permission
+            for permission in self.get_permissions())
+
+    def fast_plan(self):
+        return compile_serializer(self.get_serializer_class())
+
+    def fast_values(self, queryset, plan):
+        # Keyset pagination reads its cursor from the ordering fields of each row
+        ordering = [name.lstrip('-') for name in getattr(self, 'keyset_ordering', ())]
+        return queryset.values(*dict.fromkeys(plan.columns + ordering))
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().list(request, *args, **kwargs)
+        plan = self.fast_plan()
+        rows = self.fast_values(self.filter_queryset(self.get_queryset()), plan)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(plan.serialize(list(page)))
+        return Response(plan.serialize(list(rows)))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().retrieve(request, *args, **kwargs)
+        plan = self.fast_plan()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(self.fast_values(self.filter_queryset(self.get_queryset()), plan),
+                                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(plan.serialize([row])[0])
@@ -0,0 +1,145 @@
+'''
+Currency conversion of valuations and holdings.
+FXRate rows quote each currency in the PIVOT currency. A ConversionMatrix holds every cross rate as
+matrix[source, target], so a result set of amounts in mixed currencies is converted in one NumPy
+step: the few distinct currency codes are looked up once, not per row. With a response cache, each
+process keeps the matrix it built for the current version of the FX_RATES scope, which rate writes in
+any process bump, so a response stored under a version is always converted with that version's
+rates. Without one, the matrix is loaded from FXRate on every use. Conversions only read it when
+some amount is not already in the target currency.
+'''
+
+import threading
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_FX = {
+    # Currency every FXRate is quoted in
+    'PIVOT': 'USD',
+    # Currency of valuations when neither the request nor the user's profile names one
+    'BASE_CURRENCY': 'USD',
+}
+
+CENTS = Decimal('0.01')
+
+
+def fx_settings():
+    return {**DEFAULT_FX, **getattr(settings, 'FX', {})}
+
+
+def load_rates():
+    """
+    Loads {currency: units of PIVOT per unit} from FXRate in a single query.
+    """
+    from .models import FXRate
+    return dict(FXRate.objects.values_list('currency', 'rate'))
+
+
+class ConversionMatrix:
+    """
+    Cross rates between every currency with a rate, indexed by currency code.
+    """
+    def __init__(self, rates, pivot='USD'):
+        self.quotes = {**{currency: Decimal(str(rate)) for currency, rate in rates.items()}, pivot: Decimal('1')}
+        self.currencies = sorted(self.quotes)
+        self.index = {currency: position for position, currency in enumerate(self.currencies)}
+        to_pivot = np.array([float(self.quotes[currency]) for currency in self.currencies], dtype=float)
+        self.matrix = to_pivot[:, None] / to_pivot[None, :]
+
+    def rate(self, source, target):
+        """
+        Units of `target` per unit of `source`, or None when either has no rate.
+        """
+        if source not in self.index or target not in self.index:
+            return None
+        return float(self.matrix[self.index[source], self.index[target]])
+
+    def exact_rate(self, source, target):
+        """
+        Units of `target` per unit of `source` as a Decimal from the quoted rates, for money that is
+        summed exactly, or None when either has no rate.
+        """
+        if source not in self.quotes or target not in self.quotes:
+            return None
+        return self.quotes[source] / self.quotes[target]
+
+    def factors(self, currencies, target):
+        """
+        Returns the (N,) rates converting amounts in `currencies` to `target`, NaN where unknown.
+        """
+        codes, inverse = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+        column = self.index.get(target)
+        rates = np.array([np.nan if column is None or code not in self.index else self.matrix[self.index[code], column]
+                          for code in codes.tolist()], dtype=float)
+        return rates[inverse]
+
+    def convert(self, amounts, currencies, target):
+        """
+        Converts aligned arrays of amounts and currency codes to `target`; unknown currencies give NaN.
+        """
+        return np.asarray(amounts, dtype=float) * self.factors(currencies, target)
+
+
+def convert_amounts(amounts, currencies, target, matrix=None):
+    """
+    Converts aligned sequences of amounts and currency codes to `target` as a float array, NaN where a
+    currency has no rate. The conversion matrix is only read when some amount is in another currency.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    if all(currency == target for currency in currencies):
+        return amounts
+    return (matrix or get_conversion_matrix()).convert(amounts, currencies, target)
+
+
+def convert_records(records, conversions, target, matrix=None):
+    """
+    Converts dict records in place to `target`. `conversions` maps the key holding a currency code to
+    the amount fields in that currency; converted amounts are Decimals rounded to cents, and amounts
+    that cannot be converted become None.
+    """
+    currencies = {key: [record[key] for record in records] for key in conversions}
+    if all(currency == target for codes in currencies.values() for currency in codes):
+        return records
+    matrix = matrix or get_conversion_matrix()
+    for key, fields in conversions.items():
+        factors = matrix.factors(currencies[key], target)
+        for field in fields:
+            amounts = np.array([np.nan if record[field] is None else float(record[field]) for record in records])
+            for record, amount in zip(records, (amounts * factors).tolist()):
+                record[field] = None if np.isnan(amount) else Decimal(repr(amount)).quantize(CENTS)
+    return records
+
+
+_matrix = None
+_matrix_version = None
+_matrix_lock = threading.Lock()
+
+
+def get_conversion_matrix():
+    """
+    Returns the conversion matrix of the current rates, reused while the FX_RATES scope version is
+    unchanged, or loaded afresh when response caching is disabled.
+    """
+    global _matrix, _matrix_version
+    from .responsecache import FX_RATES, get_response_cache
+    pivot = fx_settings()['PIVOT']
+    cache = get_response_cache()
+    if cache is None:
+        return ConversionMatrix(load_rates(), pivot=pivot)
+    version = cache.versions([FX_RATES])[FX_RATES]
+    with _matrix_lock:
+        if _matrix is None or _matrix_version != version:
+            _matrix = ConversionMatrix(load_rates(), pivot=pivot)
+            _matrix_version = version
+        return _matrix
+
+
+def reset_conversion_matrix():
+    """
+    Discards the conversion matrix so the next use reloads FXRate.
+    """
+    global _matrix
+    with _matrix_lock:
+        _matrix = None
@@ -0,0 +1,233 @@
+'''
+Bulk import of mixed Stock, ETF and Cryptocurrency holdings from CSV, NDJSON or a JSON list.
+Rows are validated in batches with plain field parsing instead of a serializer per row. Each batch
+resolves its portfolios and instruments with a couple of set based queries and is written with one
+bulk_create per asset class, so importing is bound by the insert throughput of the database.
+
+Every row needs portfolio, asset_class, symbol, quantity and initial_purchase_price; purchase_date
+is an optional ISO 8601 date or timestamp and defaults to the time of the import, and currency is
+the optional currency of the purchase price, the instrument's quote currency by default.
+'''
+
+import csv
+import json
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Instrument, Portfolio, HOLDING_MODEL_BY_ASSET_CLASS, validate_currency_code
+from .responsecache import invalidate_portfolios
+from .snapshots import record_snapshots_on_commit
+from .streaming import publish_holdings_on_commit
+
+IMPORT_FIELDS = ('portfolio', 'asset_class', 'symbol', 'quantity', 'initial_purchase_price', 'purchase_date', 'currency')
+MAX_PRICE = Decimal('1e8')
+
+
+def read_records(handle, file_format):
+    """
+    Yields row dicts from an open text file in csv or ndjson format.
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(handle)
+        return
+    for line_number, line in enumerate(handle, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise ValueError(f'Line {line_number}: invalid JSON ({exc}).')
+
+
+def parse_purchase_date(value, default):
+    if value in (None, ''):
+        return default
+    parsed = parse_date(value) if len(value) == 10 else parse_datetime(value)
+    if parsed is None:
+        raise ValueError
+    if not isinstance(parsed, datetime):
+        parsed = datetime.combine(parsed, time.min)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def parse_integer(value):
+    """
+    Parses a whole number the way IntegerField does: "2" and 2.0 are accepted, while 1.5 or "0.25"
+    raise ValueError instead of being truncated.
+    """
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(value)
+    if not number.is_finite() or number != number.to_integral_value():
+        raise ValueError(value)
+    return int(number)
+
+
+def clean_row(record, default_date):
+    """
+    Parses one row into holding field values. Returns (values, errors); errors maps field names
+    to messages in the same shape as serializer errors.
+    """
+    if not isinstance(record, dict):
+        return None, {'non_field_errors': ['Expected an object.']}
+    errors = {}
+    values = {}
+
+    try:
+        values['portfolio'] = parse_integer(record['portfolio'])
+    except (KeyError, TypeError, ValueError):
+        errors['portfolio'] = ['A valid integer is required.']
+
+    asset_class = str(record.get('asset_class') or '').upper()
+    model = HOLDING_MODEL_BY_ASSET_CLASS.get(asset_class)
+    if model is None:
+        errors['asset_class'] = [f'Expected one of: {", ".join(HOLDING_MODEL_BY_ASSET_CLASS)}.']
+    values['asset_class'] = asset_class
+
+    symbol = str(record.get('symbol') or '').strip()
+    if not symbol:
+        errors['symbol'] = ['This field is required.']
+    elif model is not None and len(symbol) > model._meta.get_field(model.symbol_field).max_length:
+        errors['symbol'] = [f'Ensure this field has no more than '
+                            f'{model._meta.get_field(model.symbol_field).max_length} characters.']
+    values['symbol'] = symbol
+
+    try:
+        values['quantity'] = parse_integer(record['quantity'])
+        if values['quantity'] < 1:
+            errors['quantity'] = ['Ensure this value is greater than or equal to 1.']
+    except (KeyError, TypeError, ValueError):
+        errors['quantity'] = ['A valid integer is required.']
+
+    try:
+        price = Decimal(str(record['initial_purchase_price']))
+        if not price.is_finite() or price < 0 or price >= MAX_PRICE or price.as_tuple().exponent < -2:
+            errors['initial_purchase_price'] = ['Ensure this is a non-negative amount with at most 2 decimal places.']
+        values['initial_purchase_price'] = price
+    except (KeyError, InvalidOperation):
+        errors['initial_purchase_price'] = ['A valid number is required.']
+
+    try:
+        values['purchase_date'] = parse_purchase_date(record.get('purchase_date'), default_date)
+    except (TypeError, ValueError):
+        errors['purchase_date'] = ['Expected an ISO 8601 date or timestamp.']
+
+    values['currency'] = str(record.get('currency') or '').strip().upper()
+    if values['currency']:
+        try:
+            validate_currency_code(values['currency'])
+        except ValidationError as exc:
+            errors['currency'] = exc.messages
+    return values, errors
+
+
+class HoldingsImport:
+    """
+    Imports holding rows batch by batch. Portfolios outside `portfolios` (a queryset, all portfolios
+    by default) are reported as row errors. Instruments that do not exist yet are created unpriced.
+    """
+    def __init__(self, portfolios=None, batch_size=5000):
+        self.portfolios = portfolios if portfolios is not None else Portfolio.objects.all()
+        self.batch_size = batch_size
+        self.allowed_portfolios = {}
+        self.instruments = {}
+        self.created = 0
+        self.errors = {}
+        self.partial = False
+
+    def run(self, records, partial=False):
+        """
+        Imports all records, numbering rows from 1. Unless `partial` is set nothing is written when
+        any row is rejected. Returns (created, errors) with errors keyed by row number.
+        """
+        self.partial = partial
+        records = iter(records)
+        now = timezone.now()
+        with transaction.atomic():
+            row_number = 1
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(row_number, batch, now)
+                row_number += len(batch)
+            if self.errors and not partial:
+                transaction.set_rollback(True)
+                self.created = 0
+        return self.created, self.errors
+
+    def import_batch(self, first_row, batch, default_date):
+        rows = []
+        for row_number, record in enumerate(batch, start=first_row):
+            values, errors = clean_row(record, default_date)
+            if errors:
+                self.errors[row_number] = errors
+            else:
+                rows.append((row_number, values))
+
+        self.resolve_portfolios({values['portfolio'] for _, values in rows})
+        valid = []
+        for row_number, values in rows:
+            if self.allowed_portfolios[values['portfolio']]:
+                valid.append(values)
+            else:
+                self.errors[row_number] = {'portfolio': ['Unknown portfolio.']}
+        if self.errors and not self.partial:
+            # The import will be rolled back, so only keep validating the remaining rows
+            return
+        self.resolve_instruments({(values['asset_class'], values['symbol']) for values in valid})
+
+        holdings = {}
+        for values in valid:
+            model = HOLDING_MODEL_BY_ASSET_CLASS[values['asset_class']]
+            holdings.setdefault(model, []).append(model(
+                portfolio_id=values['portfolio'],
+                instrument_id=self.instruments[(values['asset_class'], values['symbol'])],
+                quantity=values['quantity'],
+                initial_purchase_price=values['initial_purchase_price'],
+                purchase_date=values['purchase_date'],
+                currency=values['currency'],
+                **{model.symbol_field: values['symbol']}))
+        for model, objects in holdings.items():
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+            self.created += len(objects)
+        # Only takes effect if the import commits
+        portfolio_ids = {values['portfolio'] for values in valid}
+        invalidate_portfolios(portfolio_ids)
+        record_snapshots_on_commit(portfolio_ids)
+        publish_holdings_on_commit(portfolio_ids)
+
+    def resolve_portfolios(self, portfolio_ids):
+        missing = portfolio_ids - self.allowed_portfolios.keys()
+        if not missing:
+            return
+        found = set(self.portfolios.filter(pk__in=missing).values_list('pk', flat=True))
+        self.allowed_portfolios.update({portfolio_id: portfolio_id in found for portfolio_id in missing})
+
+    def resolve_instruments(self, keys):
+        missing = keys - self.instruments.keys()
+        if not missing:
+            return
+        Instrument.objects.bulk_create([Instrument(asset_class=asset_class, symbol=symbol)
+                                        for asset_class, symbol in missing], ignore_conflicts=True)
+        for pk, asset_class, symbol in (Instrument.objects.filter(symbol__in={symbol for _, symbol in missing})
+                                        .values_list('pk', 'asset_class', 'symbol')):
+            if (asset_class, symbol) in missing:
+                self.instruments[(asset_class, symbol)] = pk
+
+
+def import_holdings(records, portfolios=None, batch_size=5000, partial=False):
+    """
+    Convenience wrapper around HoldingsImport.run().
+    """
+    return HoldingsImport(portfolios, batch_size).run(records, partial=partial)
@@ -0,0 +1,67 @@
+'''
+Position ledger derived from VirtualTrade.
+Each trade moves one (user, instrument) Position: buys re-average the cost basis and sells realize
+profit or loss against it. Keeping these rows current as trades are written makes position and P&L
+lookups single row reads instead of aggregations over the whole trade history.
+'''
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Position
+
+COST_QUANTUM = Decimal('0.0001')
+PNL_QUANTUM = Decimal('0.01')
+
+
+def apply_trade(position, trade_type, quantity, price):
+    """
+    Applies one fill to an in-memory Position.
+    """
+    if trade_type == 'BUY':
+        total_quantity = position.quantity + quantity
+        if total_quantity:
+            cost = position.quantity * position.average_cost + quantity * price
+            position.average_cost = (cost / total_quantity).quantize(COST_QUANTUM)
+        position.quantity = total_quantity
+    else:
+        position.realized_pnl = (position.realized_pnl + (price - position.average_cost) * quantity).quantize(PNL_QUANTUM)
+        position.quantity -= quantity
+        if position.quantity == 0:
+            position.average_cost = Decimal('0')
+
+
+def save_positions(positions):
+    """
+    Writes positions with one bulk upsert on (user, instrument).
+    """
+    now = timezone.now()
+    for position in positions:
+        position.updated_at = now
+    Position.objects.bulk_create(positions, update_conflicts=True, unique_fields=['user', 'instrument'],
+                                 update_fields=['quantity', 'average_cost', 'realized_pnl', 'updated_at'])
+
+
+def record_trades(trades):
+    """
+    Folds newly written trades into their positions. The affected positions are locked
+    for the duration of the caller's transaction so concurrent writers apply in turn.
+    """
+    if not trades:
+        return
+    with transaction.atomic():
+        pairs = sorted({(trade.user_id, trade.instrument_id) for trade in trades})
+        # Locks only reach existing rows, so missing positions are inserted first. An insert racing
+        # another transaction's waits for it to finish, and the lock then reads its committed row.
+        Position.objects.bulk_create([Position(user_id=user, instrument_id=instrument) for user, instrument in pairs],
+                                     ignore_conflicts=True)
+        positions = {(position.user_id, position.instrument_id): position for position in
+                     Position.objects.select_for_update()
+                     .filter(user__in={user for user, _ in pairs}, instrument__in={instrument for _, instrument in pairs})
+                     .order_by('pk')}
+        for trade in trades:
+            apply_trade(positions[(trade.user_id, trade.instrument_id)], trade.trade_type, trade.trade_quantity,
+                        trade.trade_price)
+        save_positions([positions[pair] for pair in pairs])
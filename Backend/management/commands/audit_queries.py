@@ -0,0 +1,42 @@
+'''
+Audits the query plans of every API viewset against a freshly generated data set.
+The data set is created inside a transaction that is rolled back afterwards, like benchmark_api.
+The command fails when a filtered query reads a whole table instead of using an index.
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Backend.benchmark import SCALES, generate_dataset
+from Backend.queryaudit import UnsupportedDatabase, audit_queries
+from Backend.urls import router
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queryset of every viewset and filter, failing on full table scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='small', help='Size of the generated data set.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data generator.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = generate_dataset(seed=options['seed'], history_days=0, **{
+                    key: value for key, value in SCALES[options['scale']].items() if key != 'history_days'})
+                results = audit_queries(router, user)
+                transaction.set_rollback(True)
+        except UnsupportedDatabase as exc:
+            raise CommandError(str(exc))
+
+        failures = 0
+        for name, (steps, scans) in results.items():
+            plan = ', '.join(str(step) for step in steps)
+            if scans:
+                failures += 1
+                self.stderr.write(f'{name:<40}FULL SCAN  {plan}')
+            else:
+                self.stdout.write(f'{name:<40}ok         {plan}')
+        if failures:
+            raise CommandError(f'{failures} of {len(results)} queries scan full tables.')
+        self.stdout.write(self.style.SUCCESS(f'All {len(results)} queries use indexes.'))
@@ -0,0 +1,74 @@
+'''
+Runs the API benchmark suite against a freshly generated data set.
+The data set is created inside a transaction that is rolled back afterwards and its price history
+goes to a temporary directory, so the command leaves the database and history store untouched.
+Results are written as JSON and can be checked against a baseline run for regressions.
+'''
+
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from Backend.benchmark import (SCALES, compare_results, generate_dataset, load_results, results_document,
+                               run_benchmarks, write_results)
+from Backend.pricecache import reset_price_cache
+from Backend.timeseries import PriceHistoryStore
+from Backend.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every API route on a seeded synthetic data set.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='small', help='Size of the generated data set.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the data generator.')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint.')
+        parser.add_argument('--only', action='append', help='Only run endpoints whose name contains this text.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Baseline results file to check for regressions.')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='Allowed p95 slowdown factor against the baseline.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive.')
+        baseline = load_results(options['compare']) if options['compare'] else None
+
+        # Generated rows are rolled back, so keep their prices and responses out of any shared cache;
+        # this also makes every request measure the full view rather than a cached copy.
+        # Requests are made in-process by the test client, which uses the 'testserver' host.
+        with tempfile.TemporaryDirectory() as history_root, \
+                override_settings(PRICE_HISTORY_ROOT=history_root, PRICE_CACHE={'CACHE_ALIAS': None},
+                                  RESPONSE_CACHE={'CACHE_ALIAS': None},
+                                  ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            reset_price_cache()
+            try:
+                with transaction.atomic():
+                    user = generate_dataset(seed=options['seed'], history_store=PriceHistoryStore(history_root),
+                                            **SCALES[options['scale']])
+                    endpoints = run_benchmarks(router, user, options['iterations'], options['only'])
+                    transaction.set_rollback(True)
+            finally:
+                reset_price_cache()
+
+        document = results_document(endpoints, options['scale'], options['seed'], options['iterations'])
+        self.stdout.write(f'{"endpoint":<34}{"status":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+                          f'{"queries":>9}{"rows":>7}{"peak KiB":>10}')
+        for name, metrics in sorted(endpoints.items()):
+            self.stdout.write(f'{name:<34}{metrics["status"]:>7}{metrics["p50_ms"]:>10.2f}{metrics["p95_ms"]:>10.2f}'
+                              f'{metrics["p99_ms"]:>10.2f}{metrics["queries"]:>9}{metrics["rows"]:>7}'
+                              f'{metrics["peak_kib"]:>10.1f}')
+        if options['output']:
+            write_results(options['output'], document)
+            self.stdout.write(self.style.SUCCESS(f'Wrote results to {options["output"]}.'))
+
+        if baseline is not None:
+            regressions = compare_results(baseline, document, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["compare"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}.'))
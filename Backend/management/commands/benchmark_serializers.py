@@ -0,0 +1,70 @@
+'''
+Compares the DRF serializer path with the compiled fast read path on hot list endpoints.
+Rows are seeded inside a transaction that is rolled back afterwards, and each path is timed from
+queryset to rendered Python data, so both include their queries.
+'''
+
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from Backend.benchmark import new_run_id
+from Backend.fastpath import compile_serializer
+from Backend.models import Instrument, Portfolio, Stock, VirtualTrade
+from Backend.pricecache import reset_price_cache
+from Backend.serializers import StockSerializer, VirtualTradeSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark DRF serializers against the fast read path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per list.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per path; the best is reported.')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be positive.')
+        with transaction.atomic():
+            user, querysets = self.seed(options['rows'])
+            for serializer_class, queryset in querysets:
+                self.compare(serializer_class, queryset, options['repeat'])
+            transaction.set_rollback(True)
+        reset_price_cache()
+
+    def seed(self, rows):
+        run = new_run_id()
+        user = User.objects.create(username=f'benchmark-serializers-{run}')
+        portfolio = Portfolio.objects.create(user=user, name='Benchmark')
+        instruments = [Instrument.objects.create(asset_class=Instrument.STOCK, symbol=f'{run}SYM{i}',
+                                                 last_price=100 + i, quoted_at=timezone.now()) for i in range(50)]
+        now = timezone.now()
+        Stock.objects.bulk_create([Stock(portfolio=portfolio, instrument=instruments[i % 50],
+                                         ticker_symbol=instruments[i % 50].symbol,
+                                         quantity=i + 1, initial_purchase_price='99.95', purchase_date=now)
+                                   for i in range(rows)])
+        VirtualTrade.objects.bulk_create([VirtualTrade(user=user, portfolio=portfolio, instrument=instruments[i % 50],
+                                                       trade_type='BUY', trade_quantity=i + 1, trade_price='100.05')
+                                          for i in range(rows)])
+        return user, [
+            (StockSerializer, Stock.objects.filter(portfolio=portfolio).order_by('id')),
+            (VirtualTradeSerializer, VirtualTrade.objects.filter(user=user).select_related('user', 'instrument')),
+        ]
+
+    def compare(self, serializer_class, queryset, repeat):
+        plan = compile_serializer(serializer_class)
+        drf = self.best(lambda: serializer_class(list(queryset.all()), many=True).data, repeat)
+        fast = self.best(lambda: plan.serialize(list(queryset.values(*dict.fromkeys(plan.columns)))), repeat)
+        self.stdout.write(f'{serializer_class.__name__:<24} drf {drf * 1000:8.2f} ms   '
+                          f'fast {fast * 1000:8.2f} ms   {drf / fast:5.1f}x')
+
+    def best(self, render, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,55 @@
+'''
+Bulk imports Stock, ETF and Cryptocurrency holdings from a CSV or NDJSON file.
+Rows are validated and written in batches with one bulk insert per asset class, and every
+rejected row is reported with its row number.
+
+CSV files need a header with portfolio, asset_class, symbol, quantity and initial_purchase_price
+columns and optional purchase_date and currency columns; NDJSON lines are objects with the same keys.
+'''
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from Backend.imports import import_holdings, read_records
+from Backend.models import Portfolio
+
+
+class Command(BaseCommand):
+    help = 'Bulk import holdings of any asset class from a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Holdings file to import.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='File format, inferred from the extension when omitted.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rows validated and inserted per batch.')
+        parser.add_argument('--user', help='Only accept portfolios owned by this username.')
+        parser.add_argument('--partial', action='store_true',
+                            help='Import the valid rows even when some rows are rejected.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        portfolios = Portfolio.objects.all()
+        if options['user']:
+            try:
+                portfolios = portfolios.filter(user=User.objects.get(username=options['user']))
+            except User.DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']!r}.")
+
+        with open(path, newline='') as handle:
+            try:
+                created, errors = import_holdings(read_records(handle, file_format), portfolios,
+                                                  batch_size=options['batch_size'], partial=options['partial'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+
+        for row_number, row_errors in sorted(errors.items()):
+            messages = '; '.join(f'{field}: {" ".join(field_errors)}' for field, field_errors in row_errors.items())
+            self.stderr.write(f'Row {row_number}: {messages}')
+        if errors and not options['partial']:
+            raise CommandError(f'Rejected {len(errors)} rows, nothing was imported.')
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} holdings from {path}.'))
@@ -0,0 +1,105 @@
+'''
+Streams a CSV or NDJSON quote file into the Instrument table in batches.
+Each batch is applied as a single bulk upsert, so a refresh costs one row per instrument
+no matter how many holdings reference it. Quotes are also appended to the price history store.
+
+CSV files need a header with asset_class, symbol and price columns; NDJSON lines are objects
+with the same keys. An optional quoted_at column holds an ISO 8601 timestamp. Rows with a price
+that is not a positive number or a quoted_at that is not a date and time are reported on stderr
+and skipped.
+'''
+
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from Backend.models import Instrument
+from Backend.timeseries import get_price_history_store
+
+
+class Command(BaseCommand):
+    help = 'Bulk upsert latest quotes from a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Quote file to ingest.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='File format, inferred from the extension when omitted.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of quotes applied per bulk upsert.')
+        parser.add_argument('--no-history', action='store_true',
+                            help='Only update latest quotes, without appending to the price history.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        history = None if options['no_history'] else get_price_history_store()
+        written = 0
+        self.rejected = 0
+        with open(path, newline='') as handle:
+            records = csv.DictReader(handle) if file_format == 'csv' else self.read_ndjson(handle)
+            quotes = self.parse_quotes(records, timezone.now())
+            while True:
+                batch = list(islice(quotes, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    written += Instrument.objects.upsert_quotes(batch)
+                if history is not None:
+                    history.append_many(batch)
+
+        message = f'Applied {written} quotes from {path}.'
+        if self.rejected:
+            message += f' Rejected {self.rejected} rows.'
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def read_ndjson(self, handle):
+        for line_number, line in enumerate(handle, start=1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as exc:
+                    raise CommandError(f'Line {line_number}: invalid JSON ({exc}).')
+
+    def parse_quotes(self, records, default_time):
+        asset_classes = {choice for choice, _ in Instrument.ASSET_CLASS_CHOICES}
+        for row_number, record in enumerate(records, start=1):
+            asset_class = str(record.get('asset_class', '')).upper()
+            if asset_class not in asset_classes:
+                raise CommandError(f'Row {row_number}: unknown asset class {asset_class!r}.')
+            symbol = record.get('symbol')
+            if not symbol:
+                raise CommandError(f'Row {row_number}: missing symbol.')
+            try:
+                price = Decimal(str(record['price']))
+                # NaN, infinities and non-positive prices parse, but are no price to value holdings at
+                if not price.is_finite() or price <= 0:
+                    raise InvalidOperation
+            except (KeyError, InvalidOperation):
+                self.reject(row_number, 'missing or invalid price')
+                continue
+            quoted_at = default_time
+            if record.get('quoted_at'):
+                # parse_datetime() returns None for text it does not recognise, such as a date alone
+                # before Python 3.11, and raises ValueError for an impossible date
+                try:
+                    quoted_at = parse_datetime(str(record['quoted_at']))
+                except ValueError:
+                    quoted_at = None
+                if quoted_at is None:
+                    self.reject(row_number, f'invalid quoted_at {record["quoted_at"]!r}')
+                    continue
+            yield asset_class, symbol, price, quoted_at
+
+    def reject(self, row_number, reason):
+        self.rejected += 1
+        self.stderr.write(f'Row {row_number}: {reason}, skipped.')
@@ -0,0 +1,65 @@
+'''
+Long running worker keeping instrument prices fresh.
+Instruments are refreshed by priority from the providers in QUOTE_PROVIDERS: held or recently
+traded ones every PRICE_WORKER['HOT_INTERVAL'] seconds, the rest every IDLE_INTERVAL. Fetches run on
+a thread pool and results are written with bulk upserts. Backlog, lag and throughput are reported
+periodically. Stop with Ctrl+C or SIGTERM; running batches are finished and written first.
+'''
+
+import json
+import signal
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from Backend.quotes import get_quote_service
+from Backend.scheduler import QuoteServiceFetcher, price_scheduler_from_settings
+
+
+class Command(BaseCommand):
+    help = 'Continuously refresh instrument prices by priority.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Refresh every instrument once and exit.')
+        parser.add_argument('--workers', type=int, help='Fetch threads, PRICE_WORKER["WORKERS"] by default.')
+        parser.add_argument('--batch-size', type=int, help='Instruments per fetch, PRICE_WORKER["BATCH_SIZE"] by default.')
+        parser.add_argument('--report-every', type=float, default=60, help='Seconds between stats reports.')
+        parser.add_argument('--no-history', action='store_true',
+                            help='Only update latest quotes, without appending to the price history.')
+
+    def handle(self, *args, **options):
+        overrides = {'history': not options['no_history']}
+        for option, name in (('workers', 'workers'), ('batch_size', 'batch_size')):
+            if options[option] is not None:
+                if options[option] < 1:
+                    raise CommandError(f'--{option.replace("_", "-")} must be positive.')
+                overrides[name] = options[option]
+
+        try:
+            service = get_quote_service()
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        fetcher = QuoteServiceFetcher(service)
+        scheduler = price_scheduler_from_settings(fetcher, **overrides)
+        try:
+            if options['once']:
+                scheduler.sweep()
+            else:
+                stop = threading.Event()
+                signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+                self.stdout.write('Refreshing prices, press Ctrl+C to stop.')
+                try:
+                    scheduler.run(stop, report=self.report, report_every=options['report_every'])
+                except KeyboardInterrupt:
+                    pass
+                # Write what is still running before exiting
+                while scheduler.in_flight:
+                    scheduler.collect(timeout=None)
+        finally:
+            scheduler.close()
+            fetcher.close()
+        self.report(scheduler.stats.snapshot())
+
+    def report(self, snapshot):
+        self.stdout.write(json.dumps(snapshot, sort_keys=True))
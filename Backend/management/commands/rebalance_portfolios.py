@@ -0,0 +1,36 @@
+'''
+Rebalances every portfolio with targets, or the given ones, in one batch.
+Proposed orders are printed as NDJSON unless --execute fills them, in a single transaction.
+'''
+
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from Backend.rebalancing import execute_rebalance, rebalance
+
+
+class Command(BaseCommand):
+    help = 'Propose or execute the trades bringing portfolios to their target allocations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('portfolios', nargs='*', type=int, help='Portfolio ids, every one with targets by default.')
+        parser.add_argument('--processes', type=int, help='Worker processes, REBALANCING["PROCESSES"] by default.')
+        parser.add_argument('--chunk-size', type=int, help='Portfolios per chunk, REBALANCING["CHUNK_SIZE"] by default.')
+        parser.add_argument('--execute', action='store_true', help='Fill the proposed orders.')
+
+    def handle(self, *args, **options):
+        orders, unreachable = rebalance(options['portfolios'] or None, processes=options['processes'],
+                                        chunk_size=options['chunk_size'])
+        if unreachable:
+            self.stderr.write(f'Targets of portfolios {", ".join(map(str, unreachable))} cannot be met.')
+        if not options['execute']:
+            for order in orders:
+                self.stdout.write(json.dumps(order))
+            return
+        try:
+            trades = execute_rebalance(orders)
+        except ValidationError as exc:
+            raise CommandError(f'Rebalancing orders were rejected: {exc.message_dict}')
+        self.stdout.write(self.style.SUCCESS(f'Executed {len(trades)} rebalancing trades.'))
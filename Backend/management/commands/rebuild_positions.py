@@ -0,0 +1,51 @@
+'''
+Rebuilds the Position ledger by replaying VirtualTrade history in trade order.
+Trades are streamed in chunks with a server side cursor and folded into an in-memory
+position per (user, instrument), so memory grows with the number of positions, not trades.
+'''
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Backend.ledger import apply_trade, save_positions
+from Backend.models import Position, VirtualTrade
+
+
+class Command(BaseCommand):
+    help = 'Rebuild positions, average costs and realized P&L from the trade history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only rebuild positions of this user id.')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of trades fetched per database round-trip.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of positions written per bulk upsert.')
+
+    def handle(self, *args, **options):
+        trades = VirtualTrade.objects.order_by('trade_date', 'pk')
+        positions = Position.objects.all()
+        if options['user'] is not None:
+            trades = trades.filter(user=options['user'])
+            positions = positions.filter(user=options['user'])
+
+        replayed = {}
+        count = 0
+        rows = trades.values_list('user', 'instrument', 'trade_type', 'trade_quantity', 'trade_price')
+        for user_id, instrument_id, trade_type, quantity, price in rows.iterator(chunk_size=options['chunk_size']):
+            position = replayed.get((user_id, instrument_id))
+            if position is None:
+                position = replayed[(user_id, instrument_id)] = Position(
+                    user_id=user_id, instrument_id=instrument_id,
+                    average_cost=Decimal('0'), realized_pnl=Decimal('0'))
+            apply_trade(position, trade_type, quantity, price)
+            count += 1
+
+        rebuilt = list(replayed.values())
+        with transaction.atomic():
+            positions.delete()
+            for start in range(0, len(rebuilt), options['batch_size']):
+                save_positions(rebuilt[start:start + options['batch_size']])
+
+        self.stdout.write(self.style.SUCCESS(f'Replayed {count} trades into {len(rebuilt)} positions.'))
@@ -0,0 +1,51 @@
+'''
+Long running worker recording portfolio value snapshots.
+Every SNAPSHOTS['INTERVAL'] seconds the value of every portfolio is stored as a raw point and closed
+buckets are rolled up into minute, hour, day and month points, deleting points past their retention.
+Stop with Ctrl+C or SIGTERM.
+'''
+
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Backend.snapshots import compact_snapshots, record_snapshots, snapshot_settings
+
+
+class Command(BaseCommand):
+    help = 'Record portfolio value snapshots on a schedule and maintain their rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Record and compact once and exit.')
+        parser.add_argument('--interval', type=float, help='Seconds between snapshots, SNAPSHOTS["INTERVAL"] by default.')
+        parser.add_argument('--no-compact', action='store_true', help='Only record raw points.')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] if options['interval'] is not None else snapshot_settings()['INTERVAL']
+        if interval <= 0:
+            raise CommandError('--interval must be positive.')
+        if options['once']:
+            self.run_once(options['no_compact'])
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        self.stdout.write('Recording snapshots, press Ctrl+C to stop.')
+        try:
+            while not stop.is_set():
+                started = time.monotonic()
+                self.run_once(options['no_compact'])
+                stop.wait(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+
+    def run_once(self, no_compact):
+        recorded = record_snapshots()
+        message = f'Recorded {recorded} snapshots.'
+        if not no_compact:
+            written, deleted = compact_snapshots()
+            message += (f' Rolled up {sum(written.values())} points'
+                        f' and deleted {sum(deleted.values())} compacted points.')
+        self.stdout.write(message)
@@ -1,7 +1,23 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib.auth.models import User
-from django.core.validators import MinValueValidator, MaxValueValidator, EmailValidator
+from django.core.validators import MinValueValidator, MaxValueValidator, EmailValidator, RegexValidator
 from django.core.exceptions import ValidationError
+from django.dispatch import Signal
+
+from .fx import CENTS, fx_settings, get_conversion_matrix
+from .pricecache import get_price_cache
+
+# Sent with prices={instrument id: price} and the quote tuples after upsert_quotes() writes latest quotes in bulk
+prices_changed = Signal()
+# Sent with the written currency codes after FXRate.objects.upsert_rates()
+fx_rates_changed = Signal()
+
+# ISO 4217 currency codes
+validate_currency_code = RegexValidator(r'^[A-Z]{3}$', 'Enter a three letter ISO 4217 currency code.')
 
 # Function to validate email uniqueness
 def validate_email_uniqueness(value):
@@ -12,7 +28,7 @@ class UserProfile(models.Model):
     """
     Extends the basic Django User model to include additional personal information.
     """
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     surname = models.CharField(max_length=100, null=True, blank=True)
     address = models.TextField(null=True, blank=True)
     email = models.EmailField(validators=[EmailValidator(), validate_email_uniqueness])
@@ -22,10 +38,70 @@ class UserProfile(models.Model):
     # Additional fields
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    # Currency valuations are reported in; blank uses FX['BASE_CURRENCY']
+    base_currency = models.CharField(max_length=3, blank=True, validators=[validate_currency_code])
 
     def __str__(self):
         return self.user.username
 
+# Latest Quote Model
+class InstrumentQuerySet(models.QuerySet):
+    """
+    QuerySet for instruments with bulk quote maintenance.
+    """
+    def upsert_quotes(self, quotes):
+        """
+        Applies (asset_class, symbol, price, quoted_at) tuples with a single bulk upsert.
+        Later quotes for the same instrument win. Returns the number of instruments written.
+        """
+        quotes = list(quotes)
+        latest = {}
+        for asset_class, symbol, price, quoted_at in quotes:
+            latest[(asset_class, symbol)] = Instrument(asset_class=asset_class, symbol=symbol,
+                                                       last_price=price, quoted_at=quoted_at)
+        if latest:
+            self.bulk_create(latest.values(), update_conflicts=True,
+                             unique_fields=['asset_class', 'symbol'],
+                             update_fields=['last_price', 'quoted_at'])
+            # Bulk upserts skip post_save, so drop the cached prices of the written instruments and
+            # announce the new ones here
+            written = {pk: latest[(asset_class, symbol)].last_price for pk, asset_class, symbol
+                       in self.filter(symbol__in={symbol for _, symbol in latest}).values_list('pk', 'asset_class', 'symbol')
+                       if (asset_class, symbol) in latest}
+            get_price_cache().invalidate(list(written))
+            prices_changed.send(sender=self.model, prices=written, quotes=quotes)
+        return len(latest)
+
+class Instrument(models.Model):
+    """
+    Represents a tradable instrument and its latest quote, shared by every holding of it.
+    """
+    STOCK = 'STOCK'
+    ETF = 'ETF'
+    CRYPTO = 'CRYPTO'
+    ASSET_CLASS_CHOICES = [(STOCK, 'Stock'), (ETF, 'ETF'), (CRYPTO, 'Cryptocurrency')]
+
+    asset_class = models.CharField(max_length=6, choices=ASSET_CLASS_CHOICES)
+    symbol = models.CharField(max_length=50)
+    last_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    quoted_at = models.DateTimeField(null=True, blank=True)
+    # Currency of last_price
+    currency = models.CharField(max_length=3, default='USD', validators=[validate_currency_code])
+
+    objects = InstrumentQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.asset_class}:{self.symbol}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['asset_class', 'symbol'], name='unique_instrument'),
+        ]
+        indexes = [
+            # ?symbol= without an asset class cannot use the unique (asset_class, symbol) index
+            models.Index(fields=['symbol'], name='instrument_symbol_idx'),
+        ]
+
 # Investment Portfolio Model
 class Portfolio(models.Model):
     """
@@ -37,8 +113,31 @@ class Portfolio(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def total_value(self):
-        # Calculate total value of the portfolio
-        return sum(investment.current_value() for investment in self.investment_set.all())
+        # Calculate total value of the portfolio in the database, one aggregate per asset class
+        return portfolio_valuations([self.pk]).get(self.pk, Decimal('0'))
+
+class InvestmentQuerySet(models.QuerySet):
+    """
+    QuerySet shared by all holdings that pushes valuation arithmetic into SQL.
+    """
+    def quantity_by_instrument(self):
+        """
+        Returns (portfolio_id, instrument_id, quantity) triples with quantities summed in SQL.
+        Prices are applied afterwards from the price cache.
+        """
+        return (self.order_by()
+                .values('portfolio', 'instrument')
+                .annotate(total_quantity=Sum('quantity'))
+                .values_list('portfolio', 'instrument', 'total_quantity'))
+
+    def quantity_by_instrument_currency(self):
+        """
+        Like quantity_by_instrument(), with the instrument's quote currency joined in as a fourth item.
+        """
+        return (self.order_by()
+                .values('portfolio', 'instrument', 'instrument__currency')
+                .annotate(total_quantity=Sum('quantity'))
+                .values_list('portfolio', 'instrument', 'total_quantity', 'instrument__currency'))
 
 # Abstract Investment Model
 class Investment(models.Model):
@@ -48,56 +147,379 @@ class Investment(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     initial_purchase_price = models.DecimalField(max_digits=10, decimal_places=2)
-    current_price = models.DecimalField(max_digits=10, decimal_places=2) # Real-time updated
+    # Prices live on the shared Instrument row, resolved from the holding's symbol on save
+    instrument = models.ForeignKey(Instrument, on_delete=models.PROTECT, editable=False)
     purchase_date = models.DateTimeField()
+    # Currency of initial_purchase_price; blank means the instrument's quote currency
+    currency = models.CharField(max_length=3, blank=True, validators=[validate_currency_code])
+
+    objects = InvestmentQuerySet.as_manager()
 
     class Meta:
         abstract = True
-    
+
+    @property
+    def symbol(self):
+        """
+        Symbol of the held instrument, stored in the subclass's `symbol_field`.
+        """
+        return getattr(self, self.symbol_field)
+
+    @property
+    def current_price(self):
+        """
+        Latest quoted price of the held instrument, read through the price cache.
+        """
+        return get_price_cache().get(self.instrument_id)
+
     def current_value(self):
         """
         Calculates the current value of the investment.
         """
-        return self.quantity * self.current_price
+        return self.quantity * (self.current_price or 0)
+
+    def save(self, *args, **kwargs):
+        if self.instrument_id is None or self.instrument.symbol != self.symbol:
+            self.instrument, _ = Instrument.objects.get_or_create(asset_class=self.asset_class,
+                                                                  symbol=self.symbol)
+        super().save(*args, **kwargs)
 
 # Stock Investment Model
 class Stock(Investment):
     """
     Represents a stock investment.
     """
+    asset_class = Instrument.STOCK
+    symbol_field = 'ticker_symbol'
     ticker_symbol = models.CharField(max_length=10)
 
+    class Meta(Investment.Meta):
+        indexes = [
+            # Serves ?ticker_symbol= across portfolios and a portfolio's lots of one symbol
+            models.Index(fields=['ticker_symbol'], name='stock_symbol_idx'),
+            models.Index(fields=['portfolio', 'ticker_symbol'], name='stock_portfolio_symbol_idx'),
+        ]
+
 # ETF Investment Model
 class ETF(Investment):
     """
     Represents an ETF investment.
     """
+    asset_class = Instrument.ETF
+    symbol_field = 'ticker_symbol'
     ticker_symbol = models.CharField(max_length=10)
 
+    class Meta(Investment.Meta):
+        indexes = [
+            models.Index(fields=['ticker_symbol'], name='etf_symbol_idx'),
+            models.Index(fields=['portfolio', 'ticker_symbol'], name='etf_portfolio_symbol_idx'),
+        ]
+
 # Cryptocurrency Investment Model
 class Cryptocurrency(Investment):
     """
     Represents a crypto investment.
     """
+    asset_class = Instrument.CRYPTO
+    symbol_field = 'crypto_name'
     crypto_name = models.CharField(max_length=50)
 
+    class Meta(Investment.Meta):
+        indexes = [
+            models.Index(fields=['crypto_name'], name='crypto_symbol_idx'),
+            models.Index(fields=['portfolio', 'crypto_name'], name='crypto_portfolio_symbol_idx'),
+        ]
+
+# Concrete holding models, valued together when summing a portfolio
+HOLDING_MODELS = (Stock, ETF, Cryptocurrency)
+HOLDING_MODEL_BY_ASSET_CLASS = {model.asset_class: model for model in HOLDING_MODELS}
+
+def portfolio_positions(portfolio_ids, currencies=None):
+    """
+    Returns {portfolio_id: {instrument_id: quantity}} with lots of the same instrument summed in SQL,
+    one grouped query per asset class. Pass a dict as `currencies` to also collect the quote currency
+    of every instrument held, joined into the same queries.
+    """
+    positions = {portfolio_id: {} for portfolio_id in portfolio_ids}
+    if not positions:
+        return positions
+    for model in HOLDING_MODELS:
+        lots = model.objects.filter(portfolio__in=list(positions))
+        if currencies is None:
+            rows = ((*row, None) for row in lots.quantity_by_instrument())
+        else:
+            rows = lots.quantity_by_instrument_currency()
+        for portfolio_id, instrument_id, quantity, currency in rows:
+            holdings = positions[portfolio_id]
+            holdings[instrument_id] = holdings.get(instrument_id, 0) + quantity
+            if currencies is not None:
+                currencies[instrument_id] = currency
+    return positions
+
+def portfolio_valuations(portfolio_ids, currency=None, unconverted=None):
+    """
+    Values many portfolios at once with one grouped aggregate query per asset class.
+    Prices come from the price cache, which only queries instruments it has not seen recently.
+    Returns a dict mapping portfolio id to total value in `currency`, FX['BASE_CURRENCY'] by default,
+    rounded to cents; portfolios without holdings map to 0 and unpriced holdings count as 0. Values
+    are summed exactly per quote currency and each sum is converted once at the quoted cross rate.
+    Holdings in a currency without an FX rate are left out of the total; pass a dict as
+    `unconverted` to collect {portfolio_id: [currency, ...]} of those.
+    """
+    currency = currency or fx_settings()['BASE_CURRENCY']
+    currencies = {}
+    positions = portfolio_positions(portfolio_ids, currencies)
+    prices = get_price_cache().get_many(currencies.keys())
+    subtotals = {}
+    for portfolio_id, holdings in positions.items():
+        groups = subtotals[portfolio_id] = {}
+        for instrument_id, quantity in holdings.items():
+            quoted = currencies[instrument_id]
+            groups[quoted] = groups.get(quoted, Decimal('0')) + quantity * (prices.get(instrument_id) or Decimal('0'))
+
+    foreign = {quoted for groups in subtotals.values() for quoted in groups} - {currency}
+    matrix = get_conversion_matrix() if foreign else None
+    rates = {quoted: matrix.exact_rate(quoted, currency) for quoted in foreign}
+    rates[currency] = Decimal('1')
+    valuations = {}
+    for portfolio_id, groups in subtotals.items():
+        total = Decimal('0')
+        for quoted, subtotal in sorted(groups.items()):
+            if rates[quoted] is not None:
+                total += subtotal * rates[quoted]
+            elif unconverted is not None:
+                unconverted.setdefault(portfolio_id, []).append(quoted)
+        valuations[portfolio_id] = total.quantize(CENTS)
+    return valuations
+
+def portfolio_holdings(portfolio, asset_classes=None, symbol=None, pivot_value=False):
+    """
+    Returns every lot of the portfolio across asset classes as one UNION ALL queryset of dicts with
+    id, asset_class, symbol, instrument, quantity, initial_purchase_price, current_price,
+    current_value, purchase_date, purchase_currency and quote_currency. Prices and values are as
+    quoted; with `pivot_value` each row also has its current value in FX['PIVOT'], to order lots
+    quoted in different currencies by. Filters are applied inside each branch, so the combined query
+    can only be ordered and sliced further, by column name.
+    """
+    fields = ['id', 'asset_class', 'symbol', 'instrument', 'quantity', 'initial_purchase_price',
+              'current_price', 'current_value', 'purchase_date', 'purchase_currency', 'quote_currency']
+    annotations = {}
+    if pivot_value:
+        rate = Case(When(instrument__currency=fx_settings()['PIVOT'], then=Value(Decimal('1'))),
+                    default=Subquery(FXRate.objects.filter(currency=OuterRef('instrument__currency')).values('rate')[:1]))
+        annotations['pivot_value'] = ExpressionWrapper(F('quantity') * F('instrument__last_price') * rate,
+                                                       output_field=DecimalField(max_digits=30, decimal_places=10))
+        fields.append('pivot_value')
+
+    branches = []
+    for model in HOLDING_MODELS:
+        if asset_classes is not None and model.asset_class not in asset_classes:
+            continue
+        queryset = model.objects.filter(portfolio=portfolio)
+        if symbol:
+            queryset = queryset.filter(**{f'{model.symbol_field}__iexact': symbol})
+        branches.append(queryset.order_by().annotate(
+            asset_class=Value(model.asset_class, output_field=models.CharField()),
+            symbol=F(model.symbol_field),
+            current_price=F('instrument__last_price'),
+            current_value=ExpressionWrapper(F('quantity') * F('instrument__last_price'),
+                                            output_field=DecimalField(max_digits=20, decimal_places=2)),
+            purchase_currency=Coalesce(NullIf('currency', Value('')), 'instrument__currency'),
+            quote_currency=F('instrument__currency'),
+            **annotations,
+        ).values(*fields))
+    if not branches:
+        return Stock.objects.none().values('id')
+    return branches[0].union(*branches[1:], all=True) if len(branches) > 1 else branches[0]
+
+def holding_portfolios(instrument_ids):
+    """
+    Returns the ids of the portfolios holding any of the given instruments.
+    """
+    instrument_ids = list(instrument_ids)
+    portfolio_ids = set()
+    if instrument_ids:
+        for model in HOLDING_MODELS:
+            portfolio_ids.update(model.objects.filter(instrument__in=instrument_ids).order_by()
+                                 .values_list('portfolio', flat=True).distinct())
+    return portfolio_ids
+
 # Virtual Trading
 class VirtualTrade(models.Model):
     """
     Represents a virtual-mock trade made by a user.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    investment = models.ForeignKey(Investment, on_delete=models.CASCADE)
+    # Holdings are abstract per asset class, so trades point at the portfolio and instrument they move
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    instrument = models.ForeignKey(Instrument, on_delete=models.PROTECT)
     trade_type = models.CharField(max_length=4, choices=[('BUY', 'Buy'), ('SELL', 'Sell')])
     trade_quantity = models.PositiveIntegerField()
     trade_price = models.DecimalField(max_digits=10, decimal_places=2)
     trade_date = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.user.username} - {self.trade_type} - {self.investment}"
+        return f"{self.user.username} - {self.trade_type} - {self.instrument}"
 
     class Meta:
         ordering = ['-trade_date']
+        indexes = [
+            # Serves each user's history newest first, including keyset pagination on (trade_date, id)
+            models.Index(fields=['user', '-trade_date', '-id'], name='trade_user_date_idx'),
+            # Serves the default newest first ordering and the price worker's recently traded scan
+            models.Index(fields=['trade_date', 'instrument'], name='trade_date_instrument_idx'),
+        ]
+
+
+# Position Ledger
+class Position(models.Model):
+    """
+    Represents a user's net position in an instrument across all portfolios,
+    maintained incrementally from VirtualTrade using the average cost method.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    instrument = models.ForeignKey(Instrument, on_delete=models.PROTECT)
+    quantity = models.IntegerField(default=0)
+    average_cost = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    realized_pnl = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.instrument} - {self.quantity}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'instrument'], name='unique_user_position'),
+        ]
+
+
+# Exchange rates
+class FXRateQuerySet(models.QuerySet):
+    """
+    QuerySet for exchange rates with bulk rate maintenance.
+    """
+    def upsert_rates(self, rates):
+        """
+        Applies (currency, rate, quoted_at) tuples with a single bulk upsert and returns the number
+        of currencies written. Later rates for the same currency win.
+        """
+        latest = {currency: FXRate(currency=currency, rate=rate, quoted_at=quoted_at)
+                  for currency, rate, quoted_at in rates}
+        if latest:
+            self.bulk_create(latest.values(), update_conflicts=True, unique_fields=['currency'],
+                             update_fields=['rate', 'quoted_at'])
+            # Bulk upserts skip post_save, so announce the new rates here
+            fx_rates_changed.send(sender=self.model, currencies=sorted(latest))
+        return len(latest)
+
+class FXRate(models.Model):
+    """
+    Latest exchange rate of a currency, as units of FX['PIVOT'] per unit. Used by Backend/fx.py.
+    """
+    currency = models.CharField(max_length=3, unique=True, validators=[validate_currency_code])
+    rate = models.DecimalField(max_digits=20, decimal_places=10, validators=[MinValueValidator(Decimal('0.0000000001'))])
+    quoted_at = models.DateTimeField()
+
+    objects = FXRateQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.currency}: {self.rate}"
+
+
+# Rebalancing targets
+class TargetAllocation(models.Model):
+    """
+    Target share of a portfolio's value for one instrument, or for a whole asset class, whose share
+    is spread over the portfolio's other holdings of that class. Used by Backend/rebalancing.py.
+    """
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='targets')
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, null=True, blank=True)
+    asset_class = models.CharField(max_length=6, choices=Instrument.ASSET_CLASS_CHOICES, blank=True)
+    weight = models.DecimalField(max_digits=5, decimal_places=4)
+
+    def __str__(self):
+        return f"{self.portfolio} - {self.instrument or self.asset_class}: {self.weight}"
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=(models.Q(instrument__isnull=True) & ~models.Q(asset_class=''))
+                                   | (models.Q(instrument__isnull=False) & models.Q(asset_class='')),
+                                   name='target_instrument_or_asset_class'),
+            models.CheckConstraint(check=models.Q(weight__gte=0, weight__lte=1), name='target_weight_fraction'),
+            models.UniqueConstraint(fields=['portfolio', 'instrument'], condition=models.Q(instrument__isnull=False),
+                                    name='unique_instrument_target'),
+            models.UniqueConstraint(fields=['portfolio', 'asset_class'], condition=models.Q(instrument__isnull=True),
+                                    name='unique_asset_class_target'),
+        ]
+
+
+# Append-only history, routed to the document store by Backend/routers.py
+class TradeEvent(models.Model):
+    """
+    Immutable record of an executed trade. References are plain ids rather than foreign keys,
+    as events can live in a different database from the rows they describe. Each event copies a
+    VirtualTrade, which stays the record trades are executed against on 'default'.
+    """
+    user_id = models.BigIntegerField()
+    portfolio_id = models.BigIntegerField()
+    instrument_id = models.BigIntegerField()
+    asset_class = models.CharField(max_length=6)
+    symbol = models.CharField(max_length=50)
+    trade_type = models.CharField(max_length=4)
+    trade_quantity = models.PositiveIntegerField()
+    trade_price = models.DecimalField(max_digits=10, decimal_places=2)
+    trade_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', '-trade_date'], name='event_user_date_idx'),
+        ]
+
+
+class PriceTick(models.Model):
+    """
+    One quoted price of an instrument.
+    """
+    asset_class = models.CharField(max_length=6)
+    symbol = models.CharField(max_length=50)
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    quoted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['asset_class', 'symbol', 'quoted_at'], name='tick_instrument_time_idx'),
+        ]
+
+
+class ValuationSnapshot(models.Model):
+    """
+    Value of a portfolio at `time` for raw points, or over the bucket starting at `time` for
+    rollups, with the lowest and highest value recorded in it, in the owner's base currency at the
+    time. Maintained by Backend/snapshots.py.
+    """
+    RAW = 'raw'
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    MONTH = 'month'
+    RESOLUTION_CHOICES = [(RAW, 'Raw'), (MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day'), (MONTH, 'Month')]
+
+    portfolio_id = models.BigIntegerField()
+    resolution = models.CharField(max_length=6, choices=RESOLUTION_CHOICES)
+    time = models.DateTimeField()
+    value = models.DecimalField(max_digits=20, decimal_places=2)
+    low = models.DecimalField(max_digits=20, decimal_places=2)
+    high = models.DecimalField(max_digits=20, decimal_places=2)
+    # Blank for points recorded before snapshots carried a currency, which are in FX['BASE_CURRENCY']
+    currency = models.CharField(max_length=3, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # A chart is one range read of a single portfolio and resolution
+            models.Index(fields=['portfolio_id', 'resolution', 'time'], name='snapshot_series_idx'),
+            # Compaction reads and deletes one resolution across portfolios by time
+            models.Index(fields=['resolution', 'time'], name='snapshot_resolution_time_idx'),
+        ]
 
 
 # Blog Post Model
@@ -116,6 +538,11 @@ class BlogPost(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Blog Posts"
+        indexes = [
+            # Posts are listed newest first, overall and per author
+            models.Index(fields=['-created_at'], name='post_created_idx'),
+            models.Index(fields=['author', '-created_at'], name='post_author_created_idx'),
+        ]
 
 
 # FAQ Model
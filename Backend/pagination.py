@@ -0,0 +1,185 @@
+'''
+Keyset (cursor) pagination for long, append-heavy lists such as the trade history.
+Instead of COUNT(*) plus a growing OFFSET, each page filters on the ordering values of the last row
+it returned, so with a matching index every page costs the same no matter how deep it is.
+'''
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def approximate_count(queryset):
+    """
+    Estimates the number of rows from the query planner on MySQL and PostgreSQL,
+    falling back to an exact COUNT(*) on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor not in ('mysql', 'postgresql'):
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            return int(cursor.fetchone()[columns.index('rows')] or 0)
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Paginates by the values of `ordering`, whose last field must be unique (normally the pk).
+    Clients pass the opaque ?cursor= from the next/previous links and may ask for
+    ?count=approx (planner estimate) or ?count=exact.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering, page_size=None, max_page_size=None):
+        self.ordering = tuple(ordering)
+        if page_size is not None:
+            self.page_size = page_size
+        if max_page_size is not None:
+            self.max_page_size = max_page_size
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering if not reverse else tuple(invert(field) for field in self.ordering)
+        page = queryset.order_by(*ordering)
+        if values is not None:
+            page = page.filter(self.after(ordering, values))
+        rows = list(page[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = values is not None if not reverse else has_more
+        self.first_key = self.key(rows[0]) if rows else None
+        self.last_key = self.key(rows[-1]) if rows else None
+        if not rows and values is not None:
+            # Paging past either end keeps the cursor usable in the other direction
+            self.has_next, self.has_previous = reverse, not reverse
+            self.first_key = self.last_key = self.cursor_key
+
+        count = request.query_params.get(self.count_query_param)
+        self.count = (approximate_count(queryset) if count == 'approx'
+                      else queryset.count() if count == 'exact' else None)
+        return rows
+
+    def get_paginated_response(self, data):
+        body = {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+        if self.count is not None:
+            body = {'count': self.count, **body}
+        return Response(body)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return self.link(self.last_key, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_key is None:
+            return None
+        return self.link(self.first_key, reverse=True)
+
+    def link(self, key, reverse):
+        url = self.request.build_absolute_uri()
+        cursor = base64.urlsafe_b64encode(json.dumps({'k': key, 'r': reverse}).encode()).decode()
+        return replace_query_param(remove_query_param(url, self.count_query_param), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        self.cursor_key = None
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(cursor['k']) != len(self.ordering):
+                raise ValueError
+            values = [self.field(name).to_python(value) for name, value in zip(self.ordering, cursor['k'])]
+            self.cursor_key = cursor['k']
+            return values, bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def field(self, name):
+        return self.model._meta.get_field(name.lstrip('-'))
+
+    def key(self, instance):
+        if isinstance(instance, dict):
+            # values() rows, as served by the fast read path
+            return [self.value_to_string(instance[name.lstrip('-')]) for name in self.ordering]
+        return [self.field(name).value_to_string(instance) for name in self.ordering]
+
+    def value_to_string(self, value):
+        # Mirrors Field.value_to_string() for the integer and datetime fields used as keys
+        if value is None:
+            return ''
+        return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+    def after(self, ordering, values):
+        """
+        Builds (a < x) OR (a = x AND b < y) ... for the given ordering, flipping to > for ascending fields.
+        """
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            lookup = f'{field}__lt' if name.startswith('-') else f'{field}__gt'
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{field: value})
+        return condition
+
+
+def invert(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+class KeysetPaginationMixin:
+    """
+    Lets a viewset switch from its page number pagination to keyset pagination
+    when the request carries ?pagination=cursor or a ?cursor= from a previous page.
+    """
+    keyset_ordering = ('-id',)
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params if self.request is not None else {}
+            if 'cursor' in params or params.get('pagination') == 'cursor':
+                default = super().paginator
+                self._paginator = self.keyset_pagination_class(
+                    self.keyset_ordering,
+                    page_size=getattr(default, 'page_size', None),
+                    max_page_size=getattr(default, 'max_page_size', None))
+            else:
+                return super().paginator
+        return self._paginator
@@ -0,0 +1,141 @@
+'''
+Read-through cache of latest instrument prices.
+Prices are read far more often than they change, so valuations and holdings lists look them up here
+and only query the Instrument table for ids that are missing or expired.
+
+Lookups go through an in-process LRU with a TTL first and, when PRICE_CACHE['CACHE_ALIAS'] names a
+Django cache, through that shared cache second. Writers call invalidate() or set_many() so readers
+never see a price older than the one last written in this process; other processes converge within TTL.
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULT_PRICE_CACHE = {
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 50000,
+    'CACHE_ALIAS': None,
+}
+
+
+def load_prices(instrument_ids):
+    """
+    Loads latest prices for the given instrument ids in a single query.
+    """
+    from .models import Instrument
+    return dict(Instrument.objects.filter(pk__in=instrument_ids).values_list('pk', 'last_price'))
+
+
+class PriceCache:
+    """
+    LRU mapping of instrument id to latest price with per-entry expiry.
+    """
+    key_prefix = 'price:'
+
+    def __init__(self, timeout=60, max_entries=50000, cache_alias=None, loader=load_prices, clock=time.monotonic):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.cache_alias = cache_alias
+        self.loader = loader
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_PRICE_CACHE, **getattr(settings, 'PRICE_CACHE', {})}
+        return cls(timeout=options['TIMEOUT'], max_entries=options['MAX_ENTRIES'],
+                   cache_alias=options['CACHE_ALIAS'])
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def get(self, instrument_id):
+        return self.get_many([instrument_id]).get(instrument_id)
+
+    def get_many(self, instrument_ids):
+        """
+        Returns a dict of instrument id to price, loading every miss with one query.
+        Unknown ids are omitted from the result.
+        """
+        found, missing = {}, []
+        now = self.clock()
+        with self._lock:
+            for instrument_id in set(instrument_ids):
+                entry = self._entries.get(instrument_id)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(instrument_id)
+                    found[instrument_id] = entry[0]
+                else:
+                    missing.append(instrument_id)
+
+        if missing and self.shared is not None:
+            shared = self.shared.get_many([self.key_prefix + str(pk) for pk in missing])
+            hits = {pk: shared[self.key_prefix + str(pk)] for pk in missing if self.key_prefix + str(pk) in shared}
+            self._store(hits)
+            found.update(hits)
+            missing = [pk for pk in missing if pk not in hits]
+
+        if missing:
+            loaded = self.loader(missing)
+            self.set_many(loaded)
+            found.update(loaded)
+        return found
+
+    def set_many(self, prices):
+        """
+        Writes prices through to the local LRU and the shared cache.
+        """
+        self._store(prices)
+        if prices and self.shared is not None:
+            self.shared.set_many({self.key_prefix + str(pk): price for pk, price in prices.items()},
+                                 timeout=self.timeout)
+
+    def invalidate(self, instrument_ids=None):
+        """
+        Drops the given instrument ids, or every local entry when no ids are given.
+        The shared cache is only touched per id so unrelated keys in that alias survive.
+        """
+        with self._lock:
+            if instrument_ids is None:
+                self._entries.clear()
+            else:
+                for instrument_id in instrument_ids:
+                    self._entries.pop(instrument_id, None)
+        if instrument_ids is not None and self.shared is not None:
+            self.shared.delete_many([self.key_prefix + str(pk) for pk in instrument_ids])
+
+    def _store(self, prices):
+        expires = self.clock() + self.timeout
+        with self._lock:
+            for instrument_id, price in prices.items():
+                self._entries[instrument_id] = (price, expires)
+                self._entries.move_to_end(instrument_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_price_cache = None
+
+
+def get_price_cache():
+    """
+    Returns the process-wide price cache, built from settings on first use.
+    """
+    global _price_cache
+    if _price_cache is None:
+        _price_cache = PriceCache.from_settings()
+    return _price_cache
+
+
+def reset_price_cache():
+    """
+    Discards the process-wide price cache so the next use rebuilds it from settings.
+    """
+    global _price_cache
+    _price_cache = None
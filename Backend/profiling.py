@@ -0,0 +1,352 @@
+'''
+Per-request instrumentation.
+ProfilingMiddleware times each request's view, SQL, serialization and rendering, reports them in a
+Server-Timing header and folds them into in-memory histograms per route, which the /metrics view
+exposes in the Prometheus text format. A sampled fraction of requests can also run under cProfile,
+keeping profile dumps of only the slowest ones. The middleware runs in the mode of the stack it is in,
+so under ASGI async views are not pushed through a thread.
+'''
+
+import contextvars
+import cProfile
+import heapq
+import os
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import serializers
+
+DEFAULT_PROFILING = {
+    'SERVER_TIMING': True,
+    # Histogram bucket upper bounds in seconds
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    # Fraction of requests run under cProfile; 0 disables profiling
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_KEEP': 10,
+    'PROFILE_DIR': None,
+    # When set, /metrics requires an "Authorization: Bearer <token>" header
+    'METRICS_TOKEN': None,
+}
+
+
+def profiling_settings():
+    return {**DEFAULT_PROFILING, **getattr(settings, 'PROFILING', {})}
+
+
+class RequestTimings:
+    """
+    Seconds spent per phase of one request, plus its query count.
+    """
+    def __init__(self):
+        self.sql = 0.0
+        self.queries = 0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.depth = 0
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in the block to `phase` of the current request, if any.
+    Nested blocks of the same request are only counted once.
+    """
+    timings = _current.get()
+    if timings is None or timings.depth:
+        yield
+        return
+    timings.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.depth -= 1
+        setattr(timings, phase, getattr(timings, phase) + time.perf_counter() - started)
+
+
+def sql_timer(execute, sql, params, many, context):
+    timings = _current.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timings is not None:
+            timings.sql += time.perf_counter() - started
+            timings.queries += 1
+
+
+_instrumented = False
+
+
+def instrument_serializers():
+    """
+    Wraps the `data` property of DRF serializers so their time is recorded as serialization.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        prop = serializer_class.data
+
+        def data(self, _get=prop.fget):
+            with timed('serialize'):
+                return _get(self)
+        serializer_class.data = property(data)
+    _instrumented = True
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        # Bucket counts are cumulative, as exposed
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class MetricsRegistry:
+    """
+    Thread-safe in-memory counters and histograms keyed by metric name and label values.
+    """
+    HISTOGRAMS = {
+        'http_request_duration_seconds': 'Wall time of requests.',
+        'http_request_sql_seconds': 'Time spent in SQL per request.',
+        'http_request_serialize_seconds': 'Time spent serializing per request.',
+        'http_request_render_seconds': 'Time spent rendering responses per request.',
+    }
+    COUNTERS = {
+        'http_requests_total': 'Requests served.',
+        'http_request_sql_queries_total': 'SQL queries run by requests.',
+    }
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        """
+        Formats every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name, help_text in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", repr(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum!r}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            for name, help_text in self.COUNTERS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                lines += [f'{name}{format_labels(labels)} {value}'
+                          for (metric, labels), value in sorted(self.counters.items()) if metric == name]
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+_registry = None
+
+
+def get_metrics_registry():
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry(profiling_settings()['BUCKETS'])
+    return _registry
+
+
+def reset_metrics_registry():
+    global _registry
+    _registry = None
+
+
+class SlowestProfiles:
+    """
+    Keeps cProfile dumps of the `keep` slowest sampled requests in `directory`.
+    """
+    def __init__(self, directory, keep):
+        self.directory = os.fspath(directory)
+        self.keep = keep
+        self.heap = []
+        self.lock = threading.Lock()
+
+    def offer(self, duration, route, profile):
+        with self.lock:
+            if len(self.heap) >= self.keep and duration <= self.heap[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{duration * 1000:010.1f}ms-{slug(route)}-{time.time_ns()}.prof')
+            profile.dump_stats(path)
+            if len(self.heap) < self.keep:
+                heapq.heappush(self.heap, (duration, path))
+            else:
+                _, evicted = heapq.heapreplace(self.heap, (duration, path))
+                if os.path.exists(evicted):
+                    os.remove(evicted)
+            return path
+
+
+def slug(value):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', value).strip('_') or 'root'
+
+
+class ProfilingMiddleware:
+    """
+    Records wall, SQL, serializer and render time of every request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.options = profiling_settings()
+        self.profiles = None
+        if self.options['PROFILE_SAMPLE_RATE'] and self.options['PROFILE_DIR']:
+            self.profiles = SlowestProfiles(self.options['PROFILE_DIR'], self.options['PROFILE_KEEP'])
+        instrument_serializers()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        profile = self.sample()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.time_queries(stack)
+                if profile is not None:
+                    profile.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profile is not None:
+                        profile.disable()
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, timings, profile)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        # Only the event loop thread is profiled; queries run on sync_to_async's thread
+        profile = self.sample()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                # Database connections belong to the thread async views run their queries on, which
+                # sync_to_async reuses for the whole request, so they are wrapped from that thread
+                await sync_to_async(self.time_queries)(stack)
+                if profile is not None:
+                    profile.enable()
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    if profile is not None:
+                        profile.disable()
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, timings, profile)
+
+    def sample(self):
+        if self.profiles is not None and random.random() < self.options['PROFILE_SAMPLE_RATE']:
+            return cProfile.Profile()
+        return None
+
+    def time_queries(self, stack):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(sql_timer))
+
+    def finish(self, request, response, duration, timings, profile):
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None and match.view_name else 'unmatched'
+        self.record(route, request.method, response.status_code, duration, timings)
+        if profile is not None:
+            self.profiles.offer(duration, route, profile)
+        if self.options['SERVER_TIMING']:
+            response['Server-Timing'] = server_timing(duration, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        # Responses render after the view returns, so time it from here to the post render callback
+        timings = _current.get()
+        if timings is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                timings.render += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, route, method, status, duration, timings):
+        registry = get_metrics_registry()
+        labels = {'route': route, 'method': method}
+        registry.observe('http_request_duration_seconds', labels, duration)
+        registry.observe('http_request_sql_seconds', labels, timings.sql)
+        registry.observe('http_request_serialize_seconds', labels, timings.serialize)
+        registry.observe('http_request_render_seconds', labels, timings.render)
+        registry.increment('http_requests_total', dict(labels, status=str(status)))
+        registry.increment('http_request_sql_queries_total', labels, timings.queries)
+
+
+def server_timing(duration, timings):
+    return ', '.join([
+        f'total;dur={duration * 1000:.2f}',
+        f'sql;dur={timings.sql * 1000:.2f};desc="{timings.queries} queries"',
+        f'serialize;dur={timings.serialize * 1000:.2f}',
+        f'render;dur={timings.render * 1000:.2f}',
+    ])
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint for the request histograms of this process.
+    """
+    token = profiling_settings()['METRICS_TOKEN']
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(get_metrics_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,160 @@
+'''
+Query plan audit of the API.
+viewset_queries() builds the queryset every registered viewset runs for its list and detail routes
+and for each of its filterset fields, as the given user would request them. explain() runs the
+database's EXPLAIN on a queryset and normalizes the plan into steps, so audit_queries() can report
+which filtered queries read every row of a table instead of using an index.
+'''
+
+import json
+import re
+from dataclasses import dataclass
+
+from django.db import connections
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+# Kinds of plan steps
+SCAN, INDEX_SCAN, LOOKUP, SORT, OTHER = 'scan', 'index scan', 'lookup', 'sort', 'other'
+
+SQLITE_STEP = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\S+)(?: AS \S+)?(?: USING (.*))?$')
+POSTGRESQL_NODES = {'Seq Scan': SCAN, 'Index Scan': LOOKUP, 'Index Only Scan': LOOKUP, 'Bitmap Heap Scan': LOOKUP,
+                    'Sort': SORT, 'Incremental Sort': SORT}
+
+
+class UnsupportedDatabase(Exception):
+    pass
+
+
+@dataclass
+class PlanStep:
+    kind: str
+    table: str = ''
+    index: str = ''
+    detail: str = ''
+
+    def __str__(self):
+        text = f'{self.kind} {self.table}'.strip()
+        return f'{text} ({self.index})' if self.index else text
+
+
+def explain_sqlite(cursor, sql, params):
+    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+    steps = []
+    for *_, detail in cursor.fetchall():
+        match = SQLITE_STEP.match(detail)
+        if match is None:
+            steps.append(PlanStep(SORT if 'TEMP B-TREE' in detail else OTHER, detail=detail))
+        elif match[1] == 'SEARCH':
+            steps.append(PlanStep(LOOKUP, match[2], match[3] or '', detail))
+        elif match[3]:
+            # An ordered walk of a whole index, or of the rowid
+            steps.append(PlanStep(INDEX_SCAN, match[2], match[3], detail))
+        else:
+            steps.append(PlanStep(SCAN, match[2], detail=detail))
+    return steps
+
+
+def explain_mysql(cursor, sql, params):
+    cursor.execute(f'EXPLAIN {sql}', params)
+    columns = [column[0].lower() for column in cursor.description]
+    steps = []
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        kind = {'ALL': SCAN, 'index': INDEX_SCAN}.get(row['type'], LOOKUP if row['key'] else OTHER)
+        steps.append(PlanStep(kind, row['table'] or '', row['key'] or '', str(row)))
+        if 'Using filesort' in (row['extra'] or ''):
+            steps.append(PlanStep(SORT, row['table'] or '', detail='Using filesort'))
+    return steps
+
+
+def explain_postgresql(cursor, sql, params):
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+    nodes = [(json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']]
+    steps = []
+    while nodes:
+        node = nodes.pop(0)
+        steps.append(PlanStep(POSTGRESQL_NODES.get(node['Node Type'], OTHER), node.get('Relation Name', ''),
+                              node.get('Index Name', ''), node['Node Type']))
+        nodes += node.get('Plans', [])
+    return steps
+
+
+EXPLAINERS = {'sqlite': explain_sqlite, 'mysql': explain_mysql, 'postgresql': explain_postgresql}
+
+
+def explain(queryset):
+    """
+    Returns the PlanSteps of the database's plan for `queryset`.
+    """
+    connection = connections[queryset.db]
+    explainer = EXPLAINERS.get(connection.vendor)
+    if explainer is None:
+        raise UnsupportedDatabase(f'Query plans cannot be audited on {connection.vendor}.')
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        return explainer(cursor, sql, params)
+
+
+def is_filtered(queryset):
+    return bool(queryset.query.where)
+
+
+def full_scans(queryset, steps):
+    """
+    Returns the steps reading every row of a table although the query filters its rows. Unfiltered
+    list queries read the whole table by design and are never reported.
+    """
+    if not is_filtered(queryset):
+        return []
+    return [step for step in steps if step.kind in (SCAN, INDEX_SCAN)]
+
+
+def viewset_queryset(viewset, user, params=None, action='list'):
+    """
+    Returns the filtered queryset `viewset` would run for a GET request by `user` with `params`.
+    """
+    request = Request(APIRequestFactory().get('/', params or {}))
+    request.user = user
+    view = viewset(request=request, args=(), kwargs={}, format_kwarg=None, action=action)
+    return view.filter_queryset(view.get_queryset())
+
+
+def filter_value(queryset, field):
+    # A value of `field` that exists, so every filter is explained with a selective, realistic lookup
+    value = queryset.exclude(**{f'{field}__isnull': True}).values_list(field, flat=True).first()
+    return None if value is None else str(value)
+
+
+def viewset_queries(router, user):
+    """
+    Lists (name, queryset) for the list route of every viewset registered on `router`, its detail
+    lookup and each of its filterset fields.
+    """
+    queries = []
+    for _, viewset, basename in router.registry:
+        queryset = viewset_queryset(viewset, user)
+        page_size = getattr(getattr(viewset, 'pagination_class', None), 'page_size', None)
+        queries.append((f'{basename}-list', queryset[:page_size] if page_size else queryset))
+
+        pk = queryset.values_list('pk', flat=True).first()
+        if pk is not None:
+            queries.append((f'{basename}-detail', viewset_queryset(viewset, user, action='retrieve').filter(pk=pk)))
+
+        for field in getattr(viewset, 'filterset_fields', None) or ():
+            value = filter_value(queryset, field)
+            if value is not None:
+                queries.append((f'{basename}-list?{field}=', viewset_queryset(viewset, user, {field: value})))
+    return queries
+
+
+def audit_queries(router, user):
+    """
+    Explains every viewset query and returns {name: (steps, full scans)}.
+    """
+    results = {}
+    for name, queryset in viewset_queries(router, user):
+        steps = explain(queryset)
+        results[name] = (steps, full_scans(queryset, steps))
+    return results
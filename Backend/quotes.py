@@ -0,0 +1,258 @@
+'''
+Concurrent quote fetching from pluggable providers.
+A QuoteService splits the requested instruments into each provider's batch size and runs every
+batch at once on the event loop, with a timeout, retries with backoff and a per-provider rate
+limit around each call. Instruments a provider fails on fall back to the next provider that
+supports their asset class. Providers are configured in QUOTE_PROVIDERS; FakeQuoteProvider serves
+deterministic made-up prices offline for development and tests and is never configured by default.
+'''
+
+import asyncio
+import random
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .models import Instrument
+from .timeseries import get_price_history_store
+
+DEFAULT_QUOTE_SERVICE = {
+    'TIMEOUT': 5.0,
+    'RETRIES': 2,
+    'BACKOFF': 0.2,
+}
+
+
+class QuoteProviderError(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Async token bucket allowing `rate` calls per second with bursts of up to `burst` calls.
+    """
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class QuoteProvider:
+    """
+    Base class of quote providers. Subclasses implement fetch() for up to `max_batch_size`
+    (asset_class, symbol) pairs and return {(asset_class, symbol): (price, quoted_at)} for the
+    ones they could price.
+    """
+    name = 'provider'
+    asset_classes = frozenset(asset_class for asset_class, _ in Instrument.ASSET_CLASS_CHOICES)
+    max_batch_size = 100
+
+    def __init__(self, name=None, asset_classes=None, max_batch_size=None, rate_limit=None, burst=1):
+        if name is not None:
+            self.name = name
+        if asset_classes is not None:
+            self.asset_classes = frozenset(asset_classes)
+        if max_batch_size is not None:
+            self.max_batch_size = max_batch_size
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self._limiters = {}
+
+    @property
+    def limiter(self):
+        # asyncio primitives belong to one event loop, so keep a limiter per loop
+        if self.rate_limit is None:
+            return None
+        loop = asyncio.get_running_loop()
+        if loop not in self._limiters:
+            self._limiters = {loop: RateLimiter(self.rate_limit, self.burst)}
+        return self._limiters[loop]
+
+    def supports(self, asset_class):
+        return asset_class in self.asset_classes
+
+    async def fetch(self, instruments):
+        raise NotImplementedError
+
+
+class FakeQuoteProvider(QuoteProvider):
+    """
+    Offline provider quoting a deterministic price per symbol after `latency` seconds.
+    `failure_rate` makes that fraction of calls raise, to exercise retries.
+    """
+    name = 'fake'
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0, prices=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.prices = dict(prices or {})
+        self.calls = 0
+
+    def price(self, asset_class, symbol):
+        if (asset_class, symbol) in self.prices:
+            return Decimal(str(self.prices[(asset_class, symbol)]))
+        cents = sum(ord(char) * (index + 1) for index, char in enumerate(f'{asset_class}:{symbol}'))
+        return Decimal(1000 + cents % 100000) / 100
+
+    async def fetch(self, instruments):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            raise QuoteProviderError(f'{self.name}: simulated failure')
+        now = datetime.now(dt_timezone.utc)
+        return {(asset_class, symbol): (self.price(asset_class, symbol), now) for asset_class, symbol in instruments}
+
+
+class HTTPQuoteProvider(QuoteProvider):
+    """
+    Provider for JSON quote APIs answering GET <url>?asset_class=STOCK&symbols=A,B with
+    {"quotes": [{"symbol": ..., "price": ..., "timestamp": <epoch seconds>}]}.
+    A symbol can be listed under several asset classes, so each asset class in a batch is requested
+    separately. The blocking HTTP calls run in worker threads so they still overlap on the event loop.
+    """
+    name = 'http'
+
+    def __init__(self, url, api_key=None, request_timeout=10.0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.api_key = api_key
+        self.request_timeout = request_timeout
+        self.session = requests.Session()
+
+    def get(self, asset_class, symbols):
+        headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+        response = self.session.get(self.url, params={'asset_class': asset_class, 'symbols': ','.join(symbols)},
+                                    headers=headers, timeout=self.request_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch(self, instruments):
+        symbols_by_class = {}
+        for asset_class, symbol in instruments:
+            symbols_by_class.setdefault(asset_class, []).append(symbol)
+        loop = asyncio.get_running_loop()
+        try:
+            payloads = await asyncio.gather(*(loop.run_in_executor(None, self.get, asset_class, symbols)
+                                              for asset_class, symbols in symbols_by_class.items()))
+        except (requests.RequestException, ValueError) as exc:
+            raise QuoteProviderError(f'{self.name}: {exc}') from exc
+        quotes = {}
+        for (asset_class, symbols), payload in zip(symbols_by_class.items(), payloads):
+            requested = set(symbols)
+            for quote in payload.get('quotes', []):
+                if quote.get('symbol') in requested and quote.get('price') is not None:
+                    quoted_at = (datetime.fromtimestamp(quote['timestamp'], tz=dt_timezone.utc) if quote.get('timestamp')
+                                 else datetime.now(dt_timezone.utc))
+                    quotes[(asset_class, quote['symbol'])] = (Decimal(str(quote['price'])), quoted_at)
+        return quotes
+
+
+class QuoteService:
+    """
+    Fans quote lookups out over providers concurrently.
+    """
+    def __init__(self, providers, timeout=5.0, retries=2, backoff=0.2):
+        self.providers = list(providers)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    async def call(self, provider, batch):
+        """
+        Fetches one batch from one provider, retrying timeouts and provider errors.
+        """
+        for attempt in range(self.retries + 1):
+            if provider.limiter is not None:
+                await provider.limiter.acquire()
+            try:
+                return await asyncio.wait_for(provider.fetch(batch), self.timeout)
+            except (asyncio.TimeoutError, QuoteProviderError):
+                if attempt == self.retries:
+                    return {}
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def fetch_quotes(self, instruments):
+        """
+        Quotes (asset_class, symbol) pairs. Returns (quotes, missing) where quotes are
+        (asset_class, symbol, price, quoted_at) tuples, as taken by Instrument.objects.upsert_quotes(),
+        and missing lists the pairs no provider could price.
+        """
+        pending = list(dict.fromkeys(instruments))
+        quotes = {}
+        for provider in self.providers:
+            batch_input = [instrument for instrument in pending if provider.supports(instrument[0])]
+            if not batch_input:
+                continue
+            size = provider.max_batch_size
+            batches = [batch_input[start:start + size] for start in range(0, len(batch_input), size)]
+            for result in await asyncio.gather(*(self.call(provider, batch) for batch in batches)):
+                quotes.update(result)
+            pending = [instrument for instrument in pending if instrument not in quotes]
+            if not pending:
+                break
+        return ([(asset_class, symbol, price, quoted_at) for (asset_class, symbol), (price, quoted_at) in quotes.items()],
+                pending)
+
+    async def refresh(self, instruments=None, history=True):
+        """
+        Quotes `instruments` (all listed instruments by default), upserts the latest prices and
+        appends them to the price history. Returns (updated, missing).
+        """
+        if instruments is None:
+            instruments = await sync_to_async(list)(Instrument.objects.values_list('asset_class', 'symbol'))
+        quotes, missing = await self.fetch_quotes(instruments)
+        if quotes:
+            await sync_to_async(Instrument.objects.upsert_quotes)(quotes)
+            if history:
+                await sync_to_async(get_price_history_store().append_many)(quotes)
+        return len(quotes), missing
+
+
+def quote_service_from_settings():
+    """
+    Builds a QuoteService from QUOTE_PROVIDERS and QUOTE_SERVICE. Raises ImproperlyConfigured
+    without a provider, rather than refreshing nothing.
+    """
+    if not getattr(settings, 'QUOTE_PROVIDERS', []):
+        raise ImproperlyConfigured('QUOTE_PROVIDERS is empty; configure a quote provider, e.g. with QUOTE_API_URL.')
+    options = {**DEFAULT_QUOTE_SERVICE, **getattr(settings, 'QUOTE_SERVICE', {})}
+    providers = [import_string(provider['BACKEND'])(**provider.get('OPTIONS', {}))
+                 for provider in getattr(settings, 'QUOTE_PROVIDERS', [])]
+    return QuoteService(providers, timeout=options['TIMEOUT'], retries=options['RETRIES'], backoff=options['BACKOFF'])
+
+
+_service = None
+
+
+def get_quote_service():
+    global _service
+    if _service is None:
+        _service = quote_service_from_settings()
+    return _service
+
+
+def reset_quote_service():
+    global _service
+    _service = None
@@ -0,0 +1,197 @@
+'''
+Batch rebalancing of portfolios towards their TargetAllocation weights.
+Portfolios are processed in chunks. Each chunk is loaded with a few grouped queries into a
+portfolios x instruments quantity matrix, and plan_trades() computes every trade of the chunk with
+array operations: target values from the weights, whole target quantities rounded towards the
+current holding, then orders under the minimum trade size are dropped. Prices are converted to the
+FX pivot currency first, so lines quoted in different currencies are weighed against each other at
+their exchange rate; instruments without a rate are treated as unpriced. With PROCESSES > 1, as
+used by manage.py rebalance_portfolios, the chunks are computed on a process pool while the next
+ones load; the API plans in the request's process. The result is a list of orders in
+the format taken by Backend/trading.py execute_orders(), which execute_rebalance() fills for every
+owner in one transaction.
+'''
+
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .fx import convert_amounts, fx_settings
+from .models import Instrument, Portfolio, TargetAllocation, HOLDING_MODELS
+from .pricecache import get_price_cache
+from .trading import execute_orders
+
+ASSET_CLASSES = [asset_class for asset_class, _ in Instrument.ASSET_CLASS_CHOICES]
+
+DEFAULT_REBALANCING = {
+    # Orders worth less than this, in the FX pivot currency, or for fewer units, are not proposed
+    'MIN_TRADE_VALUE': '10.00',
+    'MIN_TRADE_QUANTITY': 1,
+    # Portfolios per chunk, and processes computing chunks; 1 computes them in the calling process
+    'CHUNK_SIZE': 1000,
+    'PROCESSES': 1,
+}
+
+# Tolerance of the sum of a portfolio's target weights around 1
+WEIGHT_TOLERANCE = Decimal('0.0001')
+
+
+def rebalancing_settings():
+    return {**DEFAULT_REBALANCING, **getattr(settings, 'REBALANCING', {})}
+
+
+def plan_trades(quantities, prices, weights, class_weights, classes, min_value=0.0, min_quantity=1):
+    """
+    Computes the trades rebalancing P portfolios over N instruments.
+    `quantities` is the (P, N) held quantity, `prices` the (N,) price with NaN where unknown,
+    `weights` the (P, N) instrument target weights with NaN where there is none, `class_weights`
+    the (P, K) asset class target weights and `classes` the (N,) asset class index of each instrument.
+    An asset class weight is spread over the portfolio's holdings of the class that have no
+    instrument target, in proportion to their current value; holdings covered by no target are sold.
+    Returns (trades, unreachable): the (P, N) signed quantity to trade and a (P,) flag of portfolios
+    with a target that cannot be met, for lack of a price or of holdings to spread a class over.
+    Unpriced instruments are never traded.
+    """
+    quantities = np.asarray(quantities, dtype=np.int64)
+    priced = ~np.isnan(prices)
+    price = np.where(priced, prices, 0.0)
+    values = quantities * price
+    totals = values.sum(axis=1)
+
+    targeted = ~np.isnan(weights)
+    target_weights = np.where(targeted, weights, 0.0)
+    membership = (classes[:, None] == np.arange(class_weights.shape[1])).astype(float)
+    eligible = np.where(targeted, 0.0, values)
+    class_values = eligible @ membership
+    spread_over = class_values @ membership.T
+    shares = np.divide(eligible, spread_over, out=np.zeros_like(eligible), where=spread_over > 0)
+    target_weights += shares * (class_weights @ membership.T)
+    unreachable = (((class_weights > 0) & (class_values <= 0)).any(axis=1)
+                   | (targeted & (weights > 0) & ~priced).any(axis=1))
+
+    desired = np.divide(target_weights * totals[:, None], price, out=np.zeros_like(values), where=priced)
+    # Whole quantities are rounded towards the current holding so no trade overshoots its target and a
+    # rebalanced portfolio proposes nothing more; the epsilon absorbs floating point error on exact targets
+    targets = np.where(desired >= quantities, np.floor(desired + 1e-9), np.ceil(desired - 1e-9)).astype(np.int64)
+    trades = np.where(priced, targets - quantities, 0)
+    trades[(np.abs(trades) < min_quantity) | (np.abs(trades) * price < min_value)] = 0
+    return trades, unreachable
+
+
+def plan_chunk(chunk):
+    """
+    Runs plan_trades() on a loaded chunk and returns (portfolio ids, instrument ids, trades, unreachable).
+    """
+    portfolio_ids, instrument_ids, arrays, options = chunk
+    trades, unreachable = plan_trades(*arrays, **options)
+    return portfolio_ids, instrument_ids, trades, unreachable
+
+
+def load_chunk(portfolio_ids):
+    """
+    Loads a chunk of portfolios with one grouped query per holding model, one for targets and one
+    for instruments. Returns (instrument ids, plan_trades() arguments).
+    """
+    rows = {pk: row for row, pk in enumerate(portfolio_ids)}
+    held = [np.array(list(model.objects.filter(portfolio__in=portfolio_ids).quantity_by_instrument()),
+                     dtype=np.int64).reshape(-1, 3) for model in HOLDING_MODELS]
+    held = np.concatenate(held)
+    targets = list(TargetAllocation.objects.filter(portfolio__in=portfolio_ids)
+                   .values_list('portfolio', 'instrument', 'asset_class', 'weight'))
+
+    instrument_ids = sorted(set(held[:, 1].tolist()) | {instrument for _, instrument, _, _ in targets if instrument})
+    columns = {pk: column for column, pk in enumerate(instrument_ids)}
+    instruments = {pk: (asset_class, currency) for pk, asset_class, currency in
+                   Instrument.objects.filter(pk__in=instrument_ids).values_list('pk', 'asset_class', 'currency')}
+    classes = np.array([ASSET_CLASSES.index(instruments[pk][0]) for pk in instrument_ids], dtype=np.int64)
+    cached = get_price_cache().get_many(instrument_ids)
+    prices = convert_amounts([np.nan if cached.get(pk) is None else float(cached[pk]) for pk in instrument_ids],
+                             [instruments[pk][1] for pk in instrument_ids], fx_settings()['PIVOT'])
+
+    quantities = np.zeros((len(portfolio_ids), len(instrument_ids)), dtype=np.int64)
+    np.add.at(quantities, ([rows[pk] for pk in held[:, 0].tolist()], [columns[pk] for pk in held[:, 1].tolist()]),
+              held[:, 2])
+    weights = np.full(quantities.shape, np.nan)
+    class_weights = np.zeros((len(portfolio_ids), len(ASSET_CLASSES)))
+    for portfolio, instrument, asset_class, weight in targets:
+        if instrument:
+            weights[rows[portfolio], columns[instrument]] = float(weight)
+        else:
+            class_weights[rows[portfolio], ASSET_CLASSES.index(asset_class)] = float(weight)
+    return instrument_ids, (quantities, prices, weights, class_weights, classes)
+
+
+def chunk_orders(portfolio_ids, instrument_ids, trades):
+    """
+    Turns a chunk's trade matrix into orders, sells before buys within each portfolio.
+    """
+    rows, columns = np.nonzero(trades)
+    quantities = trades[rows, columns]
+    order = np.lexsort((columns, quantities > 0, rows))
+    portfolio_ids = np.asarray(portfolio_ids)[rows[order]].tolist()
+    instrument_ids = np.asarray(instrument_ids)[columns[order]].tolist()
+    return [{'portfolio': portfolio, 'instrument': instrument, 'trade_type': 'BUY' if quantity > 0 else 'SELL',
+             'trade_quantity': abs(quantity)}
+            for portfolio, instrument, quantity in zip(portfolio_ids, instrument_ids, quantities[order].tolist())]
+
+
+def rebalance(portfolio_ids=None, processes=None, chunk_size=None):
+    """
+    Proposes the orders rebalancing the given portfolios, every portfolio with targets by default.
+    Returns (orders, unreachable portfolio ids). Portfolios without targets are left alone. Callers
+    running other threads, such as request handlers, must pass processes=1.
+    """
+    options = rebalancing_settings()
+    processes = processes or options['PROCESSES']
+    chunk_size = chunk_size or options['CHUNK_SIZE']
+    with_targets = TargetAllocation.objects.order_by().values_list('portfolio', flat=True).distinct()
+    if portfolio_ids is not None:
+        with_targets = with_targets.filter(portfolio__in=portfolio_ids)
+    portfolio_ids = sorted(with_targets)
+    plan_options = {'min_value': float(options['MIN_TRADE_VALUE']), 'min_quantity': options['MIN_TRADE_QUANTITY']}
+
+    def chunks():
+        for start in range(0, len(portfolio_ids), chunk_size):
+            chunk = portfolio_ids[start:start + chunk_size]
+            instrument_ids, arrays = load_chunk(chunk)
+            yield chunk, instrument_ids, arrays, plan_options
+
+    if processes > 1:
+        # Only for single-threaded callers such as the management command: a fork there copies no
+        # other thread's held locks, and workers only run the NumPy kernel, never touching the
+        # database connection they inherit. Chunks keep loading while earlier ones are computed.
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            results = [future.result() for future in [executor.submit(plan_chunk, chunk) for chunk in chunks()]]
+    else:
+        results = [plan_chunk(chunk) for chunk in chunks()]
+
+    orders, unreachable = [], []
+    for chunk, instrument_ids, trades, flags in results:
+        orders += chunk_orders(chunk, instrument_ids, trades)
+        unreachable += np.asarray(chunk)[flags].tolist()
+    return orders, unreachable
+
+
+def execute_rebalance(orders):
+    """
+    Fills rebalancing orders, which may span several users' portfolios, in one transaction.
+    Returns the created trades; raises ValidationError and writes nothing if any order is rejected.
+    """
+    owners = dict(Portfolio.objects.filter(pk__in={order['portfolio'] for order in orders})
+                  .values_list('pk', 'user'))
+    by_owner = defaultdict(list)
+    for order in orders:
+        by_owner[owners[order['portfolio']]].append(order)
+    users = User.objects.in_bulk(by_owner)
+    trades = []
+    with transaction.atomic():
+        for owner in sorted(by_owner):
+            trades += execute_orders(users[owner], by_owner[owner])
+    return trades
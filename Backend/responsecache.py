@@ -0,0 +1,220 @@
+'''
+Conditional GET and server-side caching of rendered API responses.
+Cached views name the scopes their content depends on, such as 'faq' or 'portfolio:12'. Each scope
+has a version (a random token and the time it last changed) kept in a Django cache, and writes bump
+the versions of exactly the scopes they touch once their transaction commits. A response is cached
+under a key derived from its scope versions, view, URL, media type and, for private data, user, and
+that key doubles as its ETag. Repeated requests are answered from the cache, or with 304 Not
+Modified, without querying the database or running serializers; a bump makes old keys unreachable.
+Without a configured cache, views still send an ETag hashed from the rendered body and answer a
+matching If-None-Match with 304, which saves the transfer but not the work.
+'''
+
+import functools
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .models import holding_portfolios
+
+DEFAULT_RESPONSE_CACHE = {
+    # Alias of a cache shared by every process; None disables response caching
+    'CACHE_ALIAS': None,
+    # Seconds a rendered response is kept; invalidation does not depend on it
+    'TIMEOUT': 300,
+}
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+# Scope bumped along with every portfolio:<id> scope, for views spanning many portfolios
+ALL_HOLDINGS = 'holdings'
+# Scope bumped when exchange rates change, for views converting amounts between currencies
+FX_RATES = 'fx-rates'
+
+
+def response_cache_settings():
+    return {**DEFAULT_RESPONSE_CACHE, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+@checks.register(checks.Tags.caches)
+def check_response_cache(app_configs=None, **kwargs):
+    """
+    Warns at startup when responses are cached where other processes cannot bump their versions.
+    """
+    alias = response_cache_settings()['CACHE_ALIAS']
+    if alias is None:
+        return []
+    if alias not in settings.CACHES:
+        return [checks.Error(f"RESPONSE_CACHE['CACHE_ALIAS'] {alias!r} is not one of CACHES.", id='Backend.E001')]
+    if settings.CACHES[alias].get('BACKEND') in PROCESS_LOCAL_CACHES:
+        return [checks.Warning(
+            f"RESPONSE_CACHE['CACHE_ALIAS'] {alias!r} is local to each process, so writes in other processes "
+            "never invalidate its responses.",
+            hint='Use a cache shared by every process, such as Redis or Memcached, or set CACHE_ALIAS to None.',
+            id='Backend.W001')]
+    return []
+
+
+class ResponseCache:
+    """
+    Scope versions and rendered responses stored in one Django cache.
+    """
+    key_prefix = 'response:'
+
+    def __init__(self, cache_alias='default', timeout=300):
+        self.cache = caches[cache_alias]
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        options = response_cache_settings()
+        return cls(cache_alias=options['CACHE_ALIAS'], timeout=options['TIMEOUT'])
+
+    def version_key(self, scope):
+        return f'{self.key_prefix}version:{scope}'
+
+    def versions(self, scopes):
+        """
+        Returns {scope: (token, modified)}, starting unseen scopes at a new version.
+        """
+        found = self.cache.get_many([self.version_key(scope) for scope in scopes])
+        versions = {}
+        for scope in scopes:
+            version = found.get(self.version_key(scope))
+            if version is None:
+                version = (uuid.uuid4().hex, time.time())
+                # Another process may have started the scope first, so keep whichever was stored
+                if not self.cache.add(self.version_key(scope), version, None):
+                    version = self.cache.get(self.version_key(scope), version)
+            versions[scope] = version
+        return versions
+
+    def bump(self, scopes):
+        now = time.time()
+        self.cache.set_many({self.version_key(scope): (uuid.uuid4().hex, now) for scope in scopes}, None)
+
+    def get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def store(self, key, response):
+        headers = {name: value for name, value in response.items() if name.lower() != 'server-timing'}
+        self.cache.set(self.key_prefix + key, (response.status_code, headers, response.content), self.timeout)
+
+
+def get_response_cache():
+    """
+    Returns the configured ResponseCache, or None when response caching is disabled.
+    """
+    if response_cache_settings()['CACHE_ALIAS'] is None:
+        return None
+    return ResponseCache.from_settings()
+
+
+def reset_response_cache():
+    """
+    Empties the cache holding responses and versions. Tests run inside transactions that never
+    commit, so their writes do not invalidate anything by themselves.
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.cache.clear()
+
+
+def bump(scopes):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.bump(scopes)
+
+
+def invalidate(*scopes):
+    """
+    Bumps the given scopes once the current transaction commits, so a response rendered from
+    uncommitted data can never be cached under the new version.
+    """
+    if scopes:
+        transaction.on_commit(lambda: bump(scopes))
+
+
+def invalidate_portfolios(portfolio_ids):
+    """
+    Invalidates responses derived from the holdings or values of the given portfolios.
+    """
+    portfolio_ids = set(portfolio_ids)
+    if portfolio_ids:
+        invalidate(ALL_HOLDINGS, *(f'portfolio:{portfolio_id}' for portfolio_id in sorted(portfolio_ids)))
+
+
+def invalidate_instruments(instrument_ids):
+    """
+    Invalidates the portfolios holding any of the given instruments, after their prices changed.
+    """
+    invalidate_portfolios(holding_portfolios(instrument_ids))
+
+
+def not_modified_by_content(request, response):
+    """
+    Post render callback setting an ETag hashed from the rendered body, and returning 304 Not
+    Modified instead when the request's If-None-Match already names it.
+    """
+    response['ETag'] = quote_etag(hashlib.sha1(response.content).hexdigest())
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+def cache_response(*scopes, per_user=False):
+    """
+    Decorates a viewset handler to serve GET requests with ETag and Last-Modified validators from
+    the response cache. Scopes are formatted with the URL keyword arguments, e.g. 'portfolio:{pk}'.
+    Set `per_user` for private data so users never share cached responses. Permission checks still
+    run before the handler, as for any DRF view. Without a response cache the handler runs on every
+    request and only the content ETag is sent.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(self, request, *args, **kwargs)
+            cache = get_response_cache()
+            if cache is None:
+                response = method(self, request, *args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200:
+                    response.add_post_render_callback(functools.partial(not_modified_by_content, request))
+                return response
+            versions = cache.versions([scope.format(**kwargs) for scope in scopes])
+            identity = [f'{type(self).__name__}.{method.__name__}', request.get_full_path(),
+                        request.accepted_media_type, str(request.user.pk) if per_user else '']
+            identity += [f'{scope}={token}' for scope, (token, _) in sorted(versions.items())]
+            key = hashlib.sha1('\n'.join(identity).encode()).hexdigest()
+            modified = int(max(modified for _, modified in versions.values()))
+            validators = {'ETag': quote_etag(key), 'Last-Modified': http_date(modified)}
+
+            response = get_conditional_response(request, etag=validators['ETag'], last_modified=modified)
+            if response is None:
+                cached = cache.get(key)
+                if cached is not None:
+                    status, headers, content = cached
+                    response = HttpResponse(content, status=status)
+                    validators.update(headers)
+            if response is not None:
+                for name, value in validators.items():
+                    response[name] = value
+                return response
+
+            response = method(self, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                for name, value in validators.items():
+                    response[name] = value
+                # DRF responses are rendered after the view returns, so store them once they are
+                response.add_post_render_callback(functools.partial(cache.store, key))
+            return response
+        return wrapper
+    return decorator
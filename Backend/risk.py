@@ -0,0 +1,204 @@
+'''
+Value-at-Risk and expected shortfall of a portfolio by Monte Carlo and historical simulation.
+Daily log returns of every position are read from the price history into one days x instruments
+matrix. Monte Carlo paths draw horizon returns from a multivariate normal with the sample mean and
+covariance of those returns. Correlation comes from the singular value decomposition of the centered
+return matrix, which needs no positive definite covariance, so it stays valid when there are fewer days
+than positions, and each path draws only as many normals as the covariance's rank. Paths are drawn
+in single precision, one matrix product per shard of SHARD_PATHS paths. Each shard is seeded from a
+spawned SeedSequence, so a seed gives the same result whether the shards run in this process or on
+the PROCESSES worker pool. Historical simulation revalues the portfolio under every observed
+horizon-long return instead. Each process keeps the last RESULT_CACHE_SIZE results keyed by a hash
+of their inputs, the closes, position values and parameters, so repeated requests skip the
+simulation whether or not a response cache is configured, and any change of holdings, prices or
+exchange rates changes the key.
+'''
+
+import copy
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_RISK = {
+    'CONFIDENCE': 0.99,
+    'HORIZON_DAYS': 1,
+    'MAX_HORIZON_DAYS': 252,
+    # Days of price history the return model is estimated from, unless ?start= is given
+    'LOOKBACK_DAYS': 365,
+    'PATHS': 10000,
+    'MAX_PATHS': 100000,
+    # Paths drawn per shard; fixed so results do not depend on the number of processes
+    'SHARD_PATHS': 10000,
+    'SEED': 0,
+    # Worker processes shards are simulated on; 1 simulates them in the calling process
+    'PROCESSES': 1,
+    # Results kept per process, keyed by their inputs; 0 disables reuse
+    'RESULT_CACHE_SIZE': 128,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+
+def risk_settings():
+    return {**DEFAULT_RISK, **getattr(settings, 'RISK', {})}
+
+
+def get_simulation_pool():
+    """
+    Returns the process-wide simulation pool, started on first use, or None with PROCESSES <= 1.
+    """
+    global _pool
+    processes = risk_settings()['PROCESSES']
+    if processes <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # The pool starts inside threaded servers, where a fork would copy other threads' held
+            # locks and open database connections. Workers start from a fresh interpreter instead,
+            # which only imports this module, without Django, to run the NumPy kernel.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+        return _pool
+
+
+def shutdown_simulation_pool():
+    """
+    Stops the simulation pool so the next use starts a new one from settings.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def log_returns(closes):
+    """
+    Daily log returns of aligned closes. Instruments without history, and non-positive prices,
+    contribute zero return.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(np.log(np.where(closes > 0, closes, np.nan)), axis=0)
+    return np.nan_to_num(returns, nan=0, posinf=0, neginf=0)
+
+
+def simulate_shard(shard):
+    """
+    Draws one shard of horizon returns and returns the portfolio P&L of each path.
+    """
+    seed, paths, loadings, drift, values = shard
+    shocks = np.random.default_rng(seed).standard_normal((paths, loadings.shape[0]), dtype=np.float32)
+    return (np.expm1(shocks @ loadings + drift) @ values).astype(float)
+
+
+def monte_carlo_pnl(returns, values, horizon=1, paths=10000, seed=0, shard_paths=10000, pool=None):
+    """
+    Simulates `paths` P&L outcomes over `horizon` days from daily log returns (days x instruments)
+    and the current market value of each instrument.
+    """
+    observations = len(returns)
+    centered = returns - returns.mean(axis=0)
+    # covariance = centered.T @ centered / (T - 1) = (S V).T (S V) / (T - 1), so normals times the
+    # scaled components have that covariance; directions without variance are dropped
+    _, singular, components = np.linalg.svd(centered, full_matrices=False)
+    ranks = singular > singular.max(initial=0) * 1e-10
+    # N(h * mean, h * covariance) is the sum of h independent daily returns
+    loadings = (singular[ranks, None] * components[ranks]) * np.sqrt(horizon / max(observations - 1, 1))
+    loadings = loadings.astype(np.float32)
+    drift = (returns.mean(axis=0) * horizon).astype(np.float32)
+    values = np.asarray(values, dtype=np.float32)
+    sizes = [min(shard_paths, paths - start) for start in range(0, paths, shard_paths)]
+    shards = [(seed_sequence, size, loadings, drift, values)
+              for seed_sequence, size in zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes)]
+    if pool is None:
+        return np.concatenate([simulate_shard(shard) for shard in shards])
+    return np.concatenate(list(pool.map(simulate_shard, shards)))
+
+
+def historical_pnl(returns, values, horizon=1):
+    """
+    P&L of the current holdings under every overlapping `horizon` day window of observed returns.
+    """
+    if len(returns) < horizon:
+        return np.empty(0)
+    cumulative = np.concatenate([np.zeros((1, returns.shape[1])), np.cumsum(returns, axis=0)])
+    return np.expm1(cumulative[horizon:] - cumulative[:-horizon]) @ values
+
+
+def value_at_risk(pnl, confidence):
+    """
+    Returns (VaR, CVaR) at `confidence` as positive losses, or (None, None) without outcomes.
+    """
+    if len(pnl) == 0:
+        return None, None
+    losses = -np.asarray(pnl)
+    var = np.quantile(losses, confidence)
+    return float(var), float(losses[losses >= var].mean())
+
+
+def simulation_key(closes, values, *parameters):
+    digest = hashlib.sha1(repr((closes.shape, parameters)).encode())
+    digest.update(np.ascontiguousarray(closes, dtype=float).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def reset_risk_results():
+    """
+    Forgets the results kept by portfolio_risk() in this process.
+    """
+    with _results_lock:
+        _results.clear()
+
+
+def portfolio_risk(closes, values, horizon=1, confidence=0.99, paths=10000, seed=0):
+    """
+    Monte Carlo and historical VaR and CVaR of holdings worth `values`, from aligned daily closes.
+    Shards run on the simulation pool when PROCESSES is above 1. A result computed earlier in this
+    process from the same inputs is returned without simulating again.
+    """
+    options = risk_settings()
+    closes = np.asarray(closes, dtype=float)
+    values = np.asarray(values, dtype=float)
+    key = None
+    if options['RESULT_CACHE_SIZE'] > 0:
+        key = simulation_key(closes, values, horizon, confidence, paths, seed, options['SHARD_PATHS'])
+        with _results_lock:
+            if key in _results:
+                _results.move_to_end(key)
+                return copy.deepcopy(_results[key])
+    result = simulate_risk(closes, values, horizon, confidence, paths, seed, options['SHARD_PATHS'])
+    if key is not None:
+        with _results_lock:
+            _results[key] = copy.deepcopy(result)
+            while len(_results) > options['RESULT_CACHE_SIZE']:
+                _results.popitem(last=False)
+    return result
+
+
+def simulate_risk(closes, values, horizon, confidence, paths, seed, shard_paths):
+    returns = log_returns(closes) if len(closes) > 1 else np.empty((0, len(values)))
+    result = {
+        'total_value': float(values.sum()),
+        'observations': len(returns),
+        'monte_carlo': {'var': None, 'cvar': None},
+        'historical': {'var': None, 'cvar': None},
+    }
+    if len(returns) < 2:
+        return result
+
+    pnl = monte_carlo_pnl(returns, values, horizon, paths, seed, shard_paths, get_simulation_pool())
+    var, cvar = value_at_risk(pnl, confidence)
+    result['monte_carlo'] = {'var': var, 'cvar': cvar}
+    var, cvar = value_at_risk(historical_pnl(returns, values, horizon), confidence)
+    result['historical'] = {'var': var, 'cvar': cvar}
+    return result
@@ -0,0 +1,93 @@
+'''
+Database routing between the relational database, the document store and read replicas.
+Append-only history (DOCUMENT_MODELS) is read from and written to DOCUMENT_ALIAS, and only migrated
+there. Everything else stays on 'default', including VirtualTrade: trades are executed in one
+transaction with holdings and positions, so TradeEvent is an extra copy of each trade rather than a
+replacement, and trade history does not reduce write volume on 'default'. Price ticks and valuation
+snapshots are only written to the document store. List endpoints using ReplicaReadMixin read from a random
+READ_REPLICAS alias, unless the request is inside a transaction on 'default' and must see its writes.
+'''
+
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULT_STORAGE_ROUTING = {
+    # Database of append-only history; None keeps it on 'default'
+    'DOCUMENT_ALIAS': None,
+    'DOCUMENT_MODELS': ['Backend.TradeEvent', 'Backend.PriceTick', 'Backend.ValuationSnapshot'],
+    # Aliases replicating 'default', read by list endpoints
+    'READ_REPLICAS': [],
+    # Rows per bulk insert into the document store
+    'BATCH_SIZE': 1000,
+}
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def storage_routing_settings():
+    return {**DEFAULT_STORAGE_ROUTING, **getattr(settings, 'STORAGE_ROUTING', {})}
+
+
+def is_document_model(model):
+    return model._meta.label.lower() in {label.lower() for label in storage_routing_settings()['DOCUMENT_MODELS']}
+
+
+@contextmanager
+def replica_reads():
+    """
+    Lets reads of relational models inside the block go to a read replica.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class StorageRouter:
+    """
+    Routes document models to DOCUMENT_ALIAS and replica-safe reads to READ_REPLICAS.
+    """
+    def db_for_read(self, model, **hints):
+        options = storage_routing_settings()
+        if is_document_model(model):
+            return options['DOCUMENT_ALIAS']
+        if options['READ_REPLICAS'] and _replica_reads.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return random.choice(options['READ_REPLICAS'])
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_document_model(model):
+            return storage_routing_settings()['DOCUMENT_ALIAS']
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as 'default', so objects read from either may be related
+        relational = {DEFAULT_DB_ALIAS, *storage_routing_settings()['READ_REPLICAS']}
+        if obj1._state.db in relational and obj2._state.db in relational:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        options = storage_routing_settings()
+        if db in options['READ_REPLICAS']:
+            return False
+        alias = options['DOCUMENT_ALIAS']
+        if alias is None or model_name is None:
+            return None
+        documents = {label.lower() for label in options['DOCUMENT_MODELS']}
+        return (db == alias) == (f'{app_label}.{model_name}'.lower() in documents)
+
+
+class ReplicaReadMixin:
+    """
+    Serves list() from a read replica when READ_REPLICAS are configured. Replicas lag behind
+    'default', so leave it off views whose responses are cached on write invalidation.
+    """
+    def list(self, request, *args, **kwargs):
+        with replica_reads():
+            return super().list(request, *args, **kwargs)
@@ -0,0 +1,16 @@
+'''
+Routes of the push streams, served by the ASGI application next to the Django views.
+'''
+
+from django.urls import path
+
+from .consumers import PortfolioValueConsumer, PortfolioValueEventStream
+
+websocket_urlpatterns = [
+    path('ws/portfolios/', PortfolioValueConsumer.as_asgi(), name='portfolio-stream-ws'),
+]
+
+# Server-sent events are plain HTTP, served under stream/ ahead of the Django application
+stream_urlpatterns = [
+    path('portfolios/', PortfolioValueEventStream.as_asgi(), name='portfolio-stream-sse'),
+]
@@ -0,0 +1,291 @@
+'''
+Background refresh of instrument prices.
+PriceScheduler keeps every instrument on a refresh timetable: instruments held in a portfolio or
+traded recently are due every HOT_INTERVAL seconds, the others every IDLE_INTERVAL. Due instruments
+are fetched in batches on a thread pool. Prices live on the shared Instrument row, so a symbol held
+by many portfolios is fetched once and is never queued again while a fetch for it is running.
+Finished batches are written with one bulk upsert per tick. Dispatch stops at MAX_IN_FLIGHT batches,
+so a slow provider shows up as backlog and lag instead of an ever growing queue.
+'''
+
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Instrument, VirtualTrade, HOLDING_MODELS
+from .timeseries import get_price_history_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRICE_WORKER = {
+    # Refresh period in seconds of held or recently traded instruments, and of all others
+    'HOT_INTERVAL': 15,
+    'IDLE_INTERVAL': 600,
+    'TRADED_WITHIN_DAYS': 7,
+    'WORKERS': 8,
+    'BATCH_SIZE': 100,
+    'MAX_IN_FLIGHT': 16,
+    # Seconds between rereading which instruments exist and which are held or traded
+    'RESCAN_INTERVAL': 60,
+}
+
+
+def price_worker_settings():
+    return {**DEFAULT_PRICE_WORKER, **getattr(settings, 'PRICE_WORKER', {})}
+
+
+def instrument_priorities(traded_since):
+    """
+    Returns {instrument id: (asset_class, symbol, score)}, where the score counts the holdings of
+    the instrument plus its trades since `traded_since`.
+    """
+    scores = {}
+    for model in HOLDING_MODELS:
+        for instrument_id, count in (model.objects.order_by().values('instrument')
+                                     .annotate(count=Count('pk')).values_list('instrument', 'count')):
+            scores[instrument_id] = scores.get(instrument_id, 0) + count
+    for instrument_id, count in (VirtualTrade.objects.filter(trade_date__gte=traded_since).order_by()
+                                 .values('instrument').annotate(count=Count('pk')).values_list('instrument', 'count')):
+        scores[instrument_id] = scores.get(instrument_id, 0) + count
+    return {pk: (asset_class, symbol, scores.get(pk, 0))
+            for pk, asset_class, symbol in Instrument.objects.values_list('pk', 'asset_class', 'symbol')}
+
+
+class QuoteServiceFetcher:
+    """
+    Blocking fetch function over a QuoteService. Every worker thread submits to one background
+    event loop, so provider rate limits are shared by all workers.
+    """
+    def __init__(self, service):
+        self.service = service
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='price-worker-loop', daemon=True)
+        self.thread.start()
+
+    def __call__(self, instruments):
+        quotes, _ = asyncio.run_coroutine_threadsafe(self.service.fetch_quotes(instruments), self.loop).result()
+        return quotes
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class WorkerStats:
+    """
+    Counters of a PriceScheduler, plus the lag between when instruments fell due and when they
+    were dispatched, over the last `window` instruments.
+    """
+    def __init__(self, window=10000):
+        self.refreshed = 0
+        self.missing = 0
+        self.batches = 0
+        self.failures = 0
+        self.backlog = 0
+        self.in_flight = 0
+        self.lags = deque(maxlen=window)
+
+    def snapshot(self):
+        lags = np.fromiter(self.lags, dtype=float) if self.lags else np.zeros(1)
+        p50, p95 = np.percentile(lags, [50, 95])
+        return {
+            'refreshed': self.refreshed,
+            'missing': self.missing,
+            'batches': self.batches,
+            'failures': self.failures,
+            'backlog': self.backlog,
+            'in_flight': self.in_flight,
+            'lag_p50_s': round(float(p50), 3),
+            'lag_p95_s': round(float(p95), 3),
+            'lag_max_s': round(float(lags.max()), 3),
+        }
+
+
+class PriceScheduler:
+    """
+    Refreshes instrument prices by priority with `fetch`, a blocking function taking up to
+    `batch_size` (asset_class, symbol) pairs and returning (asset_class, symbol, price, quoted_at)
+    quote tuples. Call tick() in a loop, or run() to loop until stopped.
+    """
+    def __init__(self, fetch, hot_interval=15, idle_interval=600, traded_within=timedelta(days=7), workers=8,
+                 batch_size=100, max_in_flight=16, rescan_interval=60, history=True, clock=time.monotonic):
+        self.fetch = fetch
+        self.hot_interval = hot_interval
+        self.idle_interval = idle_interval
+        self.traded_within = traded_within
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.rescan_interval = rescan_interval
+        self.history = history
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='price-worker')
+        self.instruments = {}
+        # Heap of (due, -score, instrument id); entries whose due time no longer matches self.due are stale
+        self.schedule = []
+        self.due = {}
+        self.in_flight = {}
+        self.next_rescan = None
+        self.stats = WorkerStats()
+
+    def interval(self, score):
+        return self.hot_interval if score else self.idle_interval
+
+    def push(self, pk, due):
+        self.due[pk] = due
+        heapq.heappush(self.schedule, (due, -self.instruments[pk][2], pk))
+
+    def rescan(self, now):
+        """
+        Rereads the instrument priorities. New instruments are due at once, and instruments that
+        became hot are moved up to the hot interval.
+        """
+        priorities = instrument_priorities(timezone.now() - self.traded_within)
+        dispatched = {pk for batch in self.in_flight.values() for pk, _ in batch}
+        for pk in self.instruments.keys() - priorities.keys():
+            del self.instruments[pk]
+            self.due.pop(pk, None)
+        for pk, (asset_class, symbol, score) in priorities.items():
+            self.instruments[pk] = (asset_class, symbol, score)
+            if pk in dispatched:
+                continue
+            if pk not in self.due:
+                self.push(pk, now)
+            elif score and self.due[pk] > now + self.hot_interval:
+                self.push(pk, now + self.hot_interval)
+        self.next_rescan = now + self.rescan_interval
+
+    def dispatch(self, now):
+        """
+        Submits due instruments in batches, most overdue and then highest priority first, until
+        MAX_IN_FLIGHT batches are running.
+        """
+        while len(self.in_flight) < self.max_in_flight and self.schedule and self.schedule[0][0] <= now:
+            batch = []
+            while self.schedule and self.schedule[0][0] <= now and len(batch) < self.batch_size:
+                due, _, pk = heapq.heappop(self.schedule)
+                if self.due.get(pk) == due:
+                    del self.due[pk]
+                    batch.append((pk, due))
+            if batch:
+                self.stats.lags.extend(now - due for _, due in batch)
+                future = self.executor.submit(self.fetch, [self.instruments[pk][:2] for pk, _ in batch])
+                self.in_flight[future] = batch
+        self.stats.backlog = sum(1 for due in self.due.values() if due <= now)
+        self.stats.in_flight = len(self.in_flight)
+
+    def collect(self, timeout=0):
+        """
+        Waits up to `timeout` seconds for running batches, writes the quotes of all finished ones
+        with one bulk upsert and reschedules their instruments.
+        """
+        if not self.in_flight:
+            return 0
+        done, _ = wait(self.in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        now = self.clock()
+        quotes = []
+        for future in done:
+            batch = self.in_flight.pop(future)
+            self.stats.batches += 1
+            try:
+                result = list(future.result())
+            except Exception:
+                logger.exception('Price fetch of %d instruments failed', len(batch))
+                self.stats.failures += 1
+                result = []
+            quotes += result
+            priced = {(asset_class, symbol) for asset_class, symbol, _, _ in result}
+            for pk, _ in batch:
+                if pk not in self.instruments:
+                    continue
+                asset_class, symbol, score = self.instruments[pk]
+                if (asset_class, symbol) not in priced:
+                    self.stats.missing += 1
+                self.push(pk, now + self.interval(score))
+        if quotes:
+            with transaction.atomic():
+                Instrument.objects.upsert_quotes(quotes)
+            if self.history:
+                get_price_history_store().append_many(quotes)
+            self.stats.refreshed += len(quotes)
+        self.stats.in_flight = len(self.in_flight)
+        return len(quotes)
+
+    def tick(self, timeout=0):
+        """
+        One scheduling round: rescan when due, dispatch due instruments and collect finished
+        batches, waiting up to `timeout` seconds for one.
+        """
+        now = self.clock()
+        if self.next_rescan is None or now >= self.next_rescan:
+            self.rescan(now)
+        self.dispatch(now)
+        return self.collect(timeout)
+
+    def idle_time(self, limit):
+        # Time until the next instrument falls due, capped at `limit`
+        if not self.schedule:
+            return limit
+        return min(limit, max(0.0, self.schedule[0][0] - self.clock()))
+
+    def sweep(self):
+        """
+        Refreshes every instrument once and waits for the results.
+        """
+        now = self.clock()
+        self.rescan(now)
+        for pk in list(self.due):
+            self.push(pk, now)
+        while self.in_flight or (self.schedule and self.schedule[0][0] <= now):
+            self.dispatch(now)
+            self.collect(timeout=None)
+
+    def run(self, stop, poll=1.0, report=None, report_every=60):
+        """
+        Ticks until the `stop` event is set, calling `report` with a stats snapshot every
+        `report_every` seconds.
+        """
+        next_report = self.clock() + report_every
+        while not stop.is_set():
+            self.tick()
+            # Dispatch only stops early when saturated; then wait for a batch instead of the next due time
+            timeout = poll if len(self.in_flight) >= self.max_in_flight else self.idle_time(poll)
+            if self.in_flight:
+                self.collect(timeout)
+            else:
+                stop.wait(timeout)
+            if report is not None and self.clock() >= next_report:
+                report(self.stats.snapshot())
+                next_report = self.clock() + report_every
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def price_scheduler_from_settings(fetch, **overrides):
+    """
+    Builds a PriceScheduler from PRICE_WORKER, with keyword arguments taking precedence.
+    """
+    options = price_worker_settings()
+    kwargs = {
+        'hot_interval': options['HOT_INTERVAL'],
+        'idle_interval': options['IDLE_INTERVAL'],
+        'traded_within': timedelta(days=options['TRADED_WITHIN_DAYS']),
+        'workers': options['WORKERS'],
+        'batch_size': options['BATCH_SIZE'],
+        'max_in_flight': options['MAX_IN_FLIGHT'],
+        'rescan_interval': options['RESCAN_INTERVAL'],
+    }
+    kwargs.update(overrides)
+    return PriceScheduler(fetch, **kwargs)
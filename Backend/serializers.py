@@ -1,6 +1,11 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile, Portfolio, Stock, ETF, Cryptocurrency, VirtualTrade, BlogPost, FAQ
+from django.db import models
+from .pricecache import get_price_cache
+from .models import (UserProfile, Instrument, Portfolio, Stock, ETF, Cryptocurrency, VirtualTrade, Position, BlogPost, FAQ,
+                     TargetAllocation, FXRate)
 
 class UserProfileSerializer(serializers.ModelSerializer):
     """
@@ -8,7 +13,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = UserProfile
-        fields = ['user', 'surname', 'address', 'email', 'age', 'bio', 'origin', 'phone_number', 'profile_picture']
+        fields = ['user', 'surname', 'address', 'email', 'age', 'bio', 'origin', 'phone_number', 'profile_picture',
+                  'base_currency']
 
 class UserSerializer(serializers.ModelSerializer):
     """
@@ -40,6 +46,22 @@ class UserSerializer(serializers.ModelSerializer):
 
         return instance
 
+class InstrumentSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Instrument model.
+    """
+    class Meta:
+        model = Instrument
+        fields = ['id', 'asset_class', 'symbol', 'last_price', 'currency', 'quoted_at']
+
+class FXRateSerializer(serializers.ModelSerializer):
+    """
+    Serializer for FXRate model.
+    """
+    class Meta:
+        model = FXRate
+        fields = ['currency', 'rate', 'quoted_at']
+
 class PortfolioSerializer(serializers.ModelSerializer):
     """
     Serializer for Portfolio model.
@@ -48,40 +70,163 @@ class PortfolioSerializer(serializers.ModelSerializer):
         model = Portfolio
         fields = ['user', 'name', 'description', 'created_at']
 
+class PortfolioValuationSerializer(serializers.Serializer):
+    """
+    Serializer for a portfolio's aggregated market value.
+    """
+    portfolio = serializers.IntegerField(source='id')
+    name = serializers.CharField()
+    total_value = serializers.DecimalField(max_digits=20, decimal_places=2)
+    currency = serializers.CharField()
+    # Currencies of holdings left out of total_value for lack of an FX rate
+    unconverted_currencies = serializers.ListField(child=serializers.CharField())
+
+class ValuationPointSerializer(serializers.Serializer):
+    """
+    Serializer for a point of a portfolio's value history.
+    """
+    time = serializers.DateTimeField()
+    value = serializers.DecimalField(max_digits=20, decimal_places=2)
+    low = serializers.DecimalField(max_digits=20, decimal_places=2)
+    high = serializers.DecimalField(max_digits=20, decimal_places=2)
+    currency = serializers.CharField()
+
+class PortfolioHoldingSerializer(serializers.Serializer):
+    """
+    Serializer for a holding of any asset class, as returned by portfolio_holdings() and converted
+    to `currency`.
+    """
+    id = serializers.IntegerField()
+    asset_class = serializers.CharField()
+    symbol = serializers.CharField()
+    instrument = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    initial_purchase_price = serializers.DecimalField(max_digits=20, decimal_places=2, allow_null=True)
+    current_price = serializers.DecimalField(max_digits=20, decimal_places=2, allow_null=True)
+    current_value = serializers.DecimalField(max_digits=20, decimal_places=2, allow_null=True)
+    currency = serializers.CharField()
+    purchase_date = serializers.DateTimeField()
+
+class CachedPriceField(serializers.DecimalField):
+    """
+    Read-only price of a holding's instrument, resolved through the price cache.
+    """
+    def __init__(self, **kwargs):
+        kwargs.update(source='instrument_id', read_only=True)
+        super().__init__(max_digits=10, decimal_places=2, **kwargs)
+
+    def to_representation(self, instrument_id):
+        price = get_price_cache().get(instrument_id)
+        return None if price is None else super().to_representation(price)
+
+class HoldingListSerializer(serializers.ListSerializer):
+    """
+    List serializer for holdings that warms the price cache for the whole page in one lookup.
+    """
+    def to_representation(self, data):
+        holdings = list(data.all() if isinstance(data, models.Manager) else data)
+        get_price_cache().get_many({holding.instrument_id for holding in holdings})
+        return super().to_representation(holdings)
+
 class StockSerializer(serializers.ModelSerializer):
     """
     Serializer for Stock model.
     """
+    current_price = CachedPriceField()
+
     class Meta:
         model = Stock
-        fields = ['portfolio', 'ticker_symbol', 'quantity', 'initial_purchase_price', 'current_price']
+        list_serializer_class = HoldingListSerializer
+        fields = ['portfolio', 'ticker_symbol', 'quantity', 'initial_purchase_price', 'current_price', 'currency']
 
 class ETFSerializer(serializers.ModelSerializer):
     """
     Serializer for ETF model.
     """
+    current_price = CachedPriceField()
+
     class Meta:
         model = ETF
-        fields = ['portfolio', 'ticker_symbol', 'quantity', 'initial_purchase_price', 'current_price']
+        list_serializer_class = HoldingListSerializer
+        fields = ['portfolio', 'ticker_symbol', 'quantity', 'initial_purchase_price', 'current_price', 'currency']
 
 class CryptocurrencySerializer(serializers.ModelSerializer):
     """
     Serializer for Cryptocurrency model.
     """
+    current_price = CachedPriceField()
+
     class Meta:
         model = Cryptocurrency
-        fields = ['portfolio', 'crypto_name', 'quantity', 'initial_purchase_price', 'current_price']
+        list_serializer_class = HoldingListSerializer
+        fields = ['portfolio', 'crypto_name', 'quantity', 'initial_purchase_price', 'current_price', 'currency']
 
 class VirtualTradeSerializer(serializers.ModelSerializer):
     """
-    Serializer for VirtualTrade model.
+    Serializer for VirtualTrade model. Trades are filled by the execution engine,
+    so the price and date are read-only.
     """
     user = serializers.ReadOnlyField(source='user.username')
-    investment_detail = StockSerializer(source='investment', read_only=True)
+    instrument_detail = InstrumentSerializer(source='instrument', read_only=True)
 
     class Meta:
         model = VirtualTrade
-        fields = ['user', 'investment', 'investment_detail', 'trade_type', 'trade_quantity', 'trade_price', 'trade_date']
+        fields = ['user', 'portfolio', 'instrument', 'instrument_detail', 'trade_type', 'trade_quantity',
+                  'trade_price', 'trade_date']
+        read_only_fields = ['trade_price']
+        extra_kwargs = {'trade_quantity': {'min_value': 1}}
+
+class TradeOrderSerializer(serializers.Serializer):
+    """
+    Serializer for one order of a batch submission. Related ids are resolved in bulk
+    by the execution engine rather than per row.
+    """
+    portfolio = serializers.IntegerField()
+    instrument = serializers.IntegerField()
+    trade_type = serializers.ChoiceField(choices=[('BUY', 'Buy'), ('SELL', 'Sell')])
+    trade_quantity = serializers.IntegerField(min_value=1)
+
+class TargetAllocationSerializer(serializers.ModelSerializer):
+    """
+    Serializer for a portfolio's target weight of one instrument or of one asset class.
+    """
+    class Meta:
+        model = TargetAllocation
+        fields = ['instrument', 'asset_class', 'weight']
+        extra_kwargs = {'weight': {'min_value': Decimal('0'), 'max_value': Decimal('1')}}
+
+    def validate(self, data):
+        if bool(data.get('instrument')) == bool(data.get('asset_class')):
+            raise serializers.ValidationError('Set either an instrument or an asset class.')
+        return data
+
+class RebalanceSerializer(serializers.Serializer):
+    """
+    Serializer for a rebalancing request. Without portfolios every portfolio of the user with targets
+    is rebalanced; the proposed orders are only executed with execute.
+    """
+    portfolios = serializers.ListField(child=serializers.IntegerField(), required=False)
+    execute = serializers.BooleanField(default=False)
+
+class PositionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Position model, with unrealized P&L at the cached latest price.
+    """
+    instrument_detail = InstrumentSerializer(source='instrument', read_only=True)
+    current_price = CachedPriceField()
+    unrealized_pnl = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Position
+        fields = ['instrument', 'instrument_detail', 'quantity', 'average_cost', 'realized_pnl',
+                  'current_price', 'unrealized_pnl', 'updated_at']
+        list_serializer_class = HoldingListSerializer
+
+    def get_unrealized_pnl(self, position):
+        price = get_price_cache().get(position.instrument_id)
+        if price is None:
+            return None
+        return str(((price - position.average_cost) * position.quantity).quantize(Decimal('0.01')))
 
 class BlogPostSerializer(serializers.ModelSerializer):
     """
@@ -0,0 +1,145 @@
+'''
+Signal handlers that keep derived state in step with model writes.
+'''
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import (UserProfile, Instrument, Portfolio, VirtualTrade, BlogPost, FAQ, FXRate, HOLDING_MODELS,
+                     prices_changed, fx_rates_changed)
+from .fx import reset_conversion_matrix
+from .pricecache import get_price_cache
+from .ledger import record_trades
+from .archive import archive_quotes, archive_trades
+from .snapshots import record_instrument_snapshots_on_commit
+from .responsecache import FX_RATES, invalidate, invalidate_instruments, invalidate_portfolios
+from .streaming import publish_holdings_on_commit, publish_prices
+
+
+def invalidate_instrument_price(sender, instance, **kwargs):
+    """
+    Drops a cached price whenever its Instrument row is written or removed.
+    """
+    get_price_cache().invalidate([instance.pk])
+
+
+def publish_saved_price(sender, instance, raw=False, **kwargs):
+    """
+    Pushes the price of an Instrument saved on its own to the portfolio streams once committed.
+    """
+    if not raw:
+        prices = {instance.pk: instance.last_price}
+        transaction.on_commit(lambda: publish_prices(prices))
+
+
+def publish_price_changes(sender, prices, **kwargs):
+    """
+    Pushes a batch of upserted prices to the portfolio streams as one event once committed.
+    """
+    transaction.on_commit(lambda: publish_prices(prices))
+
+
+def record_saved_trade(sender, instance, created, raw=False, **kwargs):
+    """
+    Folds trades saved outside the execution engine (admin, shell, fixtures) into the position ledger
+    and the archived trade history. The engine bulk creates its trades and records them itself.
+    """
+    if created and not raw:
+        record_trades([instance])
+        archive_trades([instance])
+
+
+def archive_price_changes(sender, quotes, **kwargs):
+    """
+    Copies a batch of upserted quotes to the price ticks of the document store once committed.
+    """
+    archive_quotes(quotes)
+
+
+def snapshot_changed_prices(sender, prices, **kwargs):
+    """
+    Snapshots the portfolios holding any instrument of an upserted batch, when RECORD_ON_CHANGE is set.
+    """
+    record_instrument_snapshots_on_commit(prices)
+
+
+def invalidate_saved_price(sender, instance, created, raw=False, **kwargs):
+    """
+    Invalidates cached responses of the portfolios holding a saved Instrument. New instruments
+    are not held yet.
+    """
+    if not created and not raw:
+        invalidate_instruments([instance.pk])
+
+
+def invalidate_changed_prices(sender, prices, **kwargs):
+    """
+    Invalidates cached responses of the portfolios holding any instrument of an upserted batch.
+    """
+    invalidate_instruments(prices)
+
+
+def invalidate_portfolio(sender, instance, **kwargs):
+    invalidate('portfolios')
+    invalidate_portfolios([instance.pk])
+
+
+def invalidate_holding(sender, instance, **kwargs):
+    invalidate_portfolios([instance.portfolio_id])
+
+
+def publish_saved_holding(sender, instance, raw=False, **kwargs):
+    """
+    Pushes holdings written one at a time (API, admin) to the portfolio streams once committed.
+    The trading engine and imports bulk write holdings and publish them themselves.
+    """
+    if not raw:
+        publish_holdings_on_commit([instance.portfolio_id])
+
+
+def invalidate_content(sender, instance, **kwargs):
+    invalidate(sender._meta.model_name)
+
+
+def invalidate_fx_rates(sender, **kwargs):
+    """
+    Drops this process's conversion matrix and, once the rates commit, bumps the FX_RATES version
+    that every process keys its matrix and cached responses by.
+    """
+    reset_conversion_matrix()
+    invalidate(FX_RATES)
+
+
+def invalidate_base_currency(sender, instance, raw=False, **kwargs):
+    """
+    Invalidates the responses of a user's portfolios, which are valued in their profile's base currency.
+    """
+    if not raw:
+        invalidate_portfolios(Portfolio.objects.filter(user=instance.user_id).values_list('pk', flat=True))
+
+
+def connect_signals():
+    post_save.connect(invalidate_instrument_price, sender=Instrument, dispatch_uid='instrument_price_saved')
+    post_delete.connect(invalidate_instrument_price, sender=Instrument, dispatch_uid='instrument_price_deleted')
+    post_save.connect(publish_saved_price, sender=Instrument, dispatch_uid='instrument_price_published')
+    prices_changed.connect(publish_price_changes, dispatch_uid='instrument_prices_published')
+    post_save.connect(record_saved_trade, sender=VirtualTrade, dispatch_uid='virtual_trade_recorded')
+    prices_changed.connect(archive_price_changes, dispatch_uid='instrument_prices_archived')
+    prices_changed.connect(snapshot_changed_prices, dispatch_uid='instrument_prices_snapshotted')
+    for event, signal in (('saved', post_save), ('deleted', post_delete)):
+        for model in HOLDING_MODELS:
+            signal.connect(publish_saved_holding, sender=model,
+                           dispatch_uid=f'{model._meta.model_name}_holdings_published_{event}')
+
+    # Cached responses, see Backend/responsecache.py
+    post_save.connect(invalidate_saved_price, sender=Instrument, dispatch_uid='instrument_responses_saved')
+    prices_changed.connect(invalidate_changed_prices, dispatch_uid='instrument_responses_changed')
+    for event, signal in (('saved', post_save), ('deleted', post_delete)):
+        signal.connect(invalidate_portfolio, sender=Portfolio, dispatch_uid=f'portfolio_responses_{event}')
+        for model in HOLDING_MODELS:
+            signal.connect(invalidate_holding, sender=model, dispatch_uid=f'{model._meta.model_name}_responses_{event}')
+        for model in (BlogPost, FAQ):
+            signal.connect(invalidate_content, sender=model, dispatch_uid=f'{model._meta.model_name}_responses_{event}')
+        signal.connect(invalidate_fx_rates, sender=FXRate, dispatch_uid=f'fx_rate_responses_{event}')
+    fx_rates_changed.connect(invalidate_fx_rates, dispatch_uid='fx_rates_responses_changed')
+    post_save.connect(invalidate_base_currency, sender=UserProfile, dispatch_uid='profile_responses_saved')
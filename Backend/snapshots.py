@@ -0,0 +1,210 @@
+'''
+Portfolio value history from precomputed snapshots.
+record_snapshots() stores each portfolio's current value in its owner's base currency as a raw
+point, on a schedule (manage.py snapshot_portfolios) and, with RECORD_ON_CHANGE, after every trade
+or price change.
+compact_snapshots() rolls closed buckets up into minute, hour, day and month points, each keeping the
+last, lowest and highest value of its bucket, and deletes points older than their RETENTION once they
+are rolled up. The newest rolled up bucket is aggregated again on the next run to take in points that
+reached it late. A chart of any range is then one indexed range read of the coarsest resolution that
+still has MIN_POINTS points over it, instead of re-valuing every holding at every point in time.
+'''
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .archive import write_documents
+from .fx import fx_settings
+from .models import Portfolio, ValuationSnapshot, holding_portfolios, portfolio_valuations
+
+RAW, MINUTE, HOUR, DAY, MONTH = (ValuationSnapshot.RAW, ValuationSnapshot.MINUTE, ValuationSnapshot.HOUR,
+                                 ValuationSnapshot.DAY, ValuationSnapshot.MONTH)
+
+# Rollup levels from finest to coarsest, each built from the one before it
+ROLLUPS = (MINUTE, HOUR, DAY, MONTH)
+BUCKET_SECONDS = {MINUTE: 60, HOUR: 3600, DAY: 86400, MONTH: 2629746}
+
+HISTORY_RANGES = {
+    '1D': timedelta(days=1),
+    '1W': timedelta(weeks=1),
+    '1M': timedelta(days=30),
+    '3M': timedelta(days=91),
+    '6M': timedelta(days=182),
+    '1Y': timedelta(days=365),
+    '5Y': timedelta(days=1826),
+}
+
+DEFAULT_SNAPSHOTS = {
+    # Seconds between scheduled snapshots of every portfolio
+    'INTERVAL': 60,
+    # Also snapshot portfolios once trades or price changes touching them commit
+    'RECORD_ON_CHANGE': False,
+    # Seconds each resolution is kept after being rolled up; None keeps it forever
+    'RETENTION': {RAW: 86400, MINUTE: 7 * 86400, HOUR: 90 * 86400, DAY: None, MONTH: None},
+    # Fewest points a history range is served with, which picks its resolution
+    'MIN_POINTS': 50,
+    # Portfolios valued per round of aggregate queries
+    'BATCH_SIZE': 1000,
+}
+
+CENTS = Decimal('0.01')
+
+
+def snapshot_settings():
+    return {**DEFAULT_SNAPSHOTS, **getattr(settings, 'SNAPSHOTS', {})}
+
+
+def bucket_start(resolution, moment):
+    """
+    Returns the start of the `resolution` bucket holding `moment`, in UTC.
+    """
+    moment = moment.astimezone(dt_timezone.utc)
+    if resolution == MONTH:
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    seconds = int(moment.timestamp())
+    return datetime.fromtimestamp(seconds - seconds % BUCKET_SECONDS[resolution], tz=dt_timezone.utc)
+
+
+def bucket_end(resolution, start):
+    if resolution == MONTH:
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start + timedelta(seconds=BUCKET_SECONDS[resolution])
+
+
+def record_snapshots(portfolio_ids=None, at=None):
+    """
+    Stores the current value of the given portfolios, all of them by default, as raw points in
+    their owners' base currencies. Portfolios holding something without an FX rate to that currency
+    are skipped rather than recorded at a partial value. Returns the number of points written.
+    """
+    if portfolio_ids is None:
+        portfolio_ids = Portfolio.objects.order_by('pk').values_list('pk', flat=True)
+    portfolio_ids = sorted(portfolio_ids)
+    at = at or timezone.now()
+    batch_size = snapshot_settings()['BATCH_SIZE']
+    base_currency = fx_settings()['BASE_CURRENCY']
+    written = 0
+    for offset in range(0, len(portfolio_ids), batch_size):
+        by_currency = {}
+        for portfolio_id, currency in (Portfolio.objects.filter(pk__in=portfolio_ids[offset:offset + batch_size])
+                                       .values_list('pk', 'user__profile__base_currency')):
+            by_currency.setdefault(currency or base_currency, []).append(portfolio_id)
+        rows = []
+        for currency, batch in sorted(by_currency.items()):
+            unconverted = {}
+            for portfolio_id, value in portfolio_valuations(batch, currency, unconverted).items():
+                if portfolio_id not in unconverted:
+                    rows.append(ValuationSnapshot(portfolio_id=portfolio_id, resolution=RAW, time=at, value=value,
+                                                  low=value, high=value, currency=currency))
+        write_documents(ValuationSnapshot, rows)
+        written += len(rows)
+    return written
+
+
+def record_snapshots_on_commit(portfolio_ids):
+    """
+    Snapshots the given portfolios once the current transaction commits, when RECORD_ON_CHANGE is set.
+    """
+    portfolio_ids = set(portfolio_ids)
+    if portfolio_ids and snapshot_settings()['RECORD_ON_CHANGE']:
+        transaction.on_commit(lambda: record_snapshots(portfolio_ids))
+
+
+def record_instrument_snapshots_on_commit(instrument_ids):
+    if snapshot_settings()['RECORD_ON_CHANGE']:
+        record_snapshots_on_commit(holding_portfolios(instrument_ids))
+
+
+def roll_up(finer, coarser, now):
+    """
+    Aggregates the `finer` points of every closed `coarser` bucket into one `coarser` point per
+    portfolio. Runs resume from the bucket of the newest `coarser` point, which is aggregated again,
+    so points that reached it after it was rolled up, late or for portfolios snapshotted after
+    others, replace its stale rollups. Returns the number of points written.
+    """
+    closed = bucket_start(coarser, now)
+    points = ValuationSnapshot.objects.filter(resolution=finer, time__lt=closed)
+    last = ValuationSnapshot.objects.filter(resolution=coarser).aggregate(last=Max('time'))['last']
+    rolled_up = {}
+    if last is not None:
+        resume = bucket_start(coarser, last)
+        points = points.filter(time__gte=resume)
+        for pk, portfolio_id, at, *aggregate in (ValuationSnapshot.objects.filter(resolution=coarser, time__gte=resume)
+                                                 .values_list('pk', 'portfolio_id', 'time', 'value', 'low', 'high',
+                                                              'currency')):
+            rolled_up[(portfolio_id, at)] = (pk, tuple(aggregate))
+
+    rows, stale = [], []
+    points = (points.order_by('portfolio_id', 'time')
+              .values_list('portfolio_id', 'time', 'value', 'low', 'high', 'currency'))
+    for (portfolio_id, start), bucket in groupby(points.iterator(chunk_size=5000),
+                                                 key=lambda point: (point[0], bucket_start(coarser, point[1]))):
+        # Points from before the owner changed base currency within the bucket are left out
+        bucket = list(bucket)
+        currency = bucket[-1][5]
+        bucket = [point for point in bucket if point[5] == currency]
+        aggregate = (bucket[-1][2], min(point[3] for point in bucket), max(point[4] for point in bucket), currency)
+        pk, previous = rolled_up.get((portfolio_id, start), (None, None))
+        if previous == aggregate:
+            continue
+        if pk is not None:
+            stale.append(pk)
+        value, low, high, currency = aggregate
+        rows.append(ValuationSnapshot(portfolio_id=portfolio_id, resolution=coarser, time=start, value=value,
+                                      low=low, high=high, currency=currency))
+    # A failure between the two leaves the bucket to be rolled up again by the next run
+    if stale:
+        ValuationSnapshot.objects.filter(pk__in=stale).delete()
+    ValuationSnapshot.objects.bulk_create(rows, batch_size=snapshot_settings()['BATCH_SIZE'])
+    return len(rows)
+
+
+def compact_snapshots(now=None):
+    """
+    Rolls every resolution up into the next and deletes points past their retention that are
+    already rolled up, keeping those of the last closed bucket, which the next run aggregates again.
+    Returns ({resolution: points written}, {resolution: points deleted}).
+    """
+    now = now or timezone.now()
+    retention = snapshot_settings()['RETENTION']
+    written, deleted = {}, {}
+    for finer, coarser in zip((RAW,) + ROLLUPS, ROLLUPS):
+        written[coarser] = roll_up(finer, coarser, now)
+        deleted[finer] = 0
+        if retention.get(finer) is not None:
+            last_closed = bucket_start(coarser, bucket_start(coarser, now) - timedelta(microseconds=1))
+            cutoff = min(now - timedelta(seconds=retention[finer]), last_closed)
+            deleted[finer], _ = ValuationSnapshot.objects.filter(resolution=finer, time__lt=cutoff).delete()
+    return written, deleted
+
+
+def history_resolution(span):
+    """
+    Returns the coarsest rollup with at least MIN_POINTS buckets over `span` that is kept for all of it.
+    """
+    options = snapshot_settings()
+    for resolution in reversed(ROLLUPS):
+        retained = options['RETENTION'].get(resolution)
+        if (span.total_seconds() / BUCKET_SECONDS[resolution] >= options['MIN_POINTS']
+                and (retained is None or retained >= span.total_seconds())):
+            return resolution
+    return ROLLUPS[0]
+
+
+def portfolio_history(portfolio_id, resolution, start, end=None):
+    """
+    Returns (time, value, low, high, currency) points of a portfolio at `resolution` from `start`,
+    oldest first.
+    """
+    points = ValuationSnapshot.objects.filter(portfolio_id=portfolio_id, resolution=resolution, time__gte=start)
+    if end is not None:
+        points = points.filter(time__lt=end)
+    base_currency = fx_settings()['BASE_CURRENCY']
+    return [(at, value, low, high, currency or base_currency) for at, value, low, high, currency
+            in points.order_by('time').values_list('time', 'value', 'low', 'high', 'currency')]
@@ -0,0 +1,223 @@
+'''
+Push updates of portfolio values and holding prices.
+Price writes publish one event per batch to the channel layer group PRICE_GROUP. Every subscribed
+stream (Backend/consumers.py) keeps a PortfolioTracker of its portfolios, moves their values by the
+price deltas it receives and sends what changed at most once per COALESCE_WINDOW seconds, so a
+burst of quote updates costs each client one message and the database nothing. Values are in the
+owner's base currency, converted like /portfolios/valuations/ at the rates read when the positions
+were loaded. Trades, imports and other holding writes publish the portfolios they touched to
+HOLDINGS_GROUP, and streams tracking one of them reload its positions.
+'''
+
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from .fx import CENTS, fx_settings, get_conversion_matrix
+from .models import Instrument, Portfolio, portfolio_positions
+from .pricecache import get_price_cache
+
+PRICE_GROUP = 'instrument-prices'
+HOLDINGS_GROUP = 'portfolio-holdings'
+
+DEFAULT_STREAMING = {
+    # Seconds over which changes are merged into one message per subscriber
+    'COALESCE_WINDOW': 1.0,
+    # Seconds of silence after which server-sent event streams send a keep-alive comment
+    'HEARTBEAT': 15.0,
+}
+
+
+def streaming_settings():
+    return {**DEFAULT_STREAMING, **getattr(settings, 'STREAMING', {})}
+
+
+def publish_prices(prices):
+    """
+    Sends {instrument id: price} to every stream subscriber as a single event.
+    Does nothing when no channel layer is configured.
+    """
+    layer = get_channel_layer()
+    if layer is None or not prices:
+        return
+    # Channel layers may serialize with msgpack, so decimals travel as strings
+    async_to_sync(layer.group_send)(PRICE_GROUP, {
+        'type': 'prices.changed',
+        'prices': {str(pk): None if price is None else str(price) for pk, price in prices.items()},
+    })
+
+
+def publish_holdings(portfolio_ids):
+    """
+    Tells every stream subscriber that the holdings of `portfolio_ids` changed, as a single event.
+    Does nothing when no channel layer is configured.
+    """
+    layer = get_channel_layer()
+    if layer is None or not portfolio_ids:
+        return
+    async_to_sync(layer.group_send)(HOLDINGS_GROUP, {'type': 'holdings.changed', 'portfolios': sorted(portfolio_ids)})
+
+
+def publish_holdings_on_commit(portfolio_ids):
+    """
+    Publishes the changed holdings of `portfolio_ids` once the current transaction commits.
+    """
+    portfolio_ids = set(portfolio_ids)
+    if portfolio_ids:
+        transaction.on_commit(lambda: publish_holdings(portfolio_ids))
+
+
+def parse_prices(prices):
+    return {int(pk): None if price is None else Decimal(price) for pk, price in prices.items()}
+
+
+class PortfolioTracker:
+    """
+    Values of a set of portfolios in `currency` kept current from price changes. `instruments` maps
+    instrument ids to (asset_class, symbol, quote currency) and `rates` quote currencies to the
+    Decimal rate into `currency`, None for a currency without one. A change moves the value of
+    every portfolio holding the instrument by quantity * (new price - previous price) * rate instead
+    of re-summing its holdings; holdings without a rate are left out, as in portfolio_valuations().
+    Changes accumulate until flush(), which returns only the latest value of each changed portfolio
+    and price.
+    """
+    def __init__(self, positions, prices, instruments, currency, rates):
+        self.instruments = instruments
+        self.currency = currency
+        self.rates = rates
+        self.holders = {}
+        self.values = {}
+        for portfolio_id, holdings in positions.items():
+            for instrument_id, quantity in holdings.items():
+                self.holders.setdefault(instrument_id, []).append((portfolio_id, quantity))
+        self.prices = {instrument_id: prices.get(instrument_id) for instrument_id in self.holders}
+        for portfolio_id, holdings in positions.items():
+            self.values[portfolio_id] = self.value(holdings)
+        self.changed_values = set()
+        self.changed_prices = set()
+
+    def rate(self, instrument_id):
+        return self.rates.get(self.instruments[instrument_id][2])
+
+    def value(self, holdings):
+        """
+        Sums {instrument id: quantity} at the tracked prices, in the tracker's currency.
+        """
+        total = Decimal('0')
+        for instrument_id, quantity in holdings.items():
+            rate = self.rate(instrument_id)
+            if rate is not None:
+                total += quantity * (self.prices[instrument_id] or 0) * rate
+        return total
+
+    def apply(self, prices):
+        """
+        Applies {instrument id: price}, ignoring instruments none of the portfolios hold.
+        """
+        for instrument_id, price in prices.items():
+            holders = self.holders.get(instrument_id)
+            previous = self.prices.get(instrument_id)
+            if holders is None or price == previous:
+                continue
+            self.prices[instrument_id] = price
+            self.changed_prices.add(instrument_id)
+            rate = self.rate(instrument_id)
+            if rate is None:
+                continue
+            delta = ((price or 0) - (previous or 0)) * rate
+            for portfolio_id, quantity in holders:
+                self.values[portfolio_id] += quantity * delta
+                self.changed_values.add(portfolio_id)
+
+    def replace_positions(self, positions, prices, instruments, rates):
+        """
+        Swaps in the current holdings of tracked portfolios after their holdings changed and
+        revalues them. Instruments already tracked keep their price; new ones start at `prices`.
+        `rates` are merged into the tracked rates.
+        """
+        previous = self.prices
+        for instrument_id, holders in list(self.holders.items()):
+            holders = [(portfolio_id, quantity) for portfolio_id, quantity in holders if portfolio_id not in positions]
+            if holders:
+                self.holders[instrument_id] = holders
+            else:
+                del self.holders[instrument_id]
+        self.instruments.update(instruments)
+        self.rates.update(rates)
+        for portfolio_id, holdings in positions.items():
+            for instrument_id, quantity in holdings.items():
+                self.holders.setdefault(instrument_id, []).append((portfolio_id, quantity))
+        self.prices = {instrument_id: previous[instrument_id] if instrument_id in previous else prices.get(instrument_id)
+                       for instrument_id in self.holders}
+        self.changed_prices = {instrument_id for instrument_id in self.changed_prices if instrument_id in self.prices}
+        self.changed_prices.update(self.prices.keys() - previous.keys())
+        for portfolio_id, holdings in positions.items():
+            self.values[portfolio_id] = self.value(holdings)
+            self.changed_values.add(portfolio_id)
+
+    def message(self, message_type, portfolio_ids, instrument_ids):
+        prices = []
+        for instrument_id in sorted(instrument_ids):
+            asset_class, symbol, currency = self.instruments[instrument_id]
+            price = self.prices[instrument_id]
+            prices.append({'instrument': instrument_id, 'asset_class': asset_class, 'symbol': symbol,
+                           'price': None if price is None else str(price), 'currency': currency})
+        return {
+            'type': message_type,
+            'portfolios': [{'id': portfolio_id, 'value': str(self.values[portfolio_id].quantize(CENTS)),
+                            'currency': self.currency}
+                           for portfolio_id in sorted(portfolio_ids)],
+            'prices': prices,
+        }
+
+    def snapshot(self):
+        return self.message('snapshot', self.values, self.prices)
+
+    def flush(self):
+        """
+        Returns an update with everything changed since the last flush, or None.
+        """
+        if not self.changed_values and not self.changed_prices:
+            return None
+        update = self.message('update', self.changed_values, self.changed_prices)
+        self.changed_values = set()
+        self.changed_prices = set()
+        return update
+
+
+def load_tracker(user, portfolio_ids=None):
+    """
+    Builds the tracker of `user`'s portfolios, all of them by default, valued in the user's profile
+    base currency or FX['BASE_CURRENCY']. Returns None when any of `portfolio_ids` is not one of the
+    user's portfolios.
+    """
+    portfolios = Portfolio.objects.filter(user=user)
+    if portfolio_ids is not None:
+        portfolios = portfolios.filter(pk__in=portfolio_ids)
+    found = list(portfolios.values_list('pk', flat=True))
+    if portfolio_ids is not None and len(found) != len(set(portfolio_ids)):
+        return None
+    profile = getattr(user, 'profile', None)
+    currency = (profile and profile.base_currency) or fx_settings()['BASE_CURRENCY']
+    positions, prices, instruments, rates = load_positions(found, currency)
+    return PortfolioTracker(positions, prices, instruments, currency, rates)
+
+
+def load_positions(portfolio_ids, currency):
+    """
+    Loads (positions, prices, instruments, rates) of the given portfolios, as taken by
+    PortfolioTracker.replace_positions(), with rates from each held quote currency into `currency`.
+    """
+    positions = portfolio_positions(portfolio_ids)
+    held = {instrument_id for holdings in positions.values() for instrument_id in holdings}
+    instruments = {pk: (asset_class, symbol, quoted) for pk, asset_class, symbol, quoted
+                   in Instrument.objects.filter(pk__in=held).values_list('pk', 'asset_class', 'symbol', 'currency')}
+    foreign = {quoted for _, _, quoted in instruments.values()} - {currency}
+    matrix = get_conversion_matrix() if foreign else None
+    rates = {quoted: matrix.exact_rate(quoted, currency) for quoted in foreign}
+    rates[currency] = Decimal('1')
+    return positions, get_price_cache().get_many(held), instruments, rates
+
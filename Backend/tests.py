@@ -1,7 +1,65 @@
+import asyncio
+import base64
+import cProfile
+import csv
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+
+import numpy as np
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
-from .models import User, Stock, ETF, Cryptocurrency, BlogPost
+from .pricecache import PriceCache, get_price_cache, reset_price_cache
+from .timeseries import PriceHistoryStore, downsample
+from .analytics import fill_gaps, max_drawdown, portfolio_analytics
+from .models import (User, UserProfile, Instrument, Portfolio, Stock, ETF, Cryptocurrency, VirtualTrade, Position,
+                     BlogPost, FAQ, TradeEvent, PriceTick, ValuationSnapshot, TargetAllocation, FXRate,
+                     portfolio_valuations)
+from .benchmark import compare_results, generate_dataset, results_document, run_benchmarks
+from .fastpath import compile_serializer
+from .fx import ConversionMatrix, get_conversion_matrix, reset_conversion_matrix
+from .profiling import ProfilingMiddleware, SlowestProfiles, reset_metrics_registry
+from .quotes import FakeQuoteProvider, HTTPQuoteProvider, QuoteService, RateLimiter, reset_quote_service
+from .scheduler import PriceScheduler
+from .consumers import PortfolioValueConsumer, PortfolioValueEventStream
+from .streaming import PRICE_GROUP, PortfolioTracker
+from .responsecache import FX_RATES, bump, check_response_cache, reset_response_cache
+from .queryaudit import SCAN, audit_queries, explain, full_scans
+from .routers import StorageRouter, replica_reads
+from .snapshots import compact_snapshots, history_resolution, record_snapshots, HISTORY_RANGES
+from .rebalancing import plan_trades, rebalance
+from .risk import (get_simulation_pool, historical_pnl, monte_carlo_pnl, portfolio_risk, reset_risk_results,
+                   shutdown_simulation_pool, value_at_risk)
+from .trading import execute_orders
+from .serializers import PositionSerializer
+from .urls import router
+from .views import StockViewSet, VirtualTradeViewSet
+
+# Response caching is off by default; tests of cached views run it on the test process's local cache
+LOCAL_RESPONSE_CACHE = {'CACHE_ALIAS': 'default', 'TIMEOUT': 300}
 
 class UserViewSetTests(APITestCase):
     
@@ -102,4 +160,2133 @@ class BlogPostViewSetTests(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(BlogPost.objects.count(), 1)
-        self.assertEqual(BlogPost.objects.get().title, 'New Post')
\ No newline at end of file
+        self.assertEqual(BlogPost.objects.get().title, 'New Post')
+
+@override_settings(RESPONSE_CACHE=LOCAL_RESPONSE_CACHE)
+class PortfolioValuationTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        reset_response_cache()
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolios = [Portfolio.objects.create(user=self.user, name=f'Portfolio {i}') for i in range(3)]
+        Instrument.objects.upsert_quotes([
+            (Instrument.STOCK, 'AAPL', Decimal('150.00'), timezone.now()),
+            (Instrument.ETF, 'SPY', Decimal('450.50'), timezone.now()),
+            (Instrument.CRYPTO, 'BTC', Decimal('30000.00'), timezone.now()),
+        ])
+        for portfolio in self.portfolios:
+            Stock.objects.create(portfolio=portfolio, ticker_symbol='AAPL', quantity=10,
+                                 initial_purchase_price='100.00', purchase_date=timezone.now())
+            ETF.objects.create(portfolio=portfolio, ticker_symbol='SPY', quantity=2,
+                               initial_purchase_price='400.00', purchase_date=timezone.now())
+            Cryptocurrency.objects.create(portfolio=portfolio, crypto_name='BTC', quantity=1,
+                                          initial_purchase_price='20000.00', purchase_date=timezone.now())
+
+    def test_total_value(self):
+        """
+        Ensure a portfolio is valued across all asset classes.
+        """
+        self.assertEqual(self.portfolios[0].total_value(), Decimal('32401.00'))
+        empty = Portfolio.objects.create(user=self.user, name='Empty')
+        self.assertEqual(empty.total_value(), Decimal('0'))
+
+    def test_valuations_constant_queries(self):
+        """
+        Ensure the bulk valuation endpoint does not issue queries per portfolio.
+        """
+        url = reverse('portfolio-valuations')
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(Decimal(response.data[0]['total_value']), Decimal('32401.00'))
+        # Prices are cached after the first valuation
+        reset_response_cache()
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        # And the whole response after that
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+
+class IngestQuotesCommandTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        user = User.objects.create_user(username='investor', password='testpass123')
+        self.portfolio = Portfolio.objects.create(user=user, name='Growth')
+        self.holdings = [Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=1,
+                                              initial_purchase_price='100.00', purchase_date=timezone.now())
+                         for _ in range(5)]
+
+    def write_file(self, suffix, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False)
+        handle.write(content)
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def test_ingest_csv(self):
+        """
+        Ensure one quote row updates every holding of the instrument.
+        """
+        path = self.write_file('.csv', 'asset_class,symbol,price\nSTOCK,AAPL,100.00\nSTOCK,AAPL,187.25\nETF,VTI,220.10\n')
+        call_command('ingest_quotes', path, '--batch-size', '2', '--no-history', stdout=tempfile.TemporaryFile('w'))
+        self.assertEqual(Instrument.objects.count(), 2)
+        for holding in self.holdings:
+            holding.refresh_from_db()
+            self.assertEqual(holding.current_price, Decimal('187.25'))
+
+    def test_ingest_ndjson(self):
+        """
+        Ensure NDJSON quotes are upserted over existing instruments.
+        """
+        path = self.write_file('.ndjson', '{"asset_class": "stock", "symbol": "AAPL", "price": "190.5"}\n\n'
+                                          '{"asset_class": "CRYPTO", "symbol": "BTC", "price": 42000}\n')
+        call_command('ingest_quotes', path, '--no-history', stdout=tempfile.TemporaryFile('w'))
+        self.assertEqual(Instrument.objects.get(symbol='AAPL').last_price, Decimal('190.50'))
+        self.assertEqual(Instrument.objects.get(symbol='BTC').last_price, Decimal('42000.00'))
+
+    def test_rejects_invalid_prices(self):
+        """
+        Ensure prices that are not finite and positive are rejected instead of written.
+        """
+        for price in ('NaN', 'Infinity', '-1.00', '0'):
+            path = self.write_file('.csv', f'asset_class,symbol,price\nSTOCK,AAPL,{price}\n')
+            out, err = io.StringIO(), io.StringIO()
+            call_command('ingest_quotes', path, '--no-history', stdout=out, stderr=err)
+            self.assertIn('Rejected 1 rows.', out.getvalue())
+            self.assertIn('Row 1: missing or invalid price, skipped.', err.getvalue())
+        self.assertFalse(Instrument.objects.filter(last_price__isnull=False).exists())
+
+    def test_rejects_invalid_timestamps(self):
+        """
+        Ensure rows whose quoted_at is not a date and time or is malformed are rejected and the rest are ingested.
+        """
+        path = self.write_file('.csv', 'asset_class,symbol,price,quoted_at\n'
+                                       'STOCK,AAPL,101.00,January 1st\n'
+                                       'STOCK,AAPL,102.00,2024-13-45T10:00:00Z\n'
+                                       'STOCK,AAPL,187.25,2024-01-02T10:00:00Z\n')
+        out, err = io.StringIO(), io.StringIO()
+        with tempfile.TemporaryDirectory() as root, override_settings(PRICE_HISTORY_ROOT=root):
+            call_command('ingest_quotes', path, stdout=out, stderr=err)
+            closes = PriceHistoryStore(root).range('STOCK', 'AAPL')['p'].tolist()
+        self.assertEqual(closes, [187.25])
+        self.assertIn('Applied 1 quotes', out.getvalue())
+        self.assertIn('Rejected 2 rows.', out.getvalue())
+        self.assertIn("Row 1: invalid quoted_at 'January 1st', skipped.", err.getvalue())
+        self.assertEqual(Instrument.objects.get(symbol='AAPL').last_price, Decimal('187.25'))
+
+
+class PriceCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.loads = []
+
+    def loader(self, instrument_ids):
+        self.loads.append(sorted(instrument_ids))
+        return {pk: Decimal(pk) for pk in instrument_ids if pk < 100}
+
+    def make_cache(self, **kwargs):
+        return PriceCache(loader=self.loader, clock=lambda: self.now, **kwargs)
+
+    def test_read_through_and_expiry(self):
+        """
+        Ensure misses are loaded together and entries expire after the timeout.
+        """
+        cache = self.make_cache(timeout=10)
+        self.assertEqual(cache.get_many([1, 2, 500]), {1: Decimal(1), 2: Decimal(2)})
+        self.assertEqual(cache.get(1), Decimal(1))
+        self.assertEqual(self.loads, [[1, 2, 500]])
+        self.now = 11
+        cache.get(1)
+        self.assertEqual(self.loads[-1], [1])
+
+    def test_lru_eviction_and_invalidation(self):
+        """
+        Ensure the least recently used entry is evicted and invalidated entries reload.
+        """
+        cache = self.make_cache(max_entries=2)
+        cache.get_many([1, 2])
+        cache.get(1)
+        cache.get(3)
+        cache.get_many([1, 3])
+        self.assertEqual(len(self.loads), 2)
+        cache.get(2)
+        self.assertEqual(self.loads[-1], [2])
+        cache.invalidate([2])
+        cache.get(2)
+        self.assertEqual(self.loads[-1], [2])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_cache_backend(self):
+        """
+        Ensure a second process-local cache is served from the shared Django cache.
+        """
+        self.make_cache(cache_alias='default').get_many([7, 8])
+        self.assertEqual(self.make_cache(cache_alias='default').get_many([7, 8]), {7: Decimal(7), 8: Decimal(8)})
+        self.assertEqual(len(self.loads), 1)
+
+
+class PriceCacheInvalidationTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=user)
+        portfolio = Portfolio.objects.create(user=user, name='Growth')
+        for ticker in ('AAPL', 'MSFT', 'NVDA'):
+            Stock.objects.create(portfolio=portfolio, ticker_symbol=ticker, quantity=1,
+                                 initial_purchase_price='100.00', purchase_date=timezone.now())
+        Instrument.objects.update(last_price=Decimal('10.00'))
+        get_price_cache().invalidate()
+
+    def test_holdings_list_hits_database_on_miss_only(self):
+        """
+        Ensure a holdings page loads prices in one query when cold and none when warm.
+        """
+        url = reverse('stock-list')
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['current_price'], '10.00')
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_price_writes_invalidate(self):
+        """
+        Ensure saved and bulk upserted prices are visible immediately.
+        """
+        stock = Stock.objects.get(ticker_symbol='AAPL')
+        self.assertEqual(stock.current_price, Decimal('10.00'))
+        instrument = stock.instrument
+        instrument.last_price = Decimal('11.00')
+        instrument.save()
+        self.assertEqual(stock.current_price, Decimal('11.00'))
+        Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('12.00'), timezone.now())])
+        self.assertEqual(stock.current_price, Decimal('12.00'))
+
+
+def append_interleaved_ticks(root, offset, count):
+    store = PriceHistoryStore(root)
+    for index in range(count):
+        store.append('STOCK', 'RACE', [2 * index + offset], [float(offset)])
+
+
+class PriceHistoryStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = PriceHistoryStore(directory.name)
+        # One tick per hour over two days, priced by hour index
+        self.store.append('STOCK', 'BRK.B', np.arange(48) * 3600, np.arange(48, dtype=float))
+
+    def test_append_only(self):
+        """
+        Ensure stale and duplicate ticks are dropped so files stay ordered.
+        """
+        self.assertEqual(self.store.append('STOCK', 'BRK.B', [0, 3600 * 47, 3600 * 48, 3600 * 48], [1, 2, 3, 4]), 1)
+        series = self.store.open('STOCK', 'BRK.B')
+        self.assertEqual(len(series), 49)
+        self.assertEqual(series['p'][-1], 4)
+
+    @skipUnless('fork' in multiprocessing.get_all_start_methods(), 'needs fork')
+    def test_appends_from_several_processes(self):
+        """
+        Ensure appends racing from separate processes keep the file strictly ordered.
+        """
+        context = multiprocessing.get_context('fork')
+        writers = [context.Process(target=append_interleaved_ticks, args=(self.store.root, offset, 300))
+                   for offset in (0, 1)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        times = self.store.open('STOCK', 'RACE')['t']
+        self.assertGreater(len(times), 300)
+        self.assertTrue((np.diff(times) > 0).all())
+
+    def test_range_and_downsample(self):
+        """
+        Ensure a date range is sliced by timestamp and bucketed into daily bars.
+        """
+        start = datetime(1970, 1, 1, 12, tzinfo=dt_timezone.utc)
+        end = datetime(1970, 1, 2, 12, tzinfo=dt_timezone.utc)
+        ticks = self.store.range('STOCK', 'BRK.B', start, end)
+        self.assertEqual(ticks['p'].tolist(), list(range(12, 36)))
+        bars = downsample(ticks, 86400)
+        self.assertEqual(bars['t'].tolist(), [0, 86400])
+        self.assertEqual(bars[0].tolist(), (0, 12, 23, 12, 23))
+        self.assertEqual(bars[1].tolist(), (86400, 24, 35, 24, 35))
+        self.assertEqual(len(self.store.range('ETF', 'MISSING')), 0)
+
+
+class InstrumentHistoryViewTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICE_HISTORY_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=user)
+        self.instrument = Instrument.objects.create(asset_class=Instrument.CRYPTO, symbol='BTC')
+        path = self.write_quotes('asset_class,symbol,price,quoted_at\n'
+                                 'CRYPTO,BTC,100,2024-01-01T10:00:00Z\n'
+                                 'CRYPTO,BTC,120,2024-01-01T18:00:00Z\n'
+                                 'CRYPTO,BTC,90,2024-01-02T09:00:00Z\n'
+                                 'CRYPTO,BTC,95,2024-01-03T09:00:00Z\n')
+        call_command('ingest_quotes', path, stdout=tempfile.TemporaryFile('w'))
+
+    def write_quotes(self, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.write(content)
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def test_history_range(self):
+        """
+        Ensure ingested quotes are served for an inclusive date range.
+        """
+        url = reverse('instrument-history', args=[self.instrument.pk])
+        response = self.client.get(url, {'start': '2024-01-01', 'end': '2024-01-02'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([point['price'] for point in response.data['points']], [100, 120, 90])
+
+    def test_history_downsampled(self):
+        """
+        Ensure ?interval= returns OHLC bars and bad input is rejected.
+        """
+        url = reverse('instrument-history', args=[self.instrument.pk])
+        response = self.client.get(url, {'interval': '1d'})
+        self.assertEqual([(bar['open'], bar['high'], bar['low'], bar['close']) for bar in response.data['points']],
+                         [(100, 120, 100, 120), (90, 90, 90, 90), (95, 95, 95, 95)])
+        response = self.client.get(url, {'interval': 'daily'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AnalyticsEngineTests(SimpleTestCase):
+
+    def test_fill_gaps(self):
+        """
+        Ensure gaps are forward filled and leading gaps back filled per column.
+        """
+        matrix = np.array([[np.nan, 1.0, np.nan], [2.0, np.nan, np.nan], [np.nan, 3.0, np.nan]])
+        filled = fill_gaps(matrix)
+        self.assertEqual(filled[:, :2].tolist(), [[2.0, 1.0], [2.0, 1.0], [2.0, 3.0]])
+        self.assertTrue(np.isnan(filled[:, 2]).all())
+
+    def test_portfolio_statistics(self):
+        """
+        Ensure weights, drawdown and beta match hand computed values.
+        """
+        closes = np.array([[10.0, 100.0], [11.0, 100.0], [9.9, 100.0], [12.1, 100.0]])
+        benchmark = np.array([10.0, 11.0, 9.9, 12.1])
+        stats = portfolio_analytics(closes, [10, 1], [12.1, 100.0], benchmark_closes=benchmark, correlation=True)
+        self.assertAlmostEqual(stats['weights'][0], 121 / 221)
+        self.assertAlmostEqual(stats['max_drawdown'], 199 / 210 - 1)
+        self.assertAlmostEqual(stats['holding_beta'][0], 1.0)
+        self.assertAlmostEqual(stats['holding_beta'][1], 0.0)
+        self.assertAlmostEqual(stats['correlation'][0, 0], 1.0)
+        self.assertTrue(np.isnan(stats['correlation'][0, 1]))
+        self.assertEqual(max_drawdown(np.array([1.0, 2.0, 3.0])), 0.0)
+
+    def test_without_history(self):
+        """
+        Ensure a portfolio without price history still reports its weights.
+        """
+        stats = portfolio_analytics(np.empty((0, 2)), [1, 3], [10, 10])
+        self.assertEqual(stats['weights'].tolist(), [0.25, 0.75])
+        self.assertIsNone(stats['volatility'])
+
+
+class PortfolioAnalyticsViewTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICE_HISTORY_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=user)
+        self.portfolio = Portfolio.objects.create(user=user, name='Growth')
+        for ticker, quantity in (('AAPL', 5), ('AAPL', 5), ('MSFT', 10)):
+            Stock.objects.create(portfolio=self.portfolio, ticker_symbol=ticker, quantity=quantity,
+                                 initial_purchase_price='100.00', purchase_date=timezone.now())
+        ETF.objects.create(portfolio=self.portfolio, ticker_symbol='SPY', quantity=1,
+                           initial_purchase_price='400.00', purchase_date=timezone.now())
+        store = self.store = PriceHistoryStore(directory.name)
+        days = np.arange(30) * 86400
+        store.append('STOCK', 'AAPL', days, 100 + np.arange(30.0))
+        store.append('STOCK', 'MSFT', days, 100 + 20 * np.sin(np.arange(30.0)))
+        store.append('ETF', 'SPY', days, 400 + 4 * np.arange(30.0))
+        Instrument.objects.update(last_price=Decimal('100.00'))
+
+    def test_analytics(self):
+        """
+        Ensure analytics aggregate lots per instrument and report portfolio statistics.
+        """
+        url = reverse('portfolio-analytics', args=[self.portfolio.pk])
+        response = self.client.get(url, {'correlation': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['observations'], 30)
+        self.assertEqual([holding['quantity'] for holding in response.data['holdings']], [10, 10, 1])
+        self.assertAlmostEqual(sum(holding['weight'] for holding in response.data['holdings']), 1.0)
+        self.assertLess(response.data['max_drawdown'], 0)
+        self.assertAlmostEqual(response.data['correlation']['matrix'][0][2], 1.0)
+
+    def test_analytics_over_two_days(self):
+        """
+        Ensure a range with a single return reports None instead of non-finite statistics.
+        """
+        url = reverse('portfolio-analytics', args=[self.portfolio.pk])
+        response = self.client.get(url, {'start': '1970-01-01', 'end': '1970-01-02'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['observations'], 2)
+        self.assertIsNotNone(response.data['annual_return'])
+        for statistic in ('volatility', 'sharpe_ratio', 'beta'):
+            self.assertIsNone(response.data[statistic])
+        self.assertEqual({holding['volatility'] for holding in response.data['holdings']}, {None})
+
+    def test_analytics_across_currencies(self):
+        """
+        Ensure closes quoted in other currencies are converted before they are summed into portfolio values.
+        """
+        reset_conversion_matrix()
+        self.addCleanup(reset_conversion_matrix)
+        portfolio = Portfolio.objects.create(user=self.portfolio.user, name='Global')
+        for ticker, quantity in (('IBM', 10), ('SONY', 1)):
+            Stock.objects.create(portfolio=portfolio, ticker_symbol=ticker, quantity=quantity,
+                                 initial_purchase_price='100.00', purchase_date=timezone.now())
+        Instrument.objects.filter(symbol='IBM').update(last_price=Decimal('100.00'))
+        Instrument.objects.filter(symbol='SONY').update(currency='JPY', last_price=Decimal('50000.00'))
+        FXRate.objects.upsert_rates([('JPY', Decimal('0.01'), timezone.now())])
+        days = np.arange(2) * 86400
+        self.store.append('STOCK', 'IBM', days, np.array([100.0, 100.0]))
+        self.store.append('STOCK', 'SONY', days, np.array([100000.0, 50000.0]))
+
+        response = self.client.get(reverse('portfolio-analytics', args=[portfolio.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 1000 USD of IBM and 1000 USD of SONY, then 500 USD of SONY
+        self.assertAlmostEqual(response.data['max_drawdown'], -0.25)
+        for holding, weight in zip(response.data['holdings'], (2 / 3, 1 / 3)):
+            self.assertAlmostEqual(holding['weight'], weight)
+
+
+class TradeExecutionTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='trader', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Contest')
+        Instrument.objects.upsert_quotes([
+            (Instrument.STOCK, 'AAPL', Decimal('100.00'), timezone.now()),
+            (Instrument.CRYPTO, 'ETH', Decimal('2000.00'), timezone.now()),
+        ])
+        self.aapl = Instrument.objects.get(symbol='AAPL')
+        self.eth = Instrument.objects.get(symbol='ETH')
+
+    def order(self, instrument, trade_type, quantity):
+        return {'portfolio': self.portfolio.pk, 'instrument': instrument.pk,
+                'trade_type': trade_type, 'trade_quantity': quantity}
+
+    def test_buy_and_sell(self):
+        """
+        Ensure trades fill at the latest price and move the holding's quantity.
+        """
+        url = reverse('virtualtrade-list')
+        response = self.client.post(url, self.order(self.aapl, 'BUY', 10), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['trade_price'], '100.00')
+        Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('110.00'), timezone.now())])
+        self.client.post(url, self.order(self.aapl, 'BUY', 10), format='json')
+        stock = Stock.objects.get(portfolio=self.portfolio)
+        self.assertEqual((stock.quantity, stock.initial_purchase_price), (20, Decimal('105.00')))
+
+        response = self.client.post(url, self.order(self.aapl, 'SELL', 25), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.post(url, self.order(self.aapl, 'SELL', 20), format='json')
+        self.assertFalse(Stock.objects.exists())
+        self.assertEqual(VirtualTrade.objects.count(), 3)
+
+    def test_batch_is_atomic(self):
+        """
+        Ensure a batch with a rejected order writes nothing and reports the failing index.
+        """
+        url = reverse('virtualtrade-batch')
+        orders = [self.order(self.aapl, 'BUY', 5), self.order(self.eth, 'SELL', 1)]
+        response = self.client.post(url, orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data['errors']), [1])
+        self.assertFalse(VirtualTrade.objects.exists())
+        self.assertFalse(Stock.objects.exists())
+
+    def test_batch_queries_do_not_grow_with_orders(self):
+        """
+        Ensure hundreds of orders execute with a constant number of queries.
+        """
+        url = reverse('virtualtrade-batch')
+        orders = [self.order(self.aapl, 'BUY', 2), self.order(self.eth, 'BUY', 1)] * 150
+        orders += [self.order(self.aapl, 'SELL', 1)] * 100
+        get_price_cache().get_many([self.aapl.pk, self.eth.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, orders, format='json')
+        # Lock, lookups, one write per table and the ledger upsert; SQLite may split the trade insert
+        self.assertLessEqual(len(queries), 16)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 400)
+        self.assertEqual(Stock.objects.get().quantity, 200)
+        self.assertEqual(Cryptocurrency.objects.get().quantity, 150)
+        self.assertEqual(VirtualTrade.objects.count(), 400)
+
+
+class PositionLedgerTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='trader', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolios = [Portfolio.objects.create(user=self.user, name=name) for name in ('Long', 'Swing')]
+        Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('100.00'), timezone.now())])
+        self.aapl = Instrument.objects.get(symbol='AAPL')
+
+    def trade(self, portfolio, trade_type, quantity, price):
+        Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal(price), timezone.now())])
+        response = self.client.post(reverse('virtualtrade-list'), {
+            'portfolio': portfolio.pk, 'instrument': self.aapl.pk,
+            'trade_type': trade_type, 'trade_quantity': quantity}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_incremental_positions(self):
+        """
+        Ensure trades across portfolios update one position with average cost and realized P&L.
+        """
+        self.trade(self.portfolios[0], 'BUY', 10, '100.00')
+        self.trade(self.portfolios[1], 'BUY', 30, '120.00')
+        self.trade(self.portfolios[1], 'SELL', 20, '130.00')
+        position = Position.objects.get(user=self.user, instrument=self.aapl)
+        self.assertEqual((position.quantity, position.average_cost, position.realized_pnl),
+                         (20, Decimal('115.0000'), Decimal('300.00')))
+
+        response = self.client.get(reverse('position-list'))
+        self.assertEqual(response.data['results'][0]['unrealized_pnl'], '300.00')
+
+    def test_saved_trades_and_rebuild(self):
+        """
+        Ensure trades saved directly are recorded and a rebuild reproduces the ledger.
+        """
+        self.trade(self.portfolios[0], 'BUY', 3, '50.00')
+        VirtualTrade.objects.create(user=self.user, portfolio=self.portfolios[0], instrument=self.aapl,
+                                    trade_type='SELL', trade_quantity=1, trade_price=Decimal('80.00'))
+        expected = Position.objects.values_list('quantity', 'average_cost', 'realized_pnl').get()
+        self.assertEqual(expected, (2, Decimal('50.0000'), Decimal('30.00')))
+
+        Position.objects.update(quantity=0, realized_pnl=0)
+        call_command('rebuild_positions', '--chunk-size', '1', stdout=tempfile.TemporaryFile('w'))
+        self.assertEqual(Position.objects.values_list('quantity', 'average_cost', 'realized_pnl').get(), expected)
+
+
+class KeysetPaginationTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='trader', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        portfolio = Portfolio.objects.create(user=self.user, name='Contest')
+        instrument = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL', last_price=1)
+        # Equal trade dates force the id tie breaker to be used
+        trade_date = timezone.now()
+        VirtualTrade.objects.bulk_create(
+            [VirtualTrade(user=self.user, portfolio=portfolio, instrument=instrument, trade_type='BUY',
+                          trade_quantity=i + 1, trade_price=1) for i in range(25)]
+            + [VirtualTrade(user=other, portfolio=portfolio, instrument=instrument, trade_type='BUY',
+                            trade_quantity=1, trade_price=1)])
+        VirtualTrade.objects.update(trade_date=trade_date)
+
+    def test_walk_forward_and_back(self):
+        """
+        Ensure cursor pages cover the user's trades exactly once in both directions.
+        """
+        url = reverse('virtualtrade-list')
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 10, 'count': 'exact'})
+        self.assertEqual(response.data['count'], 25)
+        self.assertIsNone(response.data['previous'])
+        pages = [[trade['trade_quantity'] for trade in response.data['results']]]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append([trade['trade_quantity'] for trade in response.data['results']])
+        self.assertNotIn('count', response.data)
+        self.assertEqual(sum(pages, []), list(range(25, 0, -1)))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([trade['trade_quantity'] for trade in response.data['results']], pages[1])
+
+    def test_page_cost_is_constant(self):
+        """
+        Ensure a deep page runs a single keyset query without COUNT or OFFSET.
+        """
+        url = reverse('virtualtrade-list')
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 20})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+        selects = [query['sql'] for query in queries if 'virtualtrade' in query['sql'].lower()]
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('COUNT', selects[0].upper())
+        self.assertNotIn('OFFSET', selects[0].upper())
+
+    def test_invalid_cursor(self):
+        """
+        Ensure a malformed cursor is rejected.
+        """
+        response = self.client.get(reverse('virtualtrade-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    Guards list endpoints against N+1 queries: a list must run the same, fixed number of
+    queries whether it holds 10 or 1,000 rows.
+    """
+    sizes = (10, 1000)
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_authenticate(user=self.admin)
+        self.portfolio = Portfolio.objects.create(user=self.admin, name='Main')
+        self.instruments = {asset_class: Instrument.objects.create(asset_class=asset_class, symbol='SYM',
+                                                                   last_price=Decimal('1.00'))
+                            for asset_class, _ in Instrument.ASSET_CLASS_CHOICES}
+
+    def seed_users(self, start, count):
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(start, start + count)])
+        UserProfile.objects.bulk_create([UserProfile(user=user, email=f'{user.username}@example.com', age=30)
+                                         for user in users])
+
+    def seed_holdings(self, model, count):
+        instrument = self.instruments[model.asset_class]
+        model.objects.bulk_create([model(portfolio=self.portfolio, instrument=instrument, quantity=1,
+                                         initial_purchase_price=1, purchase_date=timezone.now(),
+                                         **{model.symbol_field: 'SYM'}) for _ in range(count)])
+
+    def seed_trades(self, count):
+        VirtualTrade.objects.bulk_create([VirtualTrade(user=self.admin, portfolio=self.portfolio,
+                                                       instrument=self.instruments[Instrument.STOCK],
+                                                       trade_type='BUY', trade_quantity=1, trade_price=1)
+                                          for _ in range(count)])
+
+    def seed_instruments(self, start, count):
+        Instrument.objects.bulk_create([Instrument(asset_class=Instrument.ETF, symbol=f'ETF{i}')
+                                        for i in range(start, start + count)])
+
+    def assertListQueries(self, url_name, seed, max_queries, params=None):
+        seeded = 0
+        for size in self.sizes:
+            seed(seeded, size - seeded)
+            seeded = size
+            reset_price_cache()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(url_name), params or {})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(queries), max_queries,
+                                 f'{url_name} ran {len(queries)} queries for {size} rows')
+
+    def test_users(self):
+        """
+        Ensure listing users with their nested profiles runs a fixed number of queries.
+        """
+        self.assertListQueries('user-list', self.seed_users, 1)
+
+    def test_profiles(self):
+        """
+        Ensure listing profiles runs a fixed number of queries.
+        """
+        self.assertListQueries('userprofile-list', self.seed_users, 2)
+
+    def test_portfolios(self):
+        """
+        Ensure listing portfolios runs a fixed number of queries.
+        """
+        self.assertListQueries('portfolio-list', lambda start, count: Portfolio.objects.bulk_create(
+            [Portfolio(user=self.admin, name=f'P{i}') for i in range(start, start + count)]), 1)
+
+    def test_holdings(self):
+        for url_name, model in (('stock-list', Stock), ('etf-list', ETF), ('cryptocurrency-list', Cryptocurrency)):
+            with self.subTest(url_name):
+                self.assertListQueries(url_name, lambda start, count: self.seed_holdings(model, count), 3)
+
+    def test_trades(self):
+        """
+        Ensure listing trades in both pagination modes runs a fixed number of queries.
+        """
+        self.assertListQueries('virtualtrade-list', lambda start, count: self.seed_trades(count), 2)
+        self.assertListQueries('virtualtrade-list', lambda start, count: None, 1, {'pagination': 'cursor'})
+
+    def test_instruments(self):
+        """
+        Ensure listing instruments runs a fixed number of queries.
+        """
+        self.assertListQueries('instrument-list', self.seed_instruments, 2)
+
+    def test_posts_and_faqs(self):
+        """
+        Ensure listing blog posts and FAQs runs a fixed number of queries.
+        """
+        self.assertListQueries('blogpost-list', lambda start, count: BlogPost.objects.bulk_create(
+            [BlogPost(author=self.admin, title=f'Post {i}', content='...') for i in range(count)]), 1)
+        self.assertListQueries('faq-list', lambda start, count: FAQ.objects.bulk_create(
+            [FAQ(question=f'Q{i}?', answer='A') for i in range(count)]), 1)
+
+
+class ExportTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='trader', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.aapl = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL', last_price=Decimal('110.00'))
+        self.btc = Instrument.objects.create(asset_class=Instrument.CRYPTO, symbol='BTC', last_price=Decimal('30000.00'))
+        VirtualTrade.objects.bulk_create([VirtualTrade(user=self.user, portfolio=self.portfolio, instrument=self.aapl,
+                                                       trade_type='BUY', trade_quantity=i + 1, trade_price=100)
+                                          for i in range(7)])
+        other = User.objects.create_user(username='other', password='testpass123')
+        VirtualTrade.objects.create(user=other, portfolio=Portfolio.objects.create(user=other, name='Other'),
+                                    instrument=self.aapl, trade_type='BUY', trade_quantity=99, trade_price=100)
+
+    def stream(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    @patch.object(VirtualTradeViewSet, 'export_chunk_size', 3)
+    def test_trades_csv(self):
+        """
+        Ensure the trade export streams every trade of the user, newest first, across chunk boundaries.
+        """
+        response = self.client.get(reverse('virtualtrade-export'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('trades.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(self.stream(response))))
+        self.assertEqual(rows[0], ['id', 'trade_date', 'trade_type', 'portfolio', 'asset_class', 'symbol',
+                                   'trade_quantity', 'trade_price'])
+        self.assertEqual([row[6] for row in rows[1:]], ['7', '6', '5', '4', '3', '2', '1'])
+        self.assertEqual(rows[1][4:6], [Instrument.STOCK, 'AAPL'])
+
+    @patch.object(VirtualTradeViewSet, 'export_chunk_size', 3)
+    def test_trades_ndjson(self):
+        """
+        Ensure the trade export can be streamed as one JSON object per line.
+        """
+        response = self.client.get(reverse('virtualtrade-export'), {'output': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in self.stream(response).splitlines()]
+        self.assertEqual(len(lines), 7)
+        self.assertEqual((lines[0]['trade_quantity'], lines[0]['trade_price']), (7, '100.00'))
+        self.assertEqual(self.client.get(reverse('virtualtrade-export'), {'output': 'xml'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_holdings_export(self):
+        """
+        Ensure the holdings export streams holdings of every asset class with their latest prices.
+        """
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=10,
+                             initial_purchase_price=Decimal('100.00'), purchase_date=timezone.now())
+        Cryptocurrency.objects.create(portfolio=self.portfolio, crypto_name='BTC', quantity=2,
+                                      initial_purchase_price=Decimal('25000.00'), purchase_date=timezone.now())
+        url = reverse('portfolio-holdings-export', args=[self.portfolio.pk])
+        lines = [json.loads(line) for line in self.stream(self.client.get(url, {'output': 'ndjson'})).splitlines()]
+        self.assertEqual([(line['symbol'], line['quantity'], line['current_price']) for line in lines],
+                         [('AAPL', 10, '110.00'), ('BTC', 2, '30000.00')])
+
+
+class HoldingsImportTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='advisor', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Onboarding')
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.other_portfolio = Portfolio.objects.create(user=other, name='Other')
+        Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL')
+
+    def row(self, asset_class, symbol, quantity=1, price='10.00', portfolio=None, **extra):
+        return {'portfolio': portfolio or self.portfolio.pk, 'asset_class': asset_class, 'symbol': symbol,
+                'quantity': quantity, 'initial_purchase_price': price, **extra}
+
+    def test_import_json(self):
+        """
+        Ensure mixed holdings are created against shared instruments in one request.
+        """
+        rows = [self.row('STOCK', 'AAPL', 5, purchase_date='2023-06-01'), self.row('etf', 'VTI', 2),
+                self.row('CRYPTO', 'BTC', 1, '30000.50')]
+        response = self.client.post(reverse('portfolio-holdings-import'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 3, 'errors': {}})
+        stock = Stock.objects.get()
+        self.assertEqual((stock.quantity, stock.instrument.symbol, stock.purchase_date.date().isoformat()),
+                         (5, 'AAPL', '2023-06-01'))
+        self.assertEqual(ETF.objects.get().instrument.asset_class, Instrument.ETF)
+        self.assertEqual(Cryptocurrency.objects.get().initial_purchase_price, Decimal('30000.50'))
+        self.assertEqual(Instrument.objects.count(), 3)
+
+    def test_rejected_rows(self):
+        """
+        Ensure rejected rows are reported by row number and nothing is written unless ?partial=true.
+        """
+        rows = [self.row('STOCK', 'AAPL'), self.row('BOND', 'UST', 0, 'x'),
+                self.row('STOCK', 'MSFT', portfolio=self.other_portfolio.pk)]
+        url = reverse('portfolio-holdings-import')
+        response = self.client.post(url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(sorted(response.data['errors']), [2, 3])
+        self.assertEqual(sorted(response.data['errors'][2]), ['asset_class', 'initial_purchase_price', 'quantity'])
+        self.assertEqual(response.data['errors'][3], {'portfolio': ['Unknown portfolio.']})
+        self.assertFalse(Stock.objects.exists())
+
+        response = self.client.post(url + '?partial=true', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Stock.objects.get().ticker_symbol, 'AAPL')
+
+    def test_fractional_quantities_rejected(self):
+        """
+        Ensure fractional quantities are reported per row instead of being truncated.
+        """
+        rows = [self.row('STOCK', 'AAPL', 1.5), self.row('CRYPTO', 'BTC', '0.25'), self.row('ETF', 'VTI', 2.0)]
+        response = self.client.post(reverse('portfolio-holdings-import'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][1], {'quantity': ['A valid integer is required.']})
+        self.assertEqual(response.data['errors'][2], {'quantity': ['A valid integer is required.']})
+        self.assertNotIn(3, response.data['errors'])
+        self.assertFalse(Stock.objects.exists())
+
+    def test_import_file(self):
+        """
+        Ensure holdings can be uploaded as a CSV file.
+        """
+        upload = io.BytesIO(b'portfolio,asset_class,symbol,quantity,initial_purchase_price\n'
+                            + f'{self.portfolio.pk},STOCK,AAPL,3,101.5\n{self.portfolio.pk},ETF,VTI,4,200\n'.encode())
+        upload.name = 'holdings.csv'
+        response = self.client.post(reverse('portfolio-holdings-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+
+    def test_command_queries_per_batch(self):
+        """
+        Ensure the command imports thousands of rows with a handful of queries per batch.
+        """
+        handle = tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False)
+        self.addCleanup(os.remove, handle.name)
+        for i in range(3000):
+            asset_class = ('STOCK', 'ETF', 'CRYPTO')[i % 3]
+            handle.write(json.dumps(self.row(asset_class, f'S{i % 50}', i + 1)) + '\n')
+        handle.close()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_holdings', handle.name, '--batch-size', '1000', '--user', 'advisor',
+                         stdout=tempfile.TemporaryFile('w'))
+        # Per batch: instrument upsert and lookup plus one insert per asset class, which SQLite
+        # splits into chunks of its bound parameter limit
+        self.assertLessEqual(len(queries), 40)
+        self.assertEqual(Stock.objects.count() + ETF.objects.count() + Cryptocurrency.objects.count(), 3000)
+
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        self.addCleanup(os.remove, handle.name)
+        handle.write(f'portfolio,asset_class,symbol,quantity,initial_purchase_price\n'
+                     f'{self.other_portfolio.pk},STOCK,AAPL,1,1\n')
+        handle.close()
+        with self.assertRaises(CommandError):
+            call_command('import_holdings', handle.name, '--user', 'advisor',
+                         stdout=tempfile.TemporaryFile('w'), stderr=tempfile.TemporaryFile('w'))
+
+
+class PortfolioHoldingsTests(APITestCase):
+
+    def setUp(self):
+        reset_response_cache()
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Mixed')
+        Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL', last_price=Decimal('100.00'))
+        Instrument.objects.create(asset_class=Instrument.ETF, symbol='VTI', last_price=Decimal('200.00'))
+        Instrument.objects.create(asset_class=Instrument.CRYPTO, symbol='BTC', last_price=Decimal('30000.00'))
+        now = timezone.now()
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=10,
+                             initial_purchase_price=Decimal('90.00'), purchase_date=now)
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='MSFT', quantity=3,
+                             initial_purchase_price=Decimal('300.00'), purchase_date=now)
+        ETF.objects.create(portfolio=self.portfolio, ticker_symbol='VTI', quantity=2,
+                           initial_purchase_price=Decimal('190.00'), purchase_date=now)
+        Cryptocurrency.objects.create(portfolio=self.portfolio, crypto_name='BTC', quantity=1,
+                                      initial_purchase_price=Decimal('25000.00'), purchase_date=now)
+        other = Portfolio.objects.create(user=self.user, name='Other')
+        Stock.objects.create(portfolio=other, ticker_symbol='AAPL', quantity=99,
+                             initial_purchase_price=Decimal('1.00'), purchase_date=now)
+        self.url = reverse('portfolio-holdings', args=[self.portfolio.pk])
+
+    def test_sorted_by_value_in_one_query(self):
+        """
+        Ensure holdings of every asset class come back from one query, sorted by current value.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'ordering': '-current_value'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual([(row['asset_class'], row['symbol'], row['current_value'])
+                          for row in response.data['results']],
+                         [('CRYPTO', 'BTC', '30000.00'), ('STOCK', 'AAPL', '1000.00'),
+                          ('ETF', 'VTI', '400.00'), ('STOCK', 'MSFT', None)])
+        # Portfolio lookup, page count and the page itself
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(sum('UNION' in query['sql'] for query in queries.captured_queries), 2)
+
+    def test_filters(self):
+        """
+        Ensure holdings can be filtered by asset class and symbol.
+        """
+        response = self.client.get(self.url, {'asset_class': 'stock,etf', 'ordering': 'symbol'})
+        self.assertEqual([row['symbol'] for row in response.data['results']], ['AAPL', 'MSFT', 'VTI'])
+        response = self.client.get(self.url, {'symbol': 'btc'})
+        self.assertEqual([row['asset_class'] for row in response.data['results']], ['CRYPTO'])
+        self.assertEqual(self.client.get(self.url, {'asset_class': 'BOND'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'ordering': 'initial_purchase_price'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+class FastReadTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL', last_price=Decimal('187.5'),
+                                  quoted_at=timezone.now())
+        for quantity in (1, 2, 3):
+            Stock.objects.create(portfolio=portfolio, ticker_symbol='AAPL', quantity=quantity,
+                                 initial_purchase_price=Decimal('100.1'), purchase_date=timezone.now())
+            Stock.objects.create(portfolio=portfolio, ticker_symbol='NEW', quantity=quantity,
+                                 initial_purchase_price=Decimal('5'), purchase_date=timezone.now())
+        instrument = Instrument.objects.get(symbol='AAPL')
+        VirtualTrade.objects.bulk_create([VirtualTrade(user=self.user, portfolio=portfolio, instrument=instrument,
+                                                       trade_type=trade_type, trade_quantity=1, trade_price=Decimal('187.5'))
+                                          for trade_type in ('BUY', 'SELL', 'BUY')])
+        self.stock = Stock.objects.first()
+
+    def assertSameContent(self, viewset, url, params=None):
+        fast = self.client.get(url, params or {})
+        with patch.object(viewset, 'fast_read', False):
+            drf = self.client.get(url, params or {})
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, drf.content)
+
+    def test_matches_drf_output(self):
+        """
+        Ensure the fast path renders byte for byte the same JSON as the serializers.
+        """
+        self.assertSameContent(StockViewSet, reverse('stock-list'))
+        self.assertSameContent(StockViewSet, reverse('stock-list'), {'pagination': 'cursor', 'page_size': 2})
+        self.assertSameContent(StockViewSet, reverse('stock-detail', args=[self.stock.pk]))
+        self.assertSameContent(VirtualTradeViewSet, reverse('virtualtrade-list'))
+        self.assertSameContent(VirtualTradeViewSet, reverse('virtualtrade-list'), {'pagination': 'cursor'})
+
+    def test_keyset_cursor_from_rows(self):
+        """
+        Ensure keyset cursors built from fast path rows page through every holding.
+        """
+        url, symbols = reverse('stock-list'), []
+        params = {'pagination': 'cursor', 'page_size': 4}
+        while url:
+            response = self.client.get(url, params)
+            symbols += [row['ticker_symbol'] for row in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(len(symbols), 6)
+
+    def test_plan_rejects_method_fields(self):
+        """
+        Ensure serializers with computed fields cannot be compiled.
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            compile_serializer(PositionSerializer)
+
+
+class BenchmarkSuiteTests(APITestCase):
+    # Portfolio history is read from the document store
+    databases = {'default', 'mongo'}
+
+    def setUp(self):
+        reset_price_cache()
+        reset_response_cache()
+
+    def generate(self, seed, run=None):
+        return generate_dataset(users=2, portfolios=1, holdings=6, trades=5, instruments=6, history_days=10, seed=seed,
+                                run=run)
+
+    def test_generator_is_seeded(self):
+        """
+        Ensure the same seed generates the same holdings.
+        """
+        with transaction.atomic():
+            self.generate(seed=7, run='T')
+            first = sorted(Stock.objects.values_list('ticker_symbol', 'quantity', 'initial_purchase_price'))
+            transaction.set_rollback(True)
+        self.generate(seed=7, run='T')
+        self.assertEqual(sorted(Stock.objects.values_list('ticker_symbol', 'quantity', 'initial_purchase_price')),
+                         first)
+
+    def test_generates_beside_earlier_run(self):
+        """
+        Ensure a second data set can be generated into a database that still holds the first.
+        """
+        first = self.generate(seed=0)
+        second = self.generate(seed=0)
+        self.assertNotEqual(first.username, second.username)
+        self.assertEqual(Instrument.objects.count(), 12)
+
+    def test_serializer_benchmark_beside_earlier_rows(self):
+        """
+        Ensure the serializer benchmark seeds its own prefixed rows next to existing ones and rolls them back.
+        """
+        self.generate(seed=0)
+        users, instruments = User.objects.count(), Instrument.objects.count()
+        out = io.StringIO()
+        for _ in range(2):
+            call_command('benchmark_serializers', '--rows', '5', '--repeat', '1', stdout=out)
+        self.assertEqual(out.getvalue().count('VirtualTradeSerializer'), 2)
+        self.assertEqual((User.objects.count(), Instrument.objects.count()), (users, instruments))
+
+    def test_runs_every_route(self):
+        """
+        Ensure every GET route of the router is measured and a slower run is reported as a regression.
+        """
+        user = self.generate(seed=0)
+        with tempfile.TemporaryDirectory() as root, override_settings(PRICE_HISTORY_ROOT=root):
+            endpoints = run_benchmarks(router, user, iterations=2)
+        self.assertIn('virtualtrade-export', endpoints)
+        self.assertIn('portfolio-analytics', endpoints)
+        self.assertEqual({name for name, metrics in endpoints.items() if metrics['status'] != 200}, set())
+        self.assertEqual(set(endpoints['stock-list']), {'status', 'p50_ms', 'p95_ms', 'p99_ms', 'queries',
+                                                        'rows', 'peak_kib'})
+        self.assertEqual(endpoints['virtualtrade-list']['rows'], 5)
+
+        baseline = results_document(endpoints, 'test', 0, 2)
+        current = json.loads(json.dumps(baseline))
+        current['endpoints']['stock-list']['queries'] += 1
+        current['endpoints']['stock-list']['p95_ms'] = endpoints['stock-list']['p95_ms'] * 2 + 1
+        self.assertEqual(len(compare_results(baseline, current)), 2)
+
+
+class ProfilingTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        reset_metrics_registry()
+        self.user = User.objects.create_user(username='ops', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        Stock.objects.create(portfolio=portfolio, ticker_symbol='AAPL', quantity=1,
+                             initial_purchase_price=Decimal('1.00'), purchase_date=timezone.now())
+
+    def test_server_timing_and_metrics(self):
+        """
+        Ensure responses carry Server-Timing phases and requests are aggregated per route on /metrics.
+        """
+        with patch.object(StockViewSet, 'fast_read', False):
+            response = self.client.get(reverse('stock-list'))
+        timing = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'sql', 'serialize', 'render'})
+        # Count, page and the instrument prices
+        self.assertIn('desc="3 queries"', timing['sql'])
+        self.client.get(reverse('stock-list'))
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="stock-list"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="stock-list",le="+Inf"} 2', body)
+        self.assertIn('http_requests_total{method="GET",route="stock-list",status="200"} 2', body)
+        self.assertIn('http_request_sql_queries_total{method="GET",route="stock-list"} 5', body)
+
+    @override_settings(PROFILING={'METRICS_TOKEN': 'secret'})
+    def test_metrics_token(self):
+        """
+        Ensure /metrics can require a bearer token.
+        """
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_keeps_slowest_profiles(self):
+        """
+        Ensure sampled profiles are dumped and only the slowest ones are kept.
+        """
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(PROFILING={'PROFILE_SAMPLE_RATE': 1.0, 'PROFILE_DIR': root, 'PROFILE_KEEP': 2}):
+                middleware = ProfilingMiddleware(lambda request: HttpResponse('ok'))
+            middleware(RequestFactory().get('/'))
+            self.assertEqual(len(os.listdir(root)), 1)
+
+            profiles = SlowestProfiles(root, keep=2)
+            for duration in (0.3, 0.1, 0.5, 0.2):
+                profile = cProfile.Profile()
+                profiles.offer(duration, 'stock-list', profile)
+            kept = sorted(name for name in os.listdir(root) if 'stock-list' in name)
+            self.assertEqual([name.split('ms')[0].strip('0') for name in kept], ['300.', '500.'])
+
+    @override_settings(QUOTE_PROVIDERS=[{'BACKEND': 'Backend.quotes.FakeQuoteProvider',
+                                         'OPTIONS': {'prices': {('STOCK', 'AAPL'): '190.50'}}}])
+    def test_async_views_stay_async(self):
+        """
+        Ensure the middleware awaits async views directly and still times their queries.
+        """
+        async def view(request):
+            return HttpResponse('ok')
+        middleware = ProfilingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertFalse(asyncio.iscoroutinefunction(ProfilingMiddleware(lambda request: HttpResponse('ok'))))
+        self.assertEqual(async_to_sync(middleware)(RequestFactory().get('/')).content, b'ok')
+
+        async def quote():
+            credentials = 'Basic ' + base64.b64encode(b'ops:testpass123').decode()
+            return await AsyncClient().get(reverse('quotes'), {'symbols': 'STOCK:AAPL'}, AUTHORIZATION=credentials)
+        response = async_to_sync(quote)()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertNotIn('desc="0 queries"', timing['sql'])
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_requests_total{method="GET",route="quotes",status="200"} 1', body)
+
+
+class SlowQuoteProvider(FakeQuoteProvider):
+    """
+    Fails its first `failures` calls by outlasting the service timeout.
+    """
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    async def fetch(self, instruments):
+        if self.calls < self.failures:
+            self.calls += 1
+            await asyncio.sleep(1)
+        return await super().fetch(instruments)
+
+
+class QuoteServiceTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        reset_quote_service()
+        self.addCleanup(reset_quote_service)
+
+    def test_sweep_runs_batches_concurrently(self):
+        """
+        Ensure a sweep of 5,000 symbols is split into provider sized batches that run at the same time.
+        """
+        provider = FakeQuoteProvider(latency=0.05, max_batch_size=100)
+        service = QuoteService([provider])
+        instruments = [(Instrument.STOCK, f'SYM{i}') for i in range(5000)]
+        started = time.perf_counter()
+        quotes, missing = asyncio.run(service.fetch_quotes(instruments))
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(quotes), 5000)
+        self.assertEqual(missing, [])
+        self.assertEqual(provider.calls, 50)
+        # Sequential batches would take 50 * 0.05s
+        self.assertLess(elapsed, 1.0)
+
+    def test_falls_back_to_next_provider(self):
+        """
+        Ensure instruments a failing provider cannot price are quoted by the next one, and
+        instruments no provider supports are reported missing.
+        """
+        failing = FakeQuoteProvider(failure_rate=1.0, name='down')
+        crypto_only = FakeQuoteProvider(asset_classes=[Instrument.CRYPTO], prices={(Instrument.CRYPTO, 'BTC'): '42000'})
+        service = QuoteService([failing, crypto_only], retries=1, backoff=0)
+        quotes, missing = asyncio.run(service.fetch_quotes([(Instrument.CRYPTO, 'BTC'), (Instrument.STOCK, 'AAPL')]))
+
+        self.assertEqual(failing.calls, 2)
+        self.assertEqual([(asset_class, symbol, price) for asset_class, symbol, price, _ in quotes],
+                         [(Instrument.CRYPTO, 'BTC', Decimal('42000'))])
+        self.assertEqual(missing, [(Instrument.STOCK, 'AAPL')])
+
+    def test_retries_timeouts(self):
+        """
+        Ensure calls outlasting the timeout are retried.
+        """
+        provider = SlowQuoteProvider(failures=1)
+        service = QuoteService([provider], timeout=0.05, retries=1, backoff=0)
+        quotes, missing = asyncio.run(service.fetch_quotes([(Instrument.ETF, 'VOO')]))
+        self.assertEqual(len(quotes), 1)
+        self.assertEqual(provider.calls, 2)
+
+        service = QuoteService([SlowQuoteProvider(failures=5)], timeout=0.05, retries=1, backoff=0)
+        self.assertEqual(asyncio.run(service.fetch_quotes([(Instrument.ETF, 'VOO')])), ([], [(Instrument.ETF, 'VOO')]))
+
+    def test_http_provider_keeps_asset_classes_apart(self):
+        """
+        Ensure a symbol listed under two asset classes is requested and priced once per asset class.
+        """
+        prices = {(Instrument.STOCK, 'ABC'): 12.5, (Instrument.CRYPTO, 'ABC'): 0.25, (Instrument.STOCK, 'XYZ'): 40}
+
+        def get(asset_class, symbols):
+            return {'quotes': [{'symbol': symbol, 'price': prices[(asset_class, symbol)], 'timestamp': 0}
+                               for symbol in symbols]}
+
+        provider = HTTPQuoteProvider('https://quotes.example.com')
+        instruments = [(Instrument.STOCK, 'ABC'), (Instrument.CRYPTO, 'ABC'), (Instrument.STOCK, 'XYZ')]
+        with patch.object(provider, 'get', side_effect=get) as request:
+            quotes = asyncio.run(provider.fetch(instruments))
+        self.assertEqual(sorted(call.args[0] for call in request.call_args_list), [Instrument.CRYPTO, Instrument.STOCK])
+        self.assertEqual({instrument: price for instrument, (price, _) in quotes.items()},
+                         {instrument: Decimal(str(price)) for instrument, price in prices.items()})
+
+    def test_rate_limiter(self):
+        """
+        Ensure the token bucket allows bursts and then spaces calls at its rate.
+        """
+        async def acquire(count):
+            limiter = RateLimiter(rate=100, burst=5)
+            started = time.perf_counter()
+            for _ in range(count):
+                await limiter.acquire()
+            return time.perf_counter() - started
+
+        self.assertLess(asyncio.run(acquire(5)), 0.02)
+        self.assertGreaterEqual(asyncio.run(acquire(15)), 0.09)
+
+    def test_refresh_updates_prices_and_history(self):
+        """
+        Ensure a refresh upserts the latest prices of every instrument and appends them to the history.
+        """
+        Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL', last_price=Decimal('1.00'))
+        Instrument.objects.create(asset_class=Instrument.CRYPTO, symbol='BTC')
+        provider = FakeQuoteProvider(prices={(Instrument.STOCK, 'AAPL'): '190.50', (Instrument.CRYPTO, 'BTC'): '42000'})
+        with tempfile.TemporaryDirectory() as root, override_settings(PRICE_HISTORY_ROOT=root):
+            # async_to_sync keeps the database work of sync_to_async on this thread's connection
+            updated, missing = async_to_sync(QuoteService([provider]).refresh)()
+            ticks = PriceHistoryStore(root).range(Instrument.STOCK, 'AAPL')
+
+        self.assertEqual((updated, missing), (2, []))
+        self.assertEqual(Instrument.objects.get(symbol='AAPL').last_price, Decimal('190.50'))
+        self.assertEqual(Instrument.objects.get(symbol='BTC').last_price, Decimal('42000'))
+        self.assertEqual(list(ticks['p']), [190.5])
+
+    @override_settings(QUOTE_PROVIDERS=[{'BACKEND': 'Backend.quotes.FakeQuoteProvider',
+                                         'OPTIONS': {'prices': {('STOCK', 'AAPL'): '190.50'}}}])
+    def test_quote_views(self):
+        """
+        Ensure the async quote views require a user, quote the requested symbols and let staff refresh prices.
+        """
+        url = reverse('quotes')
+        self.assertEqual(self.client.get(url, {'symbols': 'STOCK:AAPL'}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        User.objects.create_user(username='investor', password='testpass123')
+        self.client.login(username='investor', password='testpass123')
+        self.assertEqual(self.client.get(url, {'symbols': 'BOND:X'}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'symbols': 'STOCK:AAPL'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(quote['symbol'], quote['price']) for quote in response.json()['quotes']], [('AAPL', '190.50')])
+        self.assertEqual(self.client.post(reverse('quotes-refresh')).status_code, status.HTTP_403_FORBIDDEN)
+
+        User.objects.create_superuser(username='ops', password='testpass123')
+        self.client.login(username='ops', password='testpass123')
+        Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL')
+        with tempfile.TemporaryDirectory() as root, override_settings(PRICE_HISTORY_ROOT=root):
+            response = self.client.post(reverse('quotes-refresh'))
+        self.assertEqual(response.json(), {'updated': 1, 'missing': []})
+        self.assertEqual(Instrument.objects.get(symbol='AAPL').last_price, Decimal('190.50'))
+
+    @override_settings(QUOTE_PROVIDERS=[])
+    def test_quote_views_without_provider(self):
+        """
+        Ensure the quote views answer 503 with a clear message when no quote provider is configured.
+        """
+        User.objects.create_superuser(username='ops', password='testpass123')
+        self.client.login(username='ops', password='testpass123')
+        for response in (self.client.get(reverse('quotes'), {'symbols': 'STOCK:AAPL'}),
+                         self.client.post(reverse('quotes-refresh'))):
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response.json(), {'detail': 'No quote provider is configured.'})
+
+    @override_settings(QUOTE_PROVIDERS=[{'BACKEND': 'Backend.quotes.FakeQuoteProvider',
+                                         'OPTIONS': {'prices': {('STOCK', 'AAPL'): '190.50'}}}])
+    def test_quote_views_csrf(self):
+        """
+        Ensure API clients can refresh quotes with HTTP Basic credentials while session requests still need a CSRF token.
+        """
+        User.objects.create_superuser(username='ops', password='testpass123')
+        Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL')
+        client = Client(enforce_csrf_checks=True)
+        credentials = 'Basic ' + base64.b64encode(b'ops:testpass123').decode()
+        with tempfile.TemporaryDirectory() as root, override_settings(PRICE_HISTORY_ROOT=root):
+            response = client.post(reverse('quotes-refresh'), HTTP_AUTHORIZATION=credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'updated': 1, 'missing': []})
+
+        client.login(username='ops', password='testpass123')
+        response = client.post(reverse('quotes-refresh'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertIn('CSRF', response.json()['detail'])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class PriceSchedulerTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        reset_quote_service()
+        self.addCleanup(reset_quote_service)
+        user = User.objects.create_user(username='investor', password='testpass123')
+        for name in ('Growth', 'Income'):
+            portfolio = Portfolio.objects.create(user=user, name=name)
+            Stock.objects.create(portfolio=portfolio, ticker_symbol='AAPL', quantity=1,
+                                 initial_purchase_price=Decimal('1.00'), purchase_date=timezone.now())
+        Instrument.objects.create(asset_class=Instrument.ETF, symbol='IDLE')
+        self.fetched = []
+        self.clock = FakeClock()
+
+    def fetch(self, instruments):
+        self.fetched.append(sorted(instruments))
+        return [(asset_class, symbol, Decimal('10.00'), timezone.now()) for asset_class, symbol in instruments]
+
+    def scheduler(self, fetch=None, **kwargs):
+        scheduler = PriceScheduler(fetch or self.fetch, hot_interval=10, idle_interval=100, history=False,
+                                   clock=self.clock, **kwargs)
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    def test_sweep_coalesces_symbols(self):
+        """
+        Ensure a sweep fetches each instrument once however many portfolios hold it, and bulk writes the prices.
+        """
+        scheduler = self.scheduler()
+        scheduler.sweep()
+        self.assertEqual(self.fetched, [[(Instrument.ETF, 'IDLE'), (Instrument.STOCK, 'AAPL')]])
+        self.assertEqual(set(Instrument.objects.values_list('last_price', flat=True)), {Decimal('10.00')})
+        self.assertEqual(scheduler.stats.refreshed, 2)
+
+    def test_held_instruments_refresh_more_often(self):
+        """
+        Ensure held instruments are due every hot interval and idle ones every idle interval.
+        """
+        scheduler = self.scheduler(batch_size=1)
+        for now in (0, 10, 20, 30):
+            self.clock.now = now
+            scheduler.tick(timeout=None)
+            while scheduler.in_flight:
+                scheduler.collect(timeout=None)
+        symbols = [batch[0][1] for batch in self.fetched]
+        # Held instruments go first among those due at the same time
+        self.assertEqual(symbols, ['AAPL', 'IDLE', 'AAPL', 'AAPL', 'AAPL'])
+
+    def test_backpressure_and_lag(self):
+        """
+        Ensure dispatch stops at the in-flight limit, leaving the rest as backlog whose lag is reported.
+        """
+        release = threading.Event()
+
+        def blocked_fetch(instruments):
+            release.wait(5)
+            return self.fetch(instruments)
+
+        scheduler = self.scheduler(blocked_fetch, batch_size=1, max_in_flight=1)
+        scheduler.tick()
+        self.assertEqual((scheduler.stats.in_flight, scheduler.stats.backlog), (1, 1))
+
+        self.clock.now = 4
+        release.set()
+        scheduler.collect(timeout=None)
+        scheduler.tick(timeout=None)
+        snapshot = scheduler.stats.snapshot()
+        self.assertEqual((snapshot['refreshed'], snapshot['backlog'], snapshot['lag_max_s']), (2, 0, 4.0))
+
+    @override_settings(QUOTE_PROVIDERS=[{'BACKEND': 'Backend.quotes.FakeQuoteProvider'}])
+    def test_price_worker_command(self):
+        """
+        Ensure price_worker --once refreshes every instrument from the configured offline provider.
+        """
+        output = io.StringIO()
+        call_command('price_worker', '--once', '--no-history', stdout=output)
+        provider = FakeQuoteProvider()
+        for instrument in Instrument.objects.all():
+            self.assertEqual(instrument.last_price, provider.price(instrument.asset_class, instrument.symbol))
+        self.assertEqual(json.loads(output.getvalue())['refreshed'], 2)
+
+    @override_settings(QUOTE_PROVIDERS=[])
+    def test_price_worker_requires_provider(self):
+        """
+        Ensure price_worker refuses to run without a configured quote provider.
+        """
+        with self.assertRaisesMessage(CommandError, 'QUOTE_PROVIDERS'):
+            call_command('price_worker', '--once', '--no-history', stdout=io.StringIO())
+        self.assertEqual(set(Instrument.objects.values_list('last_price', flat=True)), {None})
+
+
+class PortfolioTrackerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tracker = PortfolioTracker({1: {10: 2, 11: 1}, 2: {10: 5}}, {10: Decimal('100'), 11: Decimal('50')},
+                                        {10: ('STOCK', 'AAPL', 'USD'), 11: ('ETF', 'VOO', 'USD')}, 'USD',
+                                        {'USD': Decimal('1')})
+
+    def test_applies_price_deltas(self):
+        """
+        Ensure a price change moves the value of every portfolio holding the instrument by its delta.
+        """
+        self.assertEqual(self.tracker.values, {1: Decimal('250'), 2: Decimal('500')})
+        self.tracker.apply({10: Decimal('110'), 99: Decimal('1')})
+        self.assertEqual(self.tracker.values, {1: Decimal('270'), 2: Decimal('550')})
+        self.tracker.apply({11: None})
+        self.assertEqual(self.tracker.values[1], Decimal('220'))
+
+    def test_coalesces_until_flush(self):
+        """
+        Ensure changes between flushes are merged into one update carrying the latest values.
+        """
+        self.tracker.apply({10: Decimal('110')})
+        self.tracker.apply({10: Decimal('120')})
+        update = self.tracker.flush()
+        self.assertEqual(update['portfolios'], [{'id': 1, 'value': '290.00', 'currency': 'USD'},
+                                                {'id': 2, 'value': '600.00', 'currency': 'USD'}])
+        self.assertEqual(update['prices'], [{'instrument': 10, 'asset_class': 'STOCK', 'symbol': 'AAPL', 'price': '120',
+                                             'currency': 'USD'}])
+        self.assertIsNone(self.tracker.flush())
+        self.tracker.apply({11: Decimal('50')})
+        self.assertIsNone(self.tracker.flush())
+
+    def test_replaces_changed_positions(self):
+        """
+        Ensure reloaded holdings revalue their portfolio at tracked prices and start tracking new instruments.
+        """
+        self.tracker.apply({10: Decimal('110')})
+        self.tracker.flush()
+        self.tracker.replace_positions({1: {10: 3, 12: 4}}, {10: Decimal('100'), 12: Decimal('5')},
+                                       {12: ('CRYPTO', 'DOGE', 'USD')}, {'USD': Decimal('1')})
+        self.assertEqual(self.tracker.values, {1: Decimal('350'), 2: Decimal('550')})
+        self.assertNotIn(11, self.tracker.prices)
+        update = self.tracker.flush()
+        self.assertEqual(update['portfolios'], [{'id': 1, 'value': '350.00', 'currency': 'USD'}])
+        self.assertEqual([price['symbol'] for price in update['prices']], ['DOGE'])
+        self.tracker.apply({10: Decimal('120')})
+        self.assertEqual(self.tracker.values, {1: Decimal('380'), 2: Decimal('600')})
+
+    def test_values_in_tracker_currency(self):
+        """
+        Ensure holdings quoted in other currencies move values at their rate and those without a rate are left out.
+        """
+        tracker = PortfolioTracker({1: {10: 2, 11: 1, 12: 3}}, {10: Decimal('100'), 11: Decimal('50'), 12: Decimal('7')},
+                                   {10: ('STOCK', 'AAPL', 'USD'), 11: ('ETF', 'VGK', 'EUR'), 12: ('STOCK', 'NESN', 'CHF')},
+                                   'USD', {'USD': Decimal('1'), 'EUR': Decimal('1.10'), 'CHF': None})
+        self.assertEqual(tracker.values, {1: Decimal('255')})
+        tracker.apply({11: Decimal('60'), 12: Decimal('8')})
+        update = tracker.flush()
+        self.assertEqual(update['portfolios'], [{'id': 1, 'value': '266.00', 'currency': 'USD'}])
+        self.assertEqual([price['currency'] for price in update['prices']], ['EUR', 'CHF'])
+
+
+@override_settings(STREAMING={'COALESCE_WINDOW': 0.1, 'HEARTBEAT': 60})
+class PortfolioStreamTests(APITestCase):
+    # Committed quotes are also archived to the document store
+    databases = {'default', 'mongo'}
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.instrument = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL',
+                                                    last_price=Decimal('100.00'))
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=3,
+                             initial_purchase_price=Decimal('1.00'), purchase_date=timezone.now())
+
+    async def publish(self, *prices):
+        for price in prices:
+            await get_channel_layer().group_send(PRICE_GROUP, {'type': 'prices.changed',
+                                                               'prices': {str(self.instrument.pk): price}})
+
+    def test_websocket_stream(self):
+        """
+        Ensure WebSocket subscribers get a snapshot and then one coalesced update per window.
+        """
+        async def stream(user, query=''):
+            communicator = WebsocketCommunicator(PortfolioValueConsumer.as_asgi(), f'/ws/portfolios/{query}')
+            communicator.scope['user'] = user
+            connected, code = await communicator.connect()
+            if not connected:
+                return code, None, None
+            snapshot = await communicator.receive_json_from()
+            await self.publish('110.00', '120.00')
+            update = await communicator.receive_json_from(timeout=2)
+            await communicator.receive_nothing(timeout=0.3)
+            await communicator.disconnect()
+            return code, snapshot, update
+
+        _, snapshot, update = async_to_sync(stream)(self.user, f'?portfolios={self.portfolio.pk}')
+        self.assertEqual(snapshot['portfolios'], [{'id': self.portfolio.pk, 'value': '300.00', 'currency': 'USD'}])
+        self.assertEqual(update['type'], 'update')
+        self.assertEqual(update['portfolios'], [{'id': self.portfolio.pk, 'value': '360.00', 'currency': 'USD'}])
+        self.assertEqual([price['price'] for price in update['prices']], ['120.00'])
+
+        self.assertEqual(async_to_sync(stream)(AnonymousUser())[0], 4401)
+        self.assertEqual(async_to_sync(stream)(self.user, '?portfolios=999')[0], 4404)
+
+    def test_trades_reach_open_streams(self):
+        """
+        Ensure trades executed after a stream opened update the values it pushes.
+        """
+        async def stream():
+            communicator = WebsocketCommunicator(PortfolioValueConsumer.as_asgi(), '/ws/portfolios/')
+            communicator.scope['user'] = self.user
+            await communicator.connect()
+            snapshot = await communicator.receive_json_from()
+            await database_sync_to_async(self.trade)()
+            update = await communicator.receive_json_from(timeout=2)
+            await self.publish('110.00')
+            moved = await communicator.receive_json_from(timeout=2)
+            await communicator.disconnect()
+            return snapshot, update, moved
+
+        snapshot, update, moved = async_to_sync(stream)()
+        self.assertEqual(snapshot['portfolios'], [{'id': self.portfolio.pk, 'value': '300.00', 'currency': 'USD'}])
+        self.assertEqual(update['portfolios'], [{'id': self.portfolio.pk, 'value': '500.00', 'currency': 'USD'}])
+        self.assertEqual(moved['portfolios'], [{'id': self.portfolio.pk, 'value': '550.00', 'currency': 'USD'}])
+
+    def trade(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_orders(self.user, [{'portfolio': self.portfolio.pk, 'instrument': self.instrument.pk,
+                                        'trade_type': 'BUY', 'trade_quantity': 2}])
+
+    def test_server_sent_events(self):
+        """
+        Ensure the event stream sends a snapshot and updates as server-sent events.
+        """
+        async def stream():
+            communicator = ApplicationCommunicator(PortfolioValueEventStream.as_asgi(), {
+                'type': 'http', 'method': 'GET', 'path': '/stream/portfolios/', 'query_string': b'',
+                'headers': [], 'user': self.user})
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            start = await communicator.receive_output(timeout=2)
+            snapshot = await communicator.receive_output(timeout=2)
+            await self.publish('101.00')
+            update = await communicator.receive_output(timeout=2)
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(timeout=2)
+            return start, snapshot['body'].decode(), update['body'].decode()
+
+        start, snapshot, update = async_to_sync(stream)()
+        self.assertIn((b'Content-Type', b'text/event-stream'), start['headers'])
+        self.assertTrue(snapshot.startswith('event: snapshot\ndata: '))
+        self.assertTrue(update.startswith('event: update\ndata: '))
+        self.assertEqual(json.loads(update.split('data: ', 1)[1])['portfolios'][0]['value'], '303.00')
+
+    def test_bulk_price_writes_publish_one_event(self):
+        """
+        Ensure a bulk quote upsert publishes all its prices as a single event once committed.
+        """
+        with patch('Backend.signals.publish_prices') as publish, self.captureOnCommitCallbacks(execute=True):
+            Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('5.00'), timezone.now()),
+                                              (Instrument.CRYPTO, 'BTC', Decimal('7.00'), timezone.now())])
+        publish.assert_called_once()
+        prices = publish.call_args[0][0]
+        self.assertEqual(prices[self.instrument.pk], Decimal('5.00'))
+        self.assertEqual(len(prices), 2)
+
+
+@override_settings(RESPONSE_CACHE=LOCAL_RESPONSE_CACHE)
+class ResponseCacheTests(APITestCase):
+    databases = {'default', 'mongo'}
+
+    def setUp(self):
+        reset_price_cache()
+        reset_response_cache()
+        FAQ.objects.create(question='What is this?', answer='A portfolio tracker.')
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.portfolios = [Portfolio.objects.create(user=self.user, name=name) for name in ('Tech', 'Coins')]
+        Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('100.00'), timezone.now()),
+                                          (Instrument.CRYPTO, 'BTC', Decimal('30000.00'), timezone.now())])
+        Stock.objects.create(portfolio=self.portfolios[0], ticker_symbol='AAPL', quantity=2,
+                             initial_purchase_price=Decimal('90.00'), purchase_date=timezone.now())
+        Cryptocurrency.objects.create(portfolio=self.portfolios[1], crypto_name='BTC', quantity=1,
+                                      initial_purchase_price=Decimal('20000.00'), purchase_date=timezone.now())
+
+    def test_conditional_get(self):
+        """
+        Ensure cached views send validators, answer matching If-None-Match and If-Modified-Since with 304
+        and serve repeated requests without queries.
+        """
+        url = reverse('faq-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual((cached.content, cached['ETag']), (response.content, etag))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQ.objects.create(question='Is it free?', answer='Yes.')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_private_responses_are_per_user(self):
+        """
+        Ensure private views cache a separate response per user.
+        """
+        url = reverse('portfolio-list')
+        self.client.force_authenticate(user=self.user)
+        etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(user=User.objects.create_user(username='other', password='testpass123'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_writes_invalidate_only_affected_portfolios(self):
+        """
+        Ensure price updates and holding changes invalidate the portfolios they touch and no others.
+        """
+        self.client.force_authenticate(user=self.user)
+        tech, coins = (reverse('portfolio-holdings', args=[portfolio.pk]) for portfolio in self.portfolios)
+        etags = [self.client.get(url)['ETag'] for url in (tech, coins)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('120.00'), timezone.now())])
+        self.assertEqual(self.client.get(coins, HTTP_IF_NONE_MATCH=etags[1]).status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(tech, HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['current_price'], '120.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_orders(self.user, [{'portfolio': self.portfolios[1].pk, 'trade_type': 'BUY', 'trade_quantity': 1,
+                                        'instrument': Instrument.objects.get(symbol='BTC').pk}])
+        response = self.client.get(coins, HTTP_IF_NONE_MATCH=etags[1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum(holding['quantity'] for holding in response.data['results']), 2)
+
+    @override_settings(RESPONSE_CACHE={'CACHE_ALIAS': None})
+    def test_conditional_get_without_cache(self):
+        """
+        Ensure views send a content ETag and answer a matching If-None-Match with 304 when no cache is configured.
+        """
+        url = reverse('faq-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url)['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual((response.content, response['ETag']), (b'', etag))
+
+        FAQ.objects.create(question='Is it free?', answer='Yes.')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_process_local_cache_check(self):
+        """
+        Ensure startup checks flag response caches that other processes cannot invalidate.
+        """
+        self.assertEqual([message.id for message in check_response_cache()], ['Backend.W001'])
+        with override_settings(RESPONSE_CACHE={'CACHE_ALIAS': 'shared'}):
+            self.assertEqual([message.id for message in check_response_cache()], ['Backend.E001'])
+        with override_settings(RESPONSE_CACHE={'CACHE_ALIAS': None}):
+            self.assertEqual(check_response_cache(), [])
+
+
+class QueryAuditTests(APITestCase):
+
+    def test_filtered_scan_is_reported(self):
+        """
+        Ensure a filter on an unindexed column is reported as a full scan and an indexed one is not.
+        """
+        unindexed = FAQ.objects.filter(question='Question 1?')
+        steps = explain(unindexed)
+        self.assertEqual([step.kind for step in full_scans(unindexed, steps)], [SCAN])
+        indexed = Stock.objects.filter(ticker_symbol='AAPL')
+        self.assertEqual(full_scans(indexed, explain(indexed)), [])
+        self.assertEqual(full_scans(FAQ.objects.all(), explain(FAQ.objects.all())), [])
+
+    def test_every_viewset_query_uses_indexes(self):
+        """
+        Ensure every viewset's list, detail and filter queries avoid full table scans and the command passes.
+        """
+        user = generate_dataset(users=2, portfolios=1, holdings=6, trades=5, instruments=6, history_days=0)
+        results = audit_queries(router, user)
+        self.assertIn('stock-list?ticker_symbol=', results)
+        self.assertIn('virtualtrade-list', results)
+        self.assertEqual({name: scans for name, (_, scans) in results.items() if scans}, {})
+
+    def test_command_rolls_back_dataset(self):
+        """
+        Ensure the audit_queries command passes and leaves no generated rows behind.
+        """
+        out = io.StringIO()
+        call_command('audit_queries', stdout=out, stderr=io.StringIO())
+        self.assertIn('queries use indexes', out.getvalue())
+        self.assertFalse(Instrument.objects.exists())
+
+
+class StorageRoutingTests(APITestCase):
+    databases = {'default', 'mongo'}
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.instrument = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL',
+                                                    last_price=Decimal('100.00'))
+
+    def test_history_is_written_to_document_store_on_commit(self):
+        """
+        Ensure executed trades and upserted quotes are archived to the document store only once committed.
+        """
+        order = {'portfolio': self.portfolio.pk, 'instrument': self.instrument.pk, 'trade_type': 'BUY',
+                 'trade_quantity': 5}
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            execute_orders(self.user, [order, order])
+        self.assertFalse(TradeEvent.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_orders(self.user, [order, order])
+            Instrument.objects.upsert_quotes([(Instrument.STOCK, 'AAPL', Decimal('101.00'), timezone.now()),
+                                              (Instrument.STOCK, 'AAPL', Decimal('102.00'), timezone.now())])
+        self.assertTrue(callbacks)
+        self.assertEqual(TradeEvent.objects.db, 'mongo')
+        self.assertEqual(list(TradeEvent.objects.values_list('user_id', 'symbol', 'trade_quantity')),
+                         [(self.user.pk, 'AAPL', 5)] * 2)
+        self.assertEqual(sorted(PriceTick.objects.values_list('price', flat=True)), [Decimal('101.00'), Decimal('102.00')])
+
+    def test_routing(self):
+        """
+        Ensure only document models use the document store and replicas serve reads only when allowed.
+        """
+        router = StorageRouter()
+        self.assertEqual(router.db_for_write(PriceTick), 'mongo')
+        self.assertIsNone(router.db_for_write(Portfolio))
+        self.assertTrue(router.allow_migrate('mongo', 'Backend', 'tradeevent'))
+        self.assertFalse(router.allow_migrate('mongo', 'Backend', 'portfolio'))
+        self.assertFalse(router.allow_migrate('default', 'Backend', 'pricetick'))
+        self.assertTrue(router.allow_migrate('default', 'auth', 'user'))
+
+        with override_settings(STORAGE_ROUTING={'DOCUMENT_ALIAS': 'mongo', 'READ_REPLICAS': ['replica']}):
+            self.assertFalse(router.allow_migrate('replica', 'Backend', 'portfolio'))
+            self.assertIsNone(router.db_for_read(Portfolio))
+            with replica_reads():
+                # Test cases run inside a transaction on 'default', which must read its own writes
+                self.assertIsNone(router.db_for_read(Portfolio))
+                with patch.object(connection, 'in_atomic_block', False):
+                    self.assertEqual(router.db_for_read(Portfolio), 'replica')
+                    self.assertEqual(router.db_for_read(TradeEvent), 'mongo')
+
+
+class ValuationSnapshotTests(APITestCase):
+    databases = {'default', 'mongo'}
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.instrument = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL',
+                                                    last_price=Decimal('10.00'))
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=2,
+                             initial_purchase_price=Decimal('1.00'), purchase_date=timezone.now())
+        self.start = datetime(2024, 1, 31, 23, 58, tzinfo=dt_timezone.utc)
+
+    def record(self, minutes, price):
+        Instrument.objects.filter(pk=self.instrument.pk).update(last_price=Decimal(price))
+        reset_price_cache()
+        record_snapshots(at=self.start + timedelta(minutes=minutes))
+
+    def points(self, resolution):
+        return list(ValuationSnapshot.objects.filter(resolution=resolution).order_by('time')
+                    .values_list('time', 'value', 'low', 'high'))
+
+    def test_rollups_and_compaction(self):
+        """
+        Ensure closed buckets roll up with their last, lowest and highest values, only once, and raw points are compacted.
+        """
+        for minutes, price in ((0, '10.00'), (0.5, '12.00'), (1, '9.00'), (3, '11.00')):
+            self.record(minutes, price)
+        now = self.start + timedelta(days=40)
+        with override_settings(SNAPSHOTS={'RETENTION': {'raw': 3600, 'minute': None, 'hour': None}}):
+            written, deleted = compact_snapshots(now)
+            self.assertEqual(compact_snapshots(now)[0], {'minute': 0, 'hour': 0, 'day': 0, 'month': 0})
+
+        self.assertEqual(self.points('minute'), [
+            (self.start, Decimal('24.00'), Decimal('20.00'), Decimal('24.00')),
+            (self.start + timedelta(minutes=1), Decimal('18.00'), Decimal('18.00'), Decimal('18.00')),
+            (self.start + timedelta(minutes=3), Decimal('22.00'), Decimal('22.00'), Decimal('22.00'))])
+        self.assertEqual([point[:2] for point in self.points('day')],
+                         [(datetime(2024, 1, 31, tzinfo=dt_timezone.utc), Decimal('18.00')),
+                          (datetime(2024, 2, 1, tzinfo=dt_timezone.utc), Decimal('22.00'))])
+        self.assertEqual(self.points('month')[1], (datetime(2024, 2, 1, tzinfo=dt_timezone.utc), Decimal('22.00'),
+                                                   Decimal('22.00'), Decimal('22.00')))
+        self.assertEqual(written['minute'], 3)
+        self.assertEqual(deleted['raw'], 4)
+        self.assertEqual(self.points('raw'), [])
+
+    def test_late_points_are_rolled_up(self):
+        """
+        Ensure points reaching an already rolled up bucket, late or for another portfolio, update its rollups.
+        """
+        self.record(0, '10.00')
+        now = self.start + timedelta(minutes=1, seconds=30)
+        self.assertEqual(compact_snapshots(now)[0]['minute'], 1)
+
+        # A snapshot of the same bucket that committed after the compaction, and another portfolio's first one
+        other = Portfolio.objects.create(user=self.user, name='Other')
+        Stock.objects.create(portfolio=other, ticker_symbol='AAPL', quantity=1,
+                             initial_purchase_price=Decimal('1.00'), purchase_date=timezone.now())
+        self.record(0.5, '15.00')
+        self.assertEqual(compact_snapshots(now)[0]['minute'], 2)
+        self.assertEqual(compact_snapshots(now)[0]['minute'], 0)
+        self.assertEqual(sorted(ValuationSnapshot.objects.filter(resolution='minute')
+                                .values_list('portfolio_id', 'value', 'low', 'high')),
+                         [(self.portfolio.pk, Decimal('30.00'), Decimal('20.00'), Decimal('30.00')),
+                          (other.pk, Decimal('15.00'), Decimal('15.00'), Decimal('15.00'))])
+
+    def test_snapshots_in_owner_currency(self):
+        """
+        Ensure snapshots are valued in the owner's base currency and skip portfolios that cannot be converted.
+        """
+        UserProfile.objects.create(user=self.user, email='investor@example.com', age=30, base_currency='EUR')
+        self.assertEqual(record_snapshots(at=self.start), 0)
+        FXRate.objects.upsert_rates([('EUR', Decimal('1.25'), timezone.now())])
+        self.assertEqual(record_snapshots(at=self.start + timedelta(minutes=1)), 1)
+        self.assertEqual(list(ValuationSnapshot.objects.values_list('value', 'currency')), [(Decimal('16.00'), 'EUR')])
+
+    def test_open_bucket_is_not_rolled_up(self):
+        """
+        Ensure points of a bucket that has not closed yet stay raw until it does.
+        """
+        self.record(0, '10.00')
+        compact_snapshots(self.start + timedelta(seconds=30))
+        self.assertEqual(self.points('minute'), [])
+        self.assertEqual(len(self.points('raw')), 1)
+
+    def test_history_endpoint(self):
+        """
+        Ensure history ranges are served from the coarsest sufficient rollup with one snapshot query.
+        """
+        self.assertEqual(history_resolution(HISTORY_RANGES['1D']), 'minute')
+        self.assertEqual(history_resolution(HISTORY_RANGES['1W']), 'hour')
+        self.assertEqual(history_resolution(HISTORY_RANGES['1Y']), 'day')
+        self.assertEqual(history_resolution(HISTORY_RANGES['5Y']), 'month')
+
+        now = timezone.now()
+        ValuationSnapshot.objects.bulk_create([
+            ValuationSnapshot(portfolio_id=self.portfolio.pk, resolution='day', time=now - timedelta(days=days),
+                              value=Decimal(days), low=Decimal(days), high=Decimal(days))
+            for days in (400, 30, 2)])
+        self.client.force_authenticate(user=self.user)
+        url = reverse('portfolio-history', args=[self.portfolio.pk])
+        with CaptureQueriesContext(connections['mongo']) as queries:
+            response = self.client.get(url, {'range': '1y'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.data['resolution'], 'day')
+        self.assertEqual([(point['value'], point['currency']) for point in response.data['points']],
+                         [('30.00', 'USD'), ('2.00', 'USD')])
+        self.assertEqual(self.client.get(url, {'range': '2Y'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RebalancingTests(APITestCase):
+    databases = {'default', 'mongo'}
+
+    def setUp(self):
+        reset_price_cache()
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.aapl = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='AAPL', last_price=Decimal('10.00'))
+        self.msft = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='MSFT', last_price=Decimal('20.00'))
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=10,
+                             initial_purchase_price=Decimal('5.00'), purchase_date=timezone.now())
+
+    def test_plan_trades(self):
+        """
+        Ensure trades meet instrument and asset class targets in whole units and flag unreachable targets.
+        """
+        nan = np.nan
+        # Instruments A and B of class 0, C and D of class 1, and E of class 2 without a price
+        prices = np.array([10.0, 20.0, 10.0, 10.0, nan])
+        classes = np.array([0, 0, 1, 1, 2])
+        quantities = np.array([[10, 0, 0, 0, 0], [10, 0, 5, 5, 0], [10, 0, 0, 0, 3], [10, 0, 0, 0, 0]])
+        weights = np.array([[0.5, 0.5, nan, nan, nan], [0.7, nan, nan, nan, nan],
+                            [1.0, nan, nan, nan, nan], [0.5, nan, nan, nan, nan]])
+        class_weights = np.array([[0, 0, 0], [0, 0.3, 0], [0, 0, 0], [0, 0, 0.5]])
+
+        trades, unreachable = plan_trades(quantities, prices, weights, class_weights, classes)
+        self.assertEqual(trades.tolist(), [[-5, 2, 0, 0, 0], [4, 0, -2, -2, 0], [0, 0, 0, 0, 0], [-5, 0, 0, 0, 0]])
+        self.assertEqual(unreachable.tolist(), [False, False, False, True])
+
+        trades, _ = plan_trades(quantities[:1], prices, weights[:1], class_weights[:1], classes, min_value=50.0)
+        self.assertEqual(trades.tolist(), [[-5, 0, 0, 0, 0]])
+
+    def test_rebalance_across_currencies(self):
+        """
+        Ensure lines quoted in different currencies are weighed at their exchange rate.
+        """
+        reset_conversion_matrix()
+        self.addCleanup(reset_conversion_matrix)
+        sony = Instrument.objects.create(asset_class=Instrument.STOCK, symbol='SONY', currency='JPY',
+                                         last_price=Decimal('1000.00'))
+        TargetAllocation.objects.bulk_create([
+            TargetAllocation(portfolio=self.portfolio, instrument=self.aapl, weight=Decimal('0.5')),
+            TargetAllocation(portfolio=self.portfolio, instrument=sony, weight=Decimal('0.5'))])
+        # SONY is unpriced in USD until there is a JPY rate
+        self.assertEqual(rebalance([self.portfolio.pk])[1], [self.portfolio.pk])
+
+        FXRate.objects.upsert_rates([('JPY', Decimal('0.01'), timezone.now())])
+        orders, unreachable = rebalance([self.portfolio.pk])
+        self.assertEqual(unreachable, [])
+        self.assertEqual([(order['instrument'], order['trade_type'], order['trade_quantity']) for order in orders],
+                         [(self.aapl.pk, 'SELL', 5), (sony.pk, 'BUY', 5)])
+
+    def test_targets_and_rebalance_endpoints(self):
+        """
+        Ensure owners set targets summing to 1 and rebalancing proposes, then executes, sells before buys.
+        """
+        self.client.force_authenticate(user=self.user)
+        url = reverse('portfolio-targets', args=[self.portfolio.pk])
+        targets = [{'instrument': self.aapl.pk, 'weight': '0.5'}, {'instrument': self.msft.pk, 'weight': '0.5'}]
+        response = self.client.put(url, [dict(targets[0], weight='0.4'), targets[1]], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(url, targets + [{'weight': '0'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(url, targets, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.portfolio.targets.count(), 2)
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.put(url, [], format='json').status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(reverse('portfolio-rebalance'), {'portfolios': [self.portfolio.pk]}, format='json')
+        self.assertEqual(response.data['orders'], [])
+
+        self.client.force_authenticate(user=self.user)
+        expected = [{'portfolio': self.portfolio.pk, 'instrument': self.aapl.pk, 'trade_type': 'SELL', 'trade_quantity': 5},
+                    {'portfolio': self.portfolio.pk, 'instrument': self.msft.pk, 'trade_type': 'BUY', 'trade_quantity': 2}]
+        response = self.client.post(reverse('portfolio-rebalance'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'orders': expected, 'unreachable': []})
+        self.assertFalse(VirtualTrade.objects.exists())
+
+        response = self.client.post(reverse('portfolio-rebalance'), {'execute': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['trades']), 2)
+        self.assertEqual(Stock.objects.get(ticker_symbol='AAPL').quantity, 5)
+        self.assertEqual(Stock.objects.get(ticker_symbol='MSFT').quantity, 2)
+        self.assertEqual(self.client.post(reverse('portfolio-rebalance'), {}, format='json').data['orders'], [])
+
+    def test_process_pool_matches_single_process(self):
+        """
+        Ensure chunks computed on a process pool give the same orders as one in-process pass.
+        """
+        for index in range(5):
+            portfolio = Portfolio.objects.create(user=self.user, name=f'Portfolio {index}')
+            Stock.objects.create(portfolio=portfolio, ticker_symbol='MSFT', quantity=index + 3,
+                                 initial_purchase_price=Decimal('5.00'), purchase_date=timezone.now())
+            TargetAllocation.objects.create(portfolio=portfolio, instrument=self.aapl, weight=Decimal('0.6'))
+            TargetAllocation.objects.create(portfolio=portfolio, asset_class=Instrument.STOCK, weight=Decimal('0.4'))
+
+        orders, unreachable = rebalance(processes=1, chunk_size=1000)
+        self.assertEqual(len(orders), 10)
+        self.assertEqual(rebalance(processes=2, chunk_size=2), (orders, unreachable))
+        self.assertEqual(rebalance(processes=1, chunk_size=2), (orders, unreachable))
+
+
+@override_settings(RESPONSE_CACHE=LOCAL_RESPONSE_CACHE)
+class ValueAtRiskTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        reset_response_cache()
+        reset_risk_results()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PRICE_HISTORY_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=user)
+        self.portfolio = Portfolio.objects.create(user=user, name='Growth')
+        for ticker, quantity in (('AAPL', 10), ('MSFT', 5)):
+            Stock.objects.create(portfolio=self.portfolio, ticker_symbol=ticker, quantity=quantity,
+                                 initial_purchase_price='100.00', purchase_date=timezone.now())
+        rng = np.random.default_rng(7)
+        days = np.arange(250) * 86400
+        store = PriceHistoryStore(directory.name)
+        store.append('STOCK', 'AAPL', days, 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 250))))
+        store.append('STOCK', 'MSFT', days, 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 250))))
+        Instrument.objects.update(last_price=Decimal('100.00'))
+
+    def test_simulation_kernels(self):
+        """
+        Ensure historical and Monte Carlo P&L match known distributions and seeds reproduce across shards and processes.
+        """
+        returns = np.log(np.array([[1.1], [0.9], [1.0], [1.2]]))
+        self.assertTrue(np.allclose(historical_pnl(returns, np.array([100.0]), horizon=2), [-1, -10, 20]))
+        self.assertEqual(value_at_risk(np.array([-10.0, 5.0, -20.0, 0.0, 3.0]), 0.75), (10.0, 15.0))
+
+        # A single position with 1% daily volatility loses about 2.326 standard deviations at 99%
+        returns = np.random.default_rng(3).normal(0, 0.01, (500, 1))
+        returns = (returns - returns.mean()) / returns.std(ddof=1) * 0.01
+        pnl = monte_carlo_pnl(returns, np.array([1000.0]), horizon=4, paths=50000, shard_paths=7000)
+        var, cvar = value_at_risk(pnl, 0.99)
+        self.assertAlmostEqual(var, 1000 * -np.expm1(-2.326 * 0.02), delta=2.0)
+        self.assertGreater(cvar, var)
+
+        self.addCleanup(shutdown_simulation_pool)
+        with override_settings(RISK={'PROCESSES': 2}):
+            pooled = monte_carlo_pnl(returns, np.array([1000.0]), horizon=4, paths=50000, shard_paths=7000,
+                                     pool=get_simulation_pool())
+        self.assertTrue(np.array_equal(pooled, pnl))
+
+    def test_risk_endpoint(self):
+        """
+        Ensure the risk endpoint reports VaR and CVaR, validates its parameters and caches per holdings version.
+        """
+        url = reverse('portfolio-risk', args=[self.portfolio.pk])
+        query = {'start': '1970-01-01', 'paths': 5000, 'horizon': 5}
+        with patch('Backend.views.portfolio_risk', wraps=portfolio_risk) as simulate:
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url, query).content, response.content)
+            self.assertEqual(simulate.call_count, 1)
+        self.assertEqual((response.data['observations'], response.data['total_value']), (249, 1500.0))
+        for method in ('monte_carlo', 'historical'):
+            self.assertGreater(response.data[method]['var'], 0)
+            self.assertGreaterEqual(response.data[method]['cvar'], response.data[method]['var'])
+        self.assertEqual(response.data['without_history'], [])
+
+        self.assertEqual(self.client.get(url, {'horizon': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'confidence': '1.5'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'paths': 10 ** 7}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RESPONSE_CACHE={'CACHE_ALIAS': None})
+    def test_simulations_reused_without_response_cache(self):
+        """
+        Ensure repeated risk requests reuse the simulation until the holdings change, without a response cache.
+        """
+        url = reverse('portfolio-risk', args=[self.portfolio.pk])
+        query = {'start': '1970-01-01', 'paths': 5000}
+        with patch('Backend.risk.monte_carlo_pnl', wraps=monte_carlo_pnl) as simulate:
+            first = self.client.get(url, query).json()
+            self.assertEqual(self.client.get(url, query).json(), first)
+            self.assertEqual(simulate.call_count, 1)
+            Stock.objects.filter(ticker_symbol='MSFT').update(quantity=10)
+            changed = self.client.get(url, query).json()
+            self.assertEqual(simulate.call_count, 2)
+        self.assertEqual(changed['total_value'], 2000.0)
+
+
+@override_settings(RESPONSE_CACHE=LOCAL_RESPONSE_CACHE)
+class CurrencyConversionTests(APITestCase):
+
+    def setUp(self):
+        reset_price_cache()
+        reset_response_cache()
+        reset_conversion_matrix()
+        self.addCleanup(reset_conversion_matrix)
+        self.user = User.objects.create_user(username='investor', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Global')
+        now = timezone.now()
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='AAPL', quantity=10,
+                             initial_purchase_price='100.00', purchase_date=now)
+        Stock.objects.create(portfolio=self.portfolio, ticker_symbol='SAP', quantity=10,
+                             initial_purchase_price='90.00', purchase_date=now, currency='EUR')
+        Instrument.objects.filter(symbol='AAPL').update(last_price=Decimal('100.00'))
+        Instrument.objects.filter(symbol='SAP').update(last_price=Decimal('120.00'), currency='EUR')
+        FXRate.objects.upsert_rates([('EUR', Decimal('1.10'), now), ('GBP', Decimal('1.25'), now)])
+
+    def test_conversion_matrix(self):
+        """
+        Ensure the conversion matrix derives cross rates from pivot quotes and gives NaN for unknown currencies.
+        """
+        matrix = ConversionMatrix({'EUR': 1.1, 'GBP': 1.25})
+        self.assertAlmostEqual(matrix.rate('EUR', 'GBP'), 0.88)
+        self.assertAlmostEqual(matrix.rate('USD', 'EUR'), 1 / 1.1)
+        self.assertIsNone(matrix.rate('JPY', 'USD'))
+        converted = matrix.convert([10, 20, 30, 40], ['EUR', 'USD', 'JPY', 'EUR'], 'GBP')
+        self.assertTrue(np.allclose(converted, [8.8, 16, np.nan, 35.2], equal_nan=True))
+
+    def test_matrix_follows_fx_version(self):
+        """
+        Ensure the conversion matrix is reused until the FX version is bumped, as rate writes in any process do.
+        """
+        matrix = get_conversion_matrix()
+        self.assertIs(get_conversion_matrix(), matrix)
+        # Rows written by another process only reach this one through the version bump
+        FXRate.objects.filter(currency='EUR').update(rate=Decimal('1.20'))
+        self.assertIs(get_conversion_matrix(), matrix)
+        bump([FX_RATES])
+        self.assertAlmostEqual(get_conversion_matrix().rate('EUR', 'USD'), 1.2)
+
+        with override_settings(RESPONSE_CACHE={'CACHE_ALIAS': None}):
+            self.assertIsNot(get_conversion_matrix(), get_conversion_matrix())
+
+    def test_valuations_in_requested_currency(self):
+        """
+        Ensure valuations convert holdings quoted in other currencies to ?currency= or the profile base currency.
+        """
+        self.assertEqual(portfolio_valuations([self.portfolio.pk]), {self.portfolio.pk: Decimal('2320.00')})
+        self.assertEqual(portfolio_valuations([self.portfolio.pk], 'GBP'), {self.portfolio.pk: Decimal('1856.00')})
+
+        url = reverse('portfolio-valuations')
+        response = self.client.get(url, {'currency': 'eur'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data[0]['total_value'], response.data[0]['currency']), ('2109.09', 'EUR'))
+        self.assertEqual(self.client.get(url, {'currency': 'euro'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        UserProfile.objects.create(user=self.user, email='investor@example.com', age=30, base_currency='GBP')
+        response = self.client.get(url)
+        self.assertEqual((response.data[0]['total_value'], response.data[0]['currency']), ('1856.00', 'GBP'))
+
+        # Holdings without an FX rate are reported, not counted as 0
+        Instrument.objects.filter(symbol='SAP').update(currency='CHF')
+        reset_response_cache()
+        response = self.client.get(url)
+        self.assertEqual((response.data[0]['total_value'], response.data[0]['unconverted_currencies']),
+                         ('800.00', ['CHF']))
+        Instrument.objects.filter(symbol='SAP').update(currency='EUR')
+        reset_response_cache()
+
+        # Writing rates drops the cached matrix and responses valued with it
+        with self.captureOnCommitCallbacks(execute=True):
+            FXRate.objects.upsert_rates([('GBP', Decimal('1.16'), timezone.now())])
+        self.assertEqual(self.client.get(url).json()[0]['total_value'], '2000.00')
+
+    def test_holdings_converted_and_sorted_across_currencies(self):
+        """
+        Ensure holdings are sorted by value across quote currencies and their amounts converted.
+        """
+        response = self.client.get(reverse('portfolio-holdings', args=[self.portfolio.pk]),
+                                   {'ordering': '-current_value', 'currency': 'EUR'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['symbol'], row['initial_purchase_price'], row['current_price'], row['current_value'],
+                           row['currency']) for row in response.data['results']],
+                         [('SAP', '90.00', '120.00', '1200.00', 'EUR'), ('AAPL', '90.91', '90.91', '909.09', 'EUR')])
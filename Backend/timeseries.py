@@ -0,0 +1,170 @@
+'''
+Append-only price history stored as compact NumPy record files, one per instrument.
+Each file is a flat array of (epoch seconds, price) records kept in timestamp order, so a date range
+is located with a binary search over a memory map and only the pages inside that range are read.
+Appends hold an exclusive lock on the file, so writers in different processes keep it ordered.
+'''
+
+import os
+import threading
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows, where appends are only serialized within a process
+    fcntl = None
+
+TICK_DTYPE = np.dtype([('t', '<i8'), ('p', '<f8')])
+OHLC_DTYPE = np.dtype([('t', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')])
+
+INTERVALS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_interval(value):
+    """
+    Converts an interval such as '5m', '1h' or '1d' to seconds.
+    """
+    try:
+        count, unit = int(value[:-1]), value[-1]
+        seconds = count * INTERVALS[unit]
+    except (ValueError, KeyError, IndexError):
+        raise ValueError(f"Invalid interval {value!r}, expected e.g. '5m', '1h', '1d' or '1w'.")
+    if seconds <= 0:
+        raise ValueError(f"Invalid interval {value!r}, expected a positive duration.")
+    return seconds
+
+
+def to_epoch(value):
+    """
+    Converts an aware datetime (naive values are taken as UTC) to epoch seconds.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return int(value.timestamp())
+
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(int(seconds), tz=dt_timezone.utc)
+
+
+def downsample(ticks, interval):
+    """
+    Buckets ticks into OHLC bars of `interval` seconds, labelled with the bucket start.
+    """
+    if len(ticks) == 0:
+        return np.empty(0, dtype=OHLC_DTYPE)
+    buckets = ticks['t'] // interval
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.concatenate((starts[1:], [len(ticks)])) - 1
+    prices = np.asarray(ticks['p'])
+
+    bars = np.empty(len(starts), dtype=OHLC_DTYPE)
+    bars['t'] = buckets[starts] * interval
+    bars['open'] = prices[starts]
+    bars['high'] = np.maximum.reduceat(prices, starts)
+    bars['low'] = np.minimum.reduceat(prices, starts)
+    bars['close'] = prices[ends]
+    return bars
+
+
+class PriceHistoryStore:
+    """
+    Directory of per-instrument tick files under `root`, laid out as <asset_class>/<symbol>.ticks.
+    """
+    def __init__(self, root):
+        self.root = os.fspath(root)
+        self._lock = threading.Lock()
+
+    def path(self, asset_class, symbol):
+        return os.path.join(self.root, asset_class, quote(symbol, safe='') + '.ticks')
+
+    def open(self, asset_class, symbol):
+        """
+        Memory maps an instrument's full history without reading it. Missing series are empty.
+        """
+        path = self.path(asset_class, symbol)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=TICK_DTYPE)
+        return np.memmap(path, dtype=TICK_DTYPE, mode='r')
+
+    def last_timestamp(self, asset_class, symbol):
+        series = self.open(asset_class, symbol)
+        return int(series['t'][-1]) if len(series) else None
+
+    def append(self, asset_class, symbol, timestamps, prices):
+        """
+        Appends ticks for one instrument. Ticks are sorted first and anything not newer than
+        the last stored tick is dropped, which keeps files ordered and re-ingestion idempotent.
+        Returns the number of ticks written.
+        """
+        ticks = np.empty(len(timestamps), dtype=TICK_DTYPE)
+        ticks['t'] = timestamps
+        ticks['p'] = prices
+        ticks = ticks[np.argsort(ticks['t'], kind='stable')]
+        if not len(ticks):
+            return 0
+
+        path = self.path(asset_class, symbol)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock, open(path, 'ab') as handle:
+            # ingest_quotes, price_worker and web workers append from different processes, so the
+            # file stays locked from reading its last tick until the new ones are written
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            last = self.last_timestamp(asset_class, symbol)
+            if last is not None:
+                ticks = ticks[ticks['t'] > last]
+            if len(ticks) > 1:
+                # Keep the last price of duplicate timestamps within the batch
+                ticks = ticks[np.append(np.diff(ticks['t']) != 0, True)]
+            if len(ticks):
+                ticks.tofile(handle)
+                handle.flush()
+        return len(ticks)
+
+    def append_many(self, ticks):
+        """
+        Appends (asset_class, symbol, price, quoted_at) quote tuples grouped per instrument.
+        """
+        grouped = {}
+        for asset_class, symbol, price, when in ticks:
+            timestamps, prices = grouped.setdefault((asset_class, symbol), ([], []))
+            timestamps.append(to_epoch(when))
+            prices.append(float(price))
+        return sum(self.append(asset_class, symbol, timestamps, prices)
+                   for (asset_class, symbol), (timestamps, prices) in grouped.items())
+
+    def range(self, asset_class, symbol, start=None, end=None):
+        """
+        Returns the ticks with start <= t < end as an in-memory copy of just that slice.
+        """
+        series = self.open(asset_class, symbol)
+        times = series['t']
+        lo = 0 if start is None else int(np.searchsorted(times, to_epoch(start), side='left'))
+        hi = len(series) if end is None else int(np.searchsorted(times, to_epoch(end), side='left'))
+        return np.array(series[lo:hi])
+
+    def history(self, asset_class, symbol, start=None, end=None, interval=None):
+        """
+        Returns raw ticks for the range, or OHLC bars when an interval in seconds is given.
+        """
+        ticks = self.range(asset_class, symbol, start, end)
+        return ticks if interval is None else downsample(ticks, interval)
+
+
+_store = None
+
+
+def get_price_history_store():
+    """
+    Returns the store rooted at PRICE_HISTORY_ROOT.
+    """
+    global _store
+    root = os.fspath(settings.PRICE_HISTORY_ROOT)
+    if _store is None or _store.root != root:
+        _store = PriceHistoryStore(root)
+    return _store
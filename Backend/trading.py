@@ -0,0 +1,145 @@
+'''
+Simulated execution of virtual trades.
+Orders are filled at the cached latest price and applied to the portfolio's holdings inside one
+transaction. The portfolios involved are locked first, in primary key order, so concurrent
+submissions against the same portfolio are serialized and cannot deadlock each other.
+'''
+
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Instrument, Portfolio, VirtualTrade, HOLDING_MODEL_BY_ASSET_CLASS
+from .pricecache import get_price_cache
+from .ledger import record_trades
+from .archive import archive_trades
+from .responsecache import invalidate_portfolios
+from .snapshots import record_snapshots_on_commit
+from .streaming import publish_holdings_on_commit
+
+BUY = 'BUY'
+SELL = 'SELL'
+
+
+def execute_orders(user, orders):
+    """
+    Validates and fills a batch of orders for `user` atomically.
+    Each order is a dict with portfolio and instrument ids, trade_type and trade_quantity.
+    Returns the created VirtualTrade objects in order; if any order is rejected nothing is written
+    and a ValidationError mapping order index to messages is raised.
+    """
+    with transaction.atomic():
+        portfolio_ids = sorted({order['portfolio'] for order in orders})
+        portfolios = {portfolio.pk: portfolio for portfolio in
+                      Portfolio.objects.select_for_update().filter(pk__in=portfolio_ids).order_by('pk')}
+        instruments = Instrument.objects.in_bulk({order['instrument'] for order in orders})
+        prices = get_price_cache().get_many(instruments)
+        book = HoldingsBook(portfolio_ids, instruments.values())
+
+        trades, errors = [], {}
+        for index, order in enumerate(orders):
+            portfolio = portfolios.get(order['portfolio'])
+            instrument = instruments.get(order['instrument'])
+            price = prices.get(order['instrument'])
+            quantity = order['trade_quantity']
+            if portfolio is None or portfolio.user_id != user.pk:
+                errors[index] = ['Unknown portfolio.']
+            elif instrument is None:
+                errors[index] = ['Unknown instrument.']
+            elif price is None:
+                errors[index] = [f'No price available for {instrument}.']
+            elif order['trade_type'] == SELL and book.quantity(portfolio.pk, instrument) < quantity:
+                errors[index] = [f'Cannot sell {quantity} {instrument.symbol}, '
+                                 f'only {book.quantity(portfolio.pk, instrument)} held.']
+            else:
+                book.apply(portfolio.pk, instrument, order['trade_type'], quantity, price)
+                trades.append(VirtualTrade(user=user, portfolio=portfolio, instrument=instrument,
+                                           trade_type=order['trade_type'], trade_quantity=quantity,
+                                           trade_price=price))
+        if errors:
+            raise ValidationError(errors)
+
+        book.save()
+        trades = VirtualTrade.objects.bulk_create(trades)
+        record_trades(trades)
+        archive_trades(trades)
+        # Bulk writes skip the model signals that invalidate cached portfolio responses
+        invalidate_portfolios(portfolio_ids)
+        record_snapshots_on_commit(portfolio_ids)
+        publish_holdings_on_commit(portfolio_ids)
+        return trades
+
+
+class HoldingsBook:
+    """
+    In-memory view of the holdings touched by a batch, written back with bulk queries.
+    Buys grow the oldest lot bought in the quote currency (re-averaging its purchase price) or open a
+    new one; sells consume lots oldest first and delete the ones they empty.
+    """
+    def __init__(self, portfolio_ids, instruments):
+        self.lots = {}
+        self.created, self.updated, self.deleted = [], set(), set()
+        by_asset_class = {}
+        for instrument in instruments:
+            by_asset_class.setdefault(instrument.asset_class, []).append(instrument.pk)
+        for asset_class, instrument_ids in by_asset_class.items():
+            model = HOLDING_MODEL_BY_ASSET_CLASS[asset_class]
+            for lot in (model.objects.filter(portfolio__in=portfolio_ids, instrument__in=instrument_ids)
+                        .order_by('purchase_date', 'pk')):
+                self.lots.setdefault((lot.portfolio_id, lot.instrument_id), []).append(lot)
+
+    def quantity(self, portfolio_id, instrument):
+        return sum(lot.quantity for lot in self.lots.get((portfolio_id, instrument.pk), []))
+
+    def apply(self, portfolio_id, instrument, trade_type, quantity, price):
+        lots = self.lots.setdefault((portfolio_id, instrument.pk), [])
+        if trade_type == BUY:
+            # Fills are in the quote currency, so only lots bought in it are re-averaged
+            lot = next((lot for lot in lots if lot.currency in ('', instrument.currency)), None)
+            if lot is not None:
+                cost = lot.quantity * lot.initial_purchase_price + quantity * price
+                lot.quantity += quantity
+                lot.initial_purchase_price = (cost / lot.quantity).quantize(Decimal('0.01'))
+                self.mark_updated(lot)
+            else:
+                model = HOLDING_MODEL_BY_ASSET_CLASS[instrument.asset_class]
+                lot = model(portfolio_id=portfolio_id, instrument=instrument, quantity=quantity,
+                            initial_purchase_price=price, purchase_date=timezone.now(),
+                            **{model.symbol_field: instrument.symbol})
+                lots.append(lot)
+                self.created.append(lot)
+            return
+
+        remaining = quantity
+        while remaining:
+            lot = lots[0]
+            filled = min(lot.quantity, remaining)
+            lot.quantity -= filled
+            remaining -= filled
+            if lot.quantity == 0:
+                lots.pop(0)
+                if lot in self.created:
+                    self.created.remove(lot)
+                else:
+                    self.updated.discard(lot)
+                    self.deleted.add(lot)
+            else:
+                self.mark_updated(lot)
+
+    def mark_updated(self, lot):
+        if lot.pk is not None:
+            self.updated.add(lot)
+
+    def save(self):
+        for model in HOLDING_MODEL_BY_ASSET_CLASS.values():
+            created = [lot for lot in self.created if isinstance(lot, model)]
+            updated = [lot for lot in self.updated if isinstance(lot, model)]
+            deleted = [lot.pk for lot in self.deleted if isinstance(lot, model)]
+            if created:
+                model.objects.bulk_create(created)
+            if updated:
+                model.objects.bulk_update(updated, ['quantity', 'initial_purchase_price'])
+            if deleted:
+                model.objects.filter(pk__in=deleted).delete()
@@ -7,18 +7,23 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.schemas import get_schema_view
 
-from .views import (UserViewSet, UserProfileViewSet, PortfolioViewSet, StockViewSet, 
-                    ETFViewSet, CryptocurrencyViewSet, VirtualTradeViewSet, BlogPostViewSet, FAQViewSet)
+from .profiling import metrics
+from .views import (UserViewSet, UserProfileViewSet, PortfolioViewSet, InstrumentViewSet, StockViewSet, 
+                    ETFViewSet, CryptocurrencyViewSet, VirtualTradeViewSet, PositionViewSet, BlogPostViewSet, FAQViewSet,
+                    FXRateViewSet, live_quotes, refresh_quotes)
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()  
 router.register(r'users', UserViewSet)
 router.register(r'profiles', UserProfileViewSet)
 router.register(r'portfolios', PortfolioViewSet)
+router.register(r'instruments', InstrumentViewSet)
+router.register(r'fx-rates', FXRateViewSet)
 router.register(r'stocks', StockViewSet) 
 router.register(r'etfs', ETFViewSet)
 router.register(r'cryptocurrencies', CryptocurrencyViewSet)
 router.register(r'trades', VirtualTradeViewSet)
+router.register(r'positions', PositionViewSet)
 router.register(r'posts', BlogPostViewSet)
 router.register(r'faqs', FAQViewSet)
 
@@ -32,6 +37,13 @@ urlpatterns = [
     # URLs for the router
     path('', include(router.urls)),
 
+    # Live quotes from the configured providers
+    path('quotes/', live_quotes, name='quotes'),
+    path('quotes/refresh/', refresh_quotes, name='quotes-refresh'),
+
+    # Prometheus metrics
+    path('metrics/', metrics, name='metrics'),
+
     # Users URLs
     path('users/', UserViewSet.as_view(), name='user-list'),
     path('users/<int:pk>/', UserViewSet.as_view(), name='user-detail'),
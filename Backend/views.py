@@ -3,16 +3,53 @@ The views.py file contains the view logic that controls the request and response
 It acts as the bridge between the models and the serializers to the frontend.
 '''
 
+import io
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+import numpy as np
 from rest_framework import viewsets, generics, permissions, filters, pagination
 from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, PermissionDenied, ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseNotAllowed, JsonResponse
 
-from .models import UserProfile, Portfolio, Stock, ETF, Cryptocurrency, VirtualTrade, BlogPost, FAQ
+from .models import (UserProfile, Instrument, Portfolio, Stock, ETF, Cryptocurrency, VirtualTrade, Position, BlogPost, FAQ,
+                     TargetAllocation, FXRate, HOLDING_MODELS, HOLDING_MODEL_BY_ASSET_CLASS, portfolio_holdings,
+                     portfolio_positions, portfolio_valuations, validate_currency_code)
 from .serializers import (UserSerializer, UserProfileSerializer, PortfolioSerializer, StockSerializer, 
                           ETFSerializer, CryptocurrencySerializer, VirtualTradeSerializer, 
-                          BlogPostSerializer, FAQSerializer)
+                          BlogPostSerializer, FAQSerializer, PortfolioValuationSerializer, InstrumentSerializer,
+                          TradeOrderSerializer, PositionSerializer, PortfolioHoldingSerializer,
+                          ValuationPointSerializer, TargetAllocationSerializer, RebalanceSerializer,
+                          FXRateSerializer)
+from .timeseries import get_price_history_store, parse_interval, from_epoch
+from .pricecache import get_price_cache
+from .analytics import analytics_settings, load_daily_closes, portfolio_analytics, finite_or_none
+from .trading import execute_orders
+from .pagination import KeysetPaginationMixin
+from .fastpath import FastReadMixin
+from .exports import EXPORT_FORMATS, iterate_chunks, chain_chunks, streaming_export
+from .imports import import_holdings, read_records
+from .quotes import get_quote_service
+from .responsecache import ALL_HOLDINGS, FX_RATES, cache_response
+from .fx import convert_amounts, convert_records, fx_settings
+from .routers import ReplicaReadMixin
+from .snapshots import HISTORY_RANGES, history_resolution, portfolio_history
+from .risk import portfolio_risk, risk_settings
+from .rebalancing import WEIGHT_TOLERANCE, execute_rebalance, rebalance as rebalance_portfolios
 
 
 '''
@@ -35,12 +72,55 @@ VIEWSETS
 - Viewsets provide the standard CRUD operations for models.
 '''
 
+def parse_query_datetime(value, end_of_day=False):
+    """
+    Parses an ISO datetime or date query parameter. As an exclusive end bound,
+    a plain date is taken as the following midnight so the whole day is included.
+    """
+    if value is None:
+        return None
+    try:
+        day = parse_date(value)
+        if day is not None:
+            return datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"Invalid date {value!r}.")
+    return parsed
+
+def valuation_currency(request, owner):
+    """
+    Reads the ?currency= amounts are converted to, by default the owner's profile base currency,
+    or FX['BASE_CURRENCY'] without one.
+    """
+    currency = request.query_params.get('currency')
+    if currency:
+        currency = currency.upper()
+        try:
+            validate_currency_code(currency)
+        except DjangoValidationError as exc:
+            raise ValidationError({'currency': exc.messages})
+        return currency
+    profile = getattr(owner, 'profile', None)
+    return (profile and profile.base_currency) or fx_settings()['BASE_CURRENCY']
+
+def get_export_format(request):
+    """
+    Reads the ?output= export format, csv by default.
+    """
+    output = request.query_params.get('output', 'csv')
+    if output not in EXPORT_FORMATS:
+        raise ValidationError({'output': f"Expected one of: {', '.join(EXPORT_FORMATS)}."})
+    return output
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
-    # Queryset filters and orders Users 
-    queryset = User.objects.all().order_by('-date_joined')
+    # Queryset filters and orders Users, joining the nested profile in the same query
+    queryset = User.objects.select_related('profile').order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -111,34 +191,393 @@ class PortfolioViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows Portfolios to be viewed or edited.
     """
-    queryset = Portfolio.objects.all()
+    # The owner's profile names the currency portfolios are valued in
+    queryset = Portfolio.objects.select_related('user__profile').order_by('id')
     serializer_class = PortfolioSerializer
     permission_classes = [permissions.IsAuthenticated]
+    export_chunk_size = 2000
+    import_batch_size = 5000
+    holdings_ordering_fields = ('current_value', 'symbol', 'quantity', 'purchase_date', 'asset_class')
+
+    @cache_response('portfolios', per_user=True)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('portfolios', per_user=True)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @cache_response('portfolios', ALL_HOLDINGS, FX_RATES, per_user=True)
+    def valuations(self, request):
+        """
+        Values every listed portfolio in a constant number of queries, in its owner's base currency or
+        ?currency=, listing the currencies of holdings left out for lack of an FX rate. Accepts an
+        optional comma separated ?ids= filter.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by('pk')
+        ids = request.query_params.get('ids')
+        if ids:
+            try:
+                queryset = queryset.filter(pk__in=[int(pk) for pk in ids.split(',')])
+            except ValueError:
+                return Response({'ids': 'Expected a comma separated list of integers.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        page = self.paginate_queryset(queryset)
+        portfolios = list(page if page is not None else queryset)
+        currencies = {portfolio.pk: valuation_currency(request, portfolio.user) for portfolio in portfolios}
+        by_currency = defaultdict(list)
+        for portfolio_id, currency in currencies.items():
+            by_currency[currency].append(portfolio_id)
+        totals, unconverted = {}, {}
+        for currency, portfolio_ids in by_currency.items():
+            totals.update(portfolio_valuations(portfolio_ids, currency, unconverted))
+        valuations = [{'id': portfolio.pk, 'name': portfolio.name, 'total_value': totals[portfolio.pk],
+                       'currency': currencies[portfolio.pk], 'unconverted_currencies': unconverted.get(portfolio.pk, [])}
+                      for portfolio in portfolios]
+
+        serializer = PortfolioValuationSerializer(valuations, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    @cache_response('portfolio:{pk}', FX_RATES, per_user=True)
+    def holdings(self, request, pk=None):
+        """
+        Lists the portfolio's holdings of every asset class from a single UNION query, with amounts in
+        the owner's base currency or ?currency=. Filter with ?asset_class= (comma separated) and
+        ?symbol=, and sort with ?ordering=, e.g. -current_value.
+        """
+        portfolio = self.get_object()
+        currency = valuation_currency(request, portfolio.user)
+        asset_classes = request.query_params.get('asset_class')
+        if asset_classes:
+            asset_classes = {asset_class.strip().upper() for asset_class in asset_classes.split(',')}
+            if not asset_classes <= HOLDING_MODEL_BY_ASSET_CLASS.keys():
+                raise ValidationError({'asset_class': [f'Expected one of: {", ".join(HOLDING_MODEL_BY_ASSET_CLASS)}.']})
+        ordering = request.query_params.get('ordering', 'asset_class')
+        if ordering.lstrip('-') not in self.holdings_ordering_fields:
+            raise ValidationError({'ordering': [f'Expected one of: {", ".join(self.holdings_ordering_fields)}.']})
+
+        # Values quoted in different currencies are compared in the pivot currency. Ids are only unique
+        # per asset class, so (asset_class, id) breaks ties deterministically
+        by_value = ordering.lstrip('-') == 'current_value'
+        field = F('pivot_value' if by_value else ordering.lstrip('-'))
+        queryset = portfolio_holdings(portfolio, asset_classes or None, request.query_params.get('symbol'),
+                                      pivot_value=by_value).order_by(
+            field.desc(nulls_last=True) if ordering.startswith('-') else field.asc(nulls_last=True),
+            'asset_class', 'id')
+        paginator = StandardPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        convert_records(page, {'quote_currency': ['current_price', 'current_value'],
+                               'purchase_currency': ['initial_purchase_price']}, currency)
+        for holding in page:
+            holding['currency'] = currency
+        return paginator.get_paginated_response(PortfolioHoldingSerializer(page, many=True).data)
+
+    @action(detail=False, methods=['post'], url_path='holdings/import', url_name='holdings-import')
+    def import_holdings(self, request):
+        """
+        Bulk creates holdings of any asset class in the user's portfolios from a JSON list of rows or an
+        uploaded CSV/NDJSON `file`. Nothing is written if any row is rejected unless ?partial=true,
+        and rejections are reported by row number.
+        """
+        upload = request.FILES.get('file')
+        if upload is not None:
+            file_format = 'ndjson' if upload.name.endswith(('.ndjson', '.jsonl')) else 'csv'
+            records = read_records(io.TextIOWrapper(upload, encoding='utf-8', newline=''), file_format)
+        elif isinstance(request.data, list) and request.data:
+            records = request.data
+        else:
+            raise ValidationError({'non_field_errors': ['Expected a non-empty list of holdings or a file upload.']})
+        partial = request.query_params.get('partial', '').lower() in ('1', 'true', 'yes')
+
+        try:
+            created, errors = import_holdings(records, Portfolio.objects.filter(user=request.user),
+                                              batch_size=self.import_batch_size, partial=partial)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ValidationError({'file': [str(exc)]})
+        if errors and not partial:
+            return Response({'created': 0, 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created, 'errors': errors}, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], url_path='holdings/export', url_name='holdings-export')
+    def export_holdings(self, request, pk=None):
+        """
+        Streams every Stock, ETF and Cryptocurrency holding of the portfolio as CSV or NDJSON (?output=).
+        """
+        portfolio = self.get_object()
+        output = get_export_format(request)
+        header = ['asset_class', 'symbol', 'quantity', 'initial_purchase_price', 'current_price', 'purchase_date']
+        chunks = chain_chunks(*(
+            iterate_chunks(model.objects.filter(portfolio=portfolio),
+                           ['instrument__asset_class', model.symbol_field, 'quantity', 'initial_purchase_price',
+                            'instrument__last_price', 'purchase_date'],
+                           chunk_size=self.export_chunk_size)
+            for model in HOLDING_MODELS))
+        return streaming_export(header, chunks, output, f'portfolio-{portfolio.pk}-holdings')
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        The portfolio's value over ?range= (1D, 1W, 1M, 3M, 6M, 1Y or 5Y; 1M by default), read from the
+        coarsest snapshot rollup that has enough points. Points are the closing value of each bucket,
+        in the owner's base currency when it was recorded.
+        """
+        portfolio = self.get_object()
+        period = request.query_params.get('range', '1M').upper()
+        if period not in HISTORY_RANGES:
+            raise ValidationError({'range': [f'Expected one of: {", ".join(HISTORY_RANGES)}.']})
+        resolution = history_resolution(HISTORY_RANGES[period])
+        points = [{'time': at, 'value': value, 'low': low, 'high': high, 'currency': currency}
+                  for at, value, low, high, currency in portfolio_history(portfolio.pk, resolution, timezone.now() - HISTORY_RANGES[period])]
+        return Response({'portfolio': portfolio.pk, 'range': period, 'resolution': resolution,
+                         'points': ValuationPointSerializer(points, many=True).data})
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Risk and return statistics over the portfolio's price history between ?start= and ?end=.
+        Pass ?correlation=true to include the instrument correlation matrix.
+        """
+        portfolio = self.get_object()
+        try:
+            start = parse_query_datetime(request.query_params.get('start'))
+            end = parse_query_datetime(request.query_params.get('end'), end_of_day=True)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        include_correlation = request.query_params.get('correlation', '').lower() in ('1', 'true', 'yes')
+
+        positions = portfolio_positions([portfolio.pk])[portfolio.pk]
+        instruments = list(Instrument.objects.filter(pk__in=positions).order_by('pk'))
+        prices = get_price_cache().get_many(positions)
+        options = analytics_settings()
+
+        # The benchmark is loaded as an extra last column so it shares the same day grid
+        keys = [(instrument.asset_class, instrument.symbol) for instrument in instruments]
+        days, closes, has_history = load_daily_closes(get_price_history_store(),
+                                                      keys + [tuple(options['BENCHMARK'])], start, end)
+        # Closes and current prices are valued in one currency before they are aggregated. There is no
+        # FX history, so past closes use today's rates; a holding without a rate is left out (NaN)
+        currency = valuation_currency(request, portfolio.user)
+        currencies = [instrument.currency for instrument in instruments]
+        current_prices = convert_amounts([prices.get(instrument.pk) or 0 for instrument in instruments],
+                                         currencies, currency)
+        factors = convert_amounts(np.ones(len(instruments)), currencies, currency)
+        stats = portfolio_analytics(closes[:, :-1] * factors,
+                                    [positions[instrument.pk] for instrument in instruments],
+                                    np.nan_to_num(current_prices),
+                                    benchmark_closes=closes[:, -1] if has_history[-1] else None,
+                                    risk_free_rate=options['RISK_FREE_RATE'],
+                                    periods_per_year=options['PERIODS_PER_YEAR'],
+                                    correlation=include_correlation)
+
+        holdings = [{'instrument': instrument.pk, 'asset_class': instrument.asset_class,
+                     'symbol': instrument.symbol, 'quantity': positions[instrument.pk],
+                     'weight': weight, 'volatility': volatility, 'beta': beta}
+                    for instrument, weight, volatility, beta in zip(
+                        instruments, finite_or_none(stats['weights']),
+                        finite_or_none(stats['holding_volatility']), finite_or_none(stats['holding_beta']))]
+        data = {
+            'portfolio': portfolio.pk,
+            'currency': currency,
+            'start': from_epoch(days[0]) if len(days) else None,
+            'end': from_epoch(days[-1]) if len(days) else None,
+            'observations': stats['observations'],
+            'total_value': stats['total_value'],
+            'annual_return': stats['annual_return'],
+            'volatility': stats['volatility'],
+            'sharpe_ratio': stats['sharpe_ratio'],
+            'max_drawdown': stats['max_drawdown'],
+            'beta': stats['beta'],
+            'holdings': holdings,
+        }
+        if include_correlation:
+            data['correlation'] = {'instruments': [instrument.pk for instrument in instruments],
+                                   'matrix': finite_or_none(stats['correlation'])}
+        return Response(data)
+
+    @action(detail=True, methods=['get'])
+    @cache_response('portfolio:{pk}', FX_RATES, per_user=True)
+    def risk(self, request, pk=None):
+        """
+        Monte Carlo and historical Value-at-Risk and CVaR of the portfolio over ?horizon= days at
+        ?confidence=, from ?paths= simulated paths seeded with ?seed=. The return model is estimated from
+        the price history between ?start= and ?end=, the last LOOKBACK_DAYS days by default. Responses
+        are cached until the portfolio's holdings, prices or exchange rates change, and without a
+        response cache each process still reuses simulations of unchanged inputs. Losses are in the
+        owner's base currency or ?currency=.
+        """
+        portfolio = self.get_object()
+        options = risk_settings()
+        params = request.query_params
+        try:
+            horizon = int(params.get('horizon', options['HORIZON_DAYS']))
+            confidence = float(params.get('confidence', options['CONFIDENCE']))
+            paths = int(params.get('paths', options['PATHS']))
+            seed = int(params.get('seed', options['SEED']))
+            end = parse_query_datetime(params.get('end'), end_of_day=True)
+            start = (parse_query_datetime(params.get('start'))
+                     or (end or timezone.now()) - timedelta(days=options['LOOKBACK_DAYS']))
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= horizon <= options['MAX_HORIZON_DAYS']:
+            raise ValidationError({'horizon': [f'Expected 1 to {options["MAX_HORIZON_DAYS"]} days.']})
+        if not 0 < confidence < 1:
+            raise ValidationError({'confidence': ['Expected a fraction between 0 and 1.']})
+        if not 1 <= paths <= options['MAX_PATHS']:
+            raise ValidationError({'paths': [f'Expected 1 to {options["MAX_PATHS"]} paths.']})
+
+        positions = portfolio_positions([portfolio.pk])[portfolio.pk]
+        instruments = list(Instrument.objects.filter(pk__in=positions).order_by('pk'))
+        prices = get_price_cache().get_many(positions)
+        _, closes, has_history = load_daily_closes(
+            get_price_history_store(), [(instrument.asset_class, instrument.symbol) for instrument in instruments],
+            start, end)
+        currency = valuation_currency(request, portfolio.user)
+        values = convert_amounts([positions[instrument.pk] * (prices.get(instrument.pk) or 0) for instrument in instruments],
+                                 [instrument.currency for instrument in instruments], currency)
+        data = portfolio_risk(closes, np.nan_to_num(values), horizon=horizon, confidence=confidence, paths=paths,
+                              seed=seed)
+        data.update({
+            'portfolio': portfolio.pk,
+            'currency': currency,
+            'horizon': horizon,
+            'confidence': confidence,
+            'paths': paths,
+            'seed': seed,
+            'without_history': [instrument.pk for instrument, found in zip(instruments, has_history) if not found],
+        })
+        return Response(data)
+
+    @action(detail=True, methods=['get', 'put'])
+    def targets(self, request, pk=None):
+        """
+        The portfolio's target allocation. PUT replaces every target with a list of instrument or asset
+        class weights summing to 1, or with an empty list to clear them.
+        """
+        portfolio = self.get_object()
+        if request.method == 'PUT':
+            if portfolio.user_id != request.user.pk:
+                raise PermissionDenied('Only the owner of a portfolio can set its targets.')
+            if not isinstance(request.data, list):
+                raise ValidationError({'non_field_errors': ['Expected a list of targets.']})
+            serializer = TargetAllocationSerializer(data=request.data, many=True)
+            serializer.is_valid(raise_exception=True)
+            targets = serializer.validated_data
+            keys = [target.get('instrument') or target['asset_class'] for target in targets]
+            if len(set(keys)) != len(keys):
+                raise ValidationError({'non_field_errors': ['Each instrument and asset class takes one target.']})
+            total = sum(target['weight'] for target in targets)
+            if targets and abs(total - 1) > WEIGHT_TOLERANCE:
+                raise ValidationError({'weight': [f'Expected weights summing to 1, got {total}.']})
+            with transaction.atomic():
+                portfolio.targets.all().delete()
+                TargetAllocation.objects.bulk_create([TargetAllocation(portfolio=portfolio, **target)
+                                                      for target in targets])
+        return Response(TargetAllocationSerializer(portfolio.targets.order_by('pk'), many=True).data)
+
+    @action(detail=False, methods=['post'])
+    def rebalance(self, request):
+        """
+        Proposes the orders bringing the user's portfolios, or the listed `portfolios`, to their targets,
+        all computed in one batch; staff may rebalance anyone's. With `execute` the orders are filled in
+        a single transaction. Portfolios whose targets cannot be met are listed as unreachable.
+        """
+        serializer = RebalanceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        portfolios = Portfolio.objects.all() if request.user.is_staff else Portfolio.objects.filter(user=request.user)
+        if 'portfolios' in serializer.validated_data:
+            portfolios = portfolios.filter(pk__in=serializer.validated_data['portfolios'])
+        # Planned in this process: forking workers from a threaded server would copy its locks and connections
+        orders, unreachable = rebalance_portfolios(portfolios.values_list('pk', flat=True), processes=1)
+        if not serializer.validated_data['execute']:
+            return Response({'orders': orders, 'unreachable': unreachable})
+
+        try:
+            trades = execute_rebalance(orders)
+        except DjangoValidationError as exc:
+            return Response({'errors': exc.message_dict}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'orders': orders, 'unreachable': unreachable,
+                         'trades': VirtualTradeSerializer(trades, many=True).data}, status=status.HTTP_201_CREATED)
+
+class FXRateViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows the latest exchange rates to be viewed.
+    """
+    queryset = FXRate.objects.all().order_by('currency')
+    serializer_class = FXRateSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-class StockViewSet(viewsets.ModelViewSet): 
+class InstrumentViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows Instruments, their latest quotes and price history to be viewed.
+    """
+    queryset = Instrument.objects.all().order_by('asset_class', 'symbol')
+    serializer_class = InstrumentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['asset_class', 'symbol']
+    pagination_class = StandardPagination
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Returns the instrument's price history between ?start= and ?end= (ISO dates or datetimes).
+        With ?interval= (e.g. 1h, 1d) ticks are downsampled to OHLC bars.
+        Only the requested range is read from the history file.
+        """
+        instrument = self.get_object()
+        try:
+            start = parse_query_datetime(request.query_params.get('start'))
+            end = parse_query_datetime(request.query_params.get('end'), end_of_day=True)
+            interval = request.query_params.get('interval')
+            seconds = parse_interval(interval) if interval else None
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        series = get_price_history_store().history(instrument.asset_class, instrument.symbol,
+                                                   start, end, seconds)
+        if seconds is None:
+            points = [{'time': from_epoch(t), 'price': p} for t, p in series.tolist()]
+        else:
+            points = [{'time': from_epoch(t), 'open': o, 'high': h, 'low': l, 'close': c}
+                      for t, o, h, l, c in series.tolist()]
+        return Response({'instrument': instrument.pk, 'symbol': instrument.symbol,
+                         'interval': interval, 'points': points})
+
+class StockViewSet(ReplicaReadMixin, FastReadMixin, KeysetPaginationMixin, viewsets.ModelViewSet): 
     """
     API endpoint that allows Stocks to be viewed or edited.
     """
-    queryset = Stock.objects.all()
+    queryset = Stock.objects.all().order_by('id')
+    keyset_ordering = ('id',)
+    fast_read = True
     serializer_class = StockSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['portfolio', 'ticker_symbol']
     pagination_class = StandardPagination
 
-class CryptocurrencyViewSet(viewsets.ModelViewSet):
+class CryptocurrencyViewSet(ReplicaReadMixin, FastReadMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Cryptocurrencies to be viewed or edited.
     """
-    queryset = Cryptocurrency.objects.all()
+    queryset = Cryptocurrency.objects.all().order_by('id')
+    keyset_ordering = ('id',)
+    fast_read = True
     serializer_class = CryptocurrencySerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class ETFViewSet(viewsets.ModelViewSet):
+class ETFViewSet(ReplicaReadMixin, FastReadMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows ETFs to be viewed or edited.
     """
-    queryset = ETF.objects.all() 
+    queryset = ETF.objects.all().order_by('id')
+    keyset_ordering = ('id',)
+    fast_read = True
     serializer_class = ETFSerializer
     permission_classes = [permissions.IsAuthenticated]
     
@@ -150,6 +589,14 @@ class BlogPostViewSet(viewsets.ModelViewSet):
     serializer_class = BlogPostSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    @cache_response('blogpost')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('blogpost')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 class FAQViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows FAQs to be viewed.
@@ -157,12 +604,187 @@ class FAQViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = FAQ.objects.all()
     serializer_class = FAQSerializer
     permission_classes = [permissions.AllowAny]
+
+    @cache_response('faq')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('faq')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
-class VirtualTradeViewSet(viewsets.ModelViewSet):
+class VirtualTradeViewSet(ReplicaReadMixin, FastReadMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
-    API endpoint that allows virtual trades to be viewed or edited
+    API endpoint that allows the current user's virtual trades to be viewed or submitted.
+    Submitted trades are executed against the portfolio's holdings, so executed trades cannot be edited.
+    Pass ?pagination=cursor for keyset pagination over the (user, trade_date, id) index.
     """
-    queryset = VirtualTrade.objects.all()
+    # The serializer reads the username and nests the instrument, so both are joined up front
+    queryset = VirtualTrade.objects.select_related('user', 'instrument')
     serializer_class = VirtualTradeSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = LargeResultsSetPagination
\ No newline at end of file
+    pagination_class = LargeResultsSetPagination
+    keyset_ordering = ('-trade_date', '-id')
+    fast_read = True
+    http_method_names = ['get', 'post', 'head', 'options']
+    max_batch_size = 1000
+    export_chunk_size = 2000
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = dict(serializer.validated_data, portfolio=serializer.validated_data['portfolio'].pk,
+                     instrument=serializer.validated_data['instrument'].pk)
+        try:
+            trade, = execute_orders(request.user, [order])
+        except DjangoValidationError as exc:
+            raise ValidationError({'non_field_errors': exc.message_dict[0]})
+        return Response(self.get_serializer(trade).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Streams the user's full trade history, newest first, as CSV or NDJSON (?output=).
+        """
+        output = get_export_format(request)
+        header = ['id', 'trade_date', 'trade_type', 'portfolio', 'asset_class', 'symbol',
+                  'trade_quantity', 'trade_price']
+        chunks = iterate_chunks(VirtualTrade.objects.filter(user=request.user),
+                                ['pk', 'trade_date', 'trade_type', 'portfolio', 'instrument__asset_class',
+                                 'instrument__symbol', 'trade_quantity', 'trade_price'],
+                                chunk_size=self.export_chunk_size, descending=True)
+        return streaming_export(header, chunks, output, 'trades')
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Executes a list of orders in a single transaction. Either every order fills or none do,
+        and rejections are reported by order index.
+        """
+        if not isinstance(request.data, list) or not 0 < len(request.data) <= self.max_batch_size:
+            raise ValidationError({'non_field_errors': [f'Expected a list of 1 to {self.max_batch_size} orders.']})
+        serializer = TradeOrderSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            trades = execute_orders(request.user, serializer.validated_data)
+        except DjangoValidationError as exc:
+            return Response({'errors': exc.message_dict}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(trades, many=True).data, status=status.HTTP_201_CREATED)
+
+class PositionViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows the current user's positions and P&L to be viewed.
+    """
+    queryset = Position.objects.select_related('instrument').order_by('instrument')
+    serializer_class = PositionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['instrument']
+    pagination_class = StandardPagination
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+
+# Async quote views
+# Plain Django async views, so the concurrent provider calls share the ASGI event loop. Like DRF views
+# they are exempt from CsrfViewMiddleware, and session authentication checks the CSRF token instead.
+@sync_to_async
+def authenticate(request):
+    """
+    Resolves the user with the API's authentication classes, which need the database.
+    Raises APIException when credentials are invalid or a session request lacks its CSRF token.
+    """
+    user = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+    return user if user.is_authenticated else None
+
+
+def error_response(exc):
+    return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+
+
+def quote_service_or_error():
+    """
+    Returns (service, None), or (None, a 503 response) when QUOTE_PROVIDERS is empty.
+    """
+    try:
+        return get_quote_service(), None
+    except ImproperlyConfigured:
+        return None, JsonResponse({'detail': 'No quote provider is configured.'}, status=503)
+
+
+def parse_instruments(value):
+    """
+    Parses a comma separated list of ASSET_CLASS:SYMBOL pairs.
+    """
+    asset_classes = {asset_class for asset_class, _ in Instrument.ASSET_CLASS_CHOICES}
+    instruments = []
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        asset_class, _, symbol = item.partition(':')
+        if asset_class.upper() not in asset_classes or not symbol:
+            raise ValueError(f"Invalid instrument {item!r}, expected ASSET_CLASS:SYMBOL.")
+        instruments.append((asset_class.upper(), symbol))
+    return instruments
+
+
+def quote_rows(quotes):
+    return [{'asset_class': asset_class, 'symbol': symbol, 'price': price, 'quoted_at': quoted_at}
+            for asset_class, symbol, price, quoted_at in quotes]
+
+
+# Django 4.1's require_http_methods does not wrap async views, so the methods are checked inline
+async def live_quotes(request):
+    """
+    Quotes ?symbols=STOCK:AAPL,CRYPTO:BTC from the providers concurrently, without storing them.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        user = await authenticate(request)
+    except APIException as exc:
+        return error_response(exc)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    try:
+        instruments = parse_instruments(request.GET.get('symbols', ''))
+    except ValueError as exc:
+        return JsonResponse({'symbols': [str(exc)]}, status=400)
+    if not instruments:
+        return JsonResponse({'symbols': ['This parameter is required.']}, status=400)
+    service, error = quote_service_or_error()
+    if error is not None:
+        return error
+    quotes, missing = await service.fetch_quotes(instruments)
+    return JsonResponse({'quotes': quote_rows(quotes), 'missing': [f'{a}:{s}' for a, s in missing]},
+                        encoder=DjangoJSONEncoder)
+
+
+async def refresh_quotes(request):
+    """
+    Staff only. Refreshes the latest price of every instrument (or ?symbols=) in one concurrent sweep.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        user = await authenticate(request)
+    except APIException as exc:
+        return error_response(exc)
+    if user is None or not user.is_staff:
+        return JsonResponse({'detail': 'You do not have permission to perform this action.'}, status=403)
+    try:
+        instruments = parse_instruments(request.GET['symbols']) if 'symbols' in request.GET else None
+    except ValueError as exc:
+        return JsonResponse({'symbols': [str(exc)]}, status=400)
+    service, error = quote_service_or_error()
+    if error is not None:
+        return error
+    updated, missing = await service.refresh(instruments)
+    return JsonResponse({'updated': updated, 'missing': [f'{a}:{s}' for a, s in missing]})
+
+
+# Django 4.1's csrf_exempt does not wrap async views either, so the flag it sets is set directly
+live_quotes.csrf_exempt = True
+refresh_quotes.csrf_exempt = True
@@ -10,7 +10,23 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.urls import re_path
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'investor_portfolio.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Setup.settings')
 
-application = get_asgi_application()
+# Set up Django before importing anything that loads models
+django_application = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+from Backend.routing import stream_urlpatterns, websocket_urlpatterns
+
+application = ProtocolTypeRouter({
+    'http': URLRouter([
+        re_path(r'^stream/', AuthMiddlewareStack(URLRouter(stream_urlpatterns))),
+        re_path(r'', django_application),
+    ]),
+    'websocket': AllowedHostsOriginValidator(AuthMiddlewareStack(URLRouter(websocket_urlpatterns))),
+})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Backend.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,6 +95,194 @@ DATABASES = {
     }
 }
 
+# DOCUMENT_STORE=sqlite runs the document store on a local SQLite file instead, to develop and
+# test without MongoDB
+if os.environ.get('DOCUMENT_STORE') == 'sqlite':
+    DATABASES['mongo'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'documents.sqlite3',
+    }
+
+
+# Storage routing (Backend/routers.py, Backend/archive.py)
+# Trade events, price ticks and valuation snapshots are appended to DOCUMENT_ALIAS in bulk inserts
+# of BATCH_SIZE rows; users, portfolios, holdings and trades stay on 'default'. Trade events copy
+# VirtualTrade rows, so they add document writes without removing any from 'default'. List endpoints
+# read from one of READ_REPLICAS, e.g. a 'replica' database with 'TEST': {'MIRROR': 'default'}.
+
+DATABASE_ROUTERS = ['Backend.routers.StorageRouter']
+
+STORAGE_ROUTING = {
+    'DOCUMENT_ALIAS': 'mongo',
+    'DOCUMENT_MODELS': ['Backend.TradeEvent', 'Backend.PriceTick', 'Backend.ValuationSnapshot'],
+    'READ_REPLICAS': [],
+    'BATCH_SIZE': 1000,
+}
+
+
+# Latest price cache (Backend/pricecache.py)
+# Prices are kept in an in-process LRU for TIMEOUT seconds. Set CACHE_ALIAS to one of CACHES
+# to share them between processes as well.
+
+PRICE_CACHE = {
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 50000,
+    'CACHE_ALIAS': None,
+}
+
+
+# Price history (Backend/timeseries.py)
+# Directory holding one append-only tick file per instrument.
+
+PRICE_HISTORY_ROOT = BASE_DIR / 'price_history'
+
+
+# Portfolio analytics (Backend/analytics.py)
+# BENCHMARK is the (asset_class, symbol) instrument used for beta.
+
+ANALYTICS = {
+    'BENCHMARK': ('ETF', 'SPY'),
+    'RISK_FREE_RATE': 0.0,
+    'PERIODS_PER_YEAR': 252,
+}
+
+
+# Quote providers (Backend/quotes.py)
+# Providers are tried in order for the asset classes they support. QUOTE_API_URL (and QUOTE_API_KEY)
+# configure Backend.quotes.HTTPQuoteProvider for a real feed. Without a provider, price_worker fails
+# and /quotes/ answers 503 Service Unavailable; Backend.quotes.FakeQuoteProvider quotes deterministic
+# made-up prices offline and is only meant for development and tests.
+
+QUOTE_PROVIDERS = []
+if os.environ.get('QUOTE_API_URL'):
+    QUOTE_PROVIDERS.append({
+        'BACKEND': 'Backend.quotes.HTTPQuoteProvider',
+        'OPTIONS': {'url': os.environ['QUOTE_API_URL'], 'api_key': os.environ.get('QUOTE_API_KEY'),
+                    'max_batch_size': 100, 'rate_limit': 50, 'burst': 50},
+    })
+
+QUOTE_SERVICE = {
+    'TIMEOUT': 5.0,
+    'RETRIES': 2,
+    'BACKOFF': 0.2,
+}
+
+
+# Price refresh worker (Backend/scheduler.py, manage.py price_worker)
+# Instruments held in a portfolio or traded in the last TRADED_WITHIN_DAYS are refreshed every
+# HOT_INTERVAL seconds and the rest every IDLE_INTERVAL. At most MAX_IN_FLIGHT batches of
+# BATCH_SIZE instruments are fetched at once on WORKERS threads.
+
+PRICE_WORKER = {
+    'HOT_INTERVAL': 15,
+    'IDLE_INTERVAL': 600,
+    'TRADED_WITHIN_DAYS': 7,
+    'WORKERS': 8,
+    'BATCH_SIZE': 100,
+    'MAX_IN_FLIGHT': 16,
+    'RESCAN_INTERVAL': 60,
+}
+
+
+# Portfolio value history (Backend/snapshots.py, manage.py snapshot_portfolios)
+# Every portfolio is snapshotted every INTERVAL seconds, and after trades and price changes with
+# RECORD_ON_CHANGE. Raw points are rolled up into minute, hour, day and month points; each resolution
+# is deleted RETENTION seconds after being rolled up, or kept forever with None.
+
+SNAPSHOTS = {
+    'INTERVAL': 60,
+    'RECORD_ON_CHANGE': False,
+    'RETENTION': {'raw': 86400, 'minute': 7 * 86400, 'hour': 90 * 86400, 'day': None, 'month': None},
+    'MIN_POINTS': 50,
+    'BATCH_SIZE': 1000,
+}
+
+
+# Value-at-Risk (Backend/risk.py)
+# Monte Carlo paths are drawn in shards of SHARD_PATHS seeded from SEED, on PROCESSES worker
+# processes when above 1; the return model uses the last LOOKBACK_DAYS days of price history.
+# Each process reuses its last RESULT_CACHE_SIZE results for identical inputs, with or without a
+# response cache.
+
+RISK = {
+    'CONFIDENCE': 0.99,
+    'HORIZON_DAYS': 1,
+    'MAX_HORIZON_DAYS': 252,
+    'LOOKBACK_DAYS': 365,
+    'PATHS': 10000,
+    'MAX_PATHS': 100000,
+    'SHARD_PATHS': 10000,
+    'SEED': 0,
+    'PROCESSES': 1,
+    'RESULT_CACHE_SIZE': 128,
+}
+
+
+# Rebalancing (Backend/rebalancing.py, manage.py rebalance_portfolios)
+# Portfolios are rebalanced towards their targets CHUNK_SIZE at a time. manage.py rebalance_portfolios
+# computes them on PROCESSES worker processes when above 1; the API always plans in-process.
+# Orders under MIN_TRADE_VALUE, in the FX pivot currency, or MIN_TRADE_QUANTITY units are not proposed.
+
+REBALANCING = {
+    'MIN_TRADE_VALUE': '10.00',
+    'MIN_TRADE_QUANTITY': 1,
+    'CHUNK_SIZE': 1000,
+    'PROCESSES': 1,
+}
+
+
+# Currency conversion (Backend/fx.py)
+# FX rates quote every currency in PIVOT. Valuations are in the currency asked for with ?currency=,
+# else the user's profile base currency, else BASE_CURRENCY. The conversion matrix is reused per
+# process while the response cache's FX version is unchanged, and loaded per use without one.
+
+FX = {
+    'PIVOT': 'USD',
+    'BASE_CURRENCY': 'USD',
+}
+
+
+# Push streams (Backend/streaming.py, Backend/consumers.py)
+# Portfolio value and price updates are merged per subscriber over COALESCE_WINDOW seconds.
+# The in-memory channel layer only reaches streams of the same process; use channels_redis so
+# price writes from price_worker or other processes reach every subscriber.
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+STREAMING = {
+    'COALESCE_WINDOW': 1.0,
+    'HEARTBEAT': 15.0,
+}
+
+
+# Response cache (Backend/responsecache.py)
+# Rendered responses of cached views and the versions that invalidate them live in CACHE_ALIAS.
+# Caching is off until CACHE_ALIAS names one of CACHES shared by all processes, such as Redis or
+# Memcached, so writes in one process invalidate responses cached by the others. A process-local
+# cache would keep serving stale responses after writes in price_worker or other web processes.
+
+RESPONSE_CACHE = {
+    'CACHE_ALIAS': None,
+    'TIMEOUT': 300,
+}
+
+
+# Request profiling (Backend/profiling.py)
+# Adds Server-Timing headers and per-route histograms served on /metrics. Set PROFILE_SAMPLE_RATE
+# and PROFILE_DIR to run that fraction of requests under cProfile and keep the PROFILE_KEEP slowest.
+
+PROFILING = {
+    'SERVER_TIMING': True,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_KEEP': 10,
+    'PROFILE_DIR': BASE_DIR / 'profiles',
+    'METRICS_TOKEN': None,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators